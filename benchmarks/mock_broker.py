@@ -0,0 +1,166 @@
+"""
+Local stand-ins for the broker APIs the service talks to:
+
+- stocksdeveloper: /trading/placeRegularOrder and /trading/readPlatformMargins
+- users service:   /users
+- SmartAPI:        login, profile, token refresh, searchScrip and market quote
+
+Every endpoint sleeps for `latency` seconds and fails with probability
+`error_rate`, so the hot paths can be measured under realistic round-trips.
+The server runs on its own event loop in a background thread; SmartConnect
+makes blocking calls that would otherwise deadlock against an in-loop server.
+"""
+import asyncio
+import json
+import random
+import threading
+from collections import Counter
+from aiohttp import web
+
+SMARTAPI_PREFIX = "/rest"
+
+
+class MockBroker:
+    def __init__(self, accounts: int = 10, latency: float = 0.0, error_rate: float = 0.0, fund: float = 500000, seed: int = 0):
+        self.accounts = accounts
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fund = fund
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.url = None
+        self._order_ids = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    # -- lifecycle --
+
+    def start(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), name="mock-broker", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        started.set()
+        self._loop.run_forever()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/trading/placeRegularOrder", self.place_order)
+        app.router.add_get("/trading/readPlatformMargins", self.margins)
+        app.router.add_get("/users", self.users)
+        app.router.add_post(SMARTAPI_PREFIX + "/auth/angelbroking/user/v1/loginByPassword", self.login)
+        app.router.add_post(SMARTAPI_PREFIX + "/auth/angelbroking/jwt/v1/generateTokens", self.login)
+        app.router.add_get(SMARTAPI_PREFIX + "/secure/angelbroking/user/v1/getProfile", self.profile)
+        app.router.add_post(SMARTAPI_PREFIX + "/secure/angelbroking/order/v1/searchScrip", self.search_scrip)
+        app.router.add_post(SMARTAPI_PREFIX + "/secure/angelbroking/market/v1/quote", self.quote)
+        return app
+
+    # -- helpers --
+
+    async def respond(self, name):
+        """Applies latency and error injection; returns an error response or None."""
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.calls[name + ".error"] += 1
+            return web.json_response({'status': False, 'message': 'injected error', 'errorcode': 'MOCK'})
+        return None
+
+    @staticmethod
+    def token_for(symbol: str) -> str:
+        return str(10000 + sum(ord(c) * (i + 1) for i, c in enumerate(symbol)) % 90000)
+
+    def account_list(self):
+        return [
+            {
+                'pseudoAccountName': f'ACC{i:05d}',
+                'fund': self.fund,
+                'accountId': f'ID{i:05d}',
+                'stoplosstype': 'percentage' if i % 2 else 'number',
+                'stoploss': 1 if i % 2 else 1000,
+            }
+            for i in range(self.accounts)
+        ]
+
+    # -- stocksdeveloper --
+
+    async def place_order(self, request):
+        error = await self.respond("place_order")
+        if error:
+            return error
+        self._order_ids += 1
+        return web.json_response({'status': True, 'result': f'MOCK{self._order_ids}'})
+
+    async def margins(self, request):
+        error = await self.respond("margins")
+        if error:
+            return error
+        return web.json_response({'status': True, 'result': [{'category': 'EQUITY', 'funds': self.fund}]})
+
+    # -- users service --
+
+    async def users(self, request):
+        self.calls["users"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'accountslist': self.account_list()})
+
+    # -- SmartAPI --
+
+    async def login(self, request):
+        self.calls["login"] += 1
+        return web.json_response({'status': True, 'data': {'jwtToken': 'jwt', 'refreshToken': 'refresh', 'feedToken': 'feed'}})
+
+    async def profile(self, request):
+        return web.json_response({'status': True, 'data': {'clientcode': 'MOCK'}})
+
+    async def search_scrip(self, request):
+        error = await self.respond("search_scrip")
+        if error:
+            return error
+        body = json.loads(await request.text())
+        symbol = body['searchscrip']
+        return web.json_response({'status': True, 'data': [
+            {'exchange': body['exchange'], 'tradingsymbol': symbol, 'symboltoken': self.token_for(symbol)}
+        ]})
+
+    async def quote(self, request):
+        error = await self.respond("quote")
+        if error:
+            return error
+        body = json.loads(await request.text())
+        fetched = [
+            {'exchange': exchange, 'symbolToken': token, 'tradingSymbol': token, 'ltp': self.price_for(token)}
+            for exchange, tokens in body['exchangeTokens'].items() for token in tokens
+        ]
+        return web.json_response({'status': True, 'data': {'fetched': fetched, 'unfetched': []}})
+
+    def price_for(self, token: str) -> float:
+        """Prices hover around 100 so seeded stops on both sides get crossed."""
+        return round(100 + self.random.uniform(-5, 5), 2)
@@ -0,0 +1,208 @@
+"""
+Replays recorded LTP ticks through the stop-loss monitor's evaluation path,
+offline, against a seeded set of open trades.
+
+    python -m benchmarks.replay ticks.csv --trades trades.json
+    python -m benchmarks.replay 2024-*.parquet --seed-trades 50000 --speed 60
+
+Tick files are CSV or Parquet with `timestamp`, `symbol` and `ltp` columns
+(`price` is accepted for `ltp`); timestamps are epoch seconds or ISO 8601, and
+files are replayed in the order given. Parquet needs pyarrow, which is not a
+service dependency.
+
+Each tick goes through rms.evaluate_stop_losses, the same call the streaming
+monitor makes. Exits are placed on StubOrderSink, which accepts every order
+immediately, so confirmed exits close trades in the store exactly as in
+production. `--speed 0` (the default) replays as fast as possible; `--speed N`
+keeps N times the recorded pace.
+
+Open trades come from `--trades`, a JSON file in the trades.json format
+({symbol: [trade, ...]}), or `--seed-trades N`, N trades spread over the
+symbols in the first ticks with stops within `--stop-band` of their first price.
+
+The report has ticks/sec, triggered exits and per-tick evaluation latency, and
+with `--exits` every exit order is written as a JSON line for checking stop-loss
+behaviour.
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.run import reset_trade_state, summarize
+
+
+def parse_timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def read_csv_ticks(path):
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            ltp = row.get('ltp') or row.get('price')
+            yield parse_timestamp(row['timestamp']), row['symbol'], float(ltp)
+
+
+def read_parquet_ticks(path, batch_size: int = 65536):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Replaying Parquet tick files needs pyarrow: pip install pyarrow") from None
+    parquet = pq.ParquetFile(path)
+    price_column = 'ltp' if 'ltp' in parquet.schema_arrow.names else 'price'
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=['timestamp', 'symbol', price_column]):
+        columns = batch.to_pydict()
+        for timestamp, symbol, ltp in zip(columns['timestamp'], columns['symbol'], columns[price_column]):
+            yield parse_timestamp(timestamp), symbol, float(ltp)
+
+
+def read_ticks(paths):
+    """(timestamp, symbol, ltp) from every file in turn, streamed rather than loaded."""
+    for path in paths:
+        if path.endswith(('.parquet', '.pq')):
+            yield from read_parquet_ticks(path)
+        else:
+            yield from read_csv_ticks(path)
+
+
+class StubOrderSink:
+    """Stands in for TradingService when exiting: accepts every RMS order and records it."""
+
+    def __init__(self):
+        self.orders = []
+        self.tick = None  # (timestamp, symbol, ltp) being replayed, stamped on each order
+
+    async def place_rms_order(self, trade_request):
+        self.orders.append({
+            'timestamp': self.tick[0] if self.tick else None,
+            'account': trade_request.pseudoAccount,
+            'symbol': trade_request.symbol,
+            'side': trade_request.tradeType.value,
+            'quantity': trade_request.quantity,
+            'price': trade_request.price,
+        })
+        return {'status': True, 'data': {'order_id': f'REPLAY{len(self.orders)}'}}
+
+
+def seed_trades(first_ticks, count: int, stop_band: float = 0.02, seed: int = 0):
+    """`count` open trades spread over the symbols of `first_ticks`, with stops within `stop_band` of each first price."""
+    rng = random.Random(seed)
+    first_prices = {}
+    for _, symbol, ltp in first_ticks:
+        first_prices.setdefault(symbol, ltp)
+    symbols = list(first_prices)
+    trades = {}
+    for i in range(count if symbols else 0):
+        symbol = symbols[i % len(symbols)]
+        price = first_prices[symbol]
+        side = 'BUY' if i % 2 else 'SELL'
+        offset = price * rng.uniform(0, stop_band)
+        trades.setdefault(symbol, []).append({
+            'pseudo_account': f'REPLAY{i:06d}', 'falcon_account': f'ID{i:06d}', 'symbol': symbol.lower(),
+            'order_id': f'SEED{i}', 'quantity': 1, 'price': price, 'balance': 100000,
+            'trade_type': side, 'stoploss_price': price - offset if side == 'BUY' else price + offset,
+        })
+    return trades
+
+
+async def replay(ticks, open_trades, speed: float = 0, workdir: str = None):
+    """
+    Evaluates every tick against `open_trades` ({symbol: [trade dicts]}) and
+    returns the report and the exit orders placed.
+    """
+    import rms
+    from exit_executor import ExitExecutor
+
+    reset_trade_state(workdir or tempfile.mkdtemp(prefix='falcon-replay-'), 'replay.journal')
+    rms.add_successful_trades(open_trades)
+    seeded = rms.get_trade_store().open_count
+
+    sink = StubOrderSink()
+    exits = ExitExecutor(sink, on_confirmed=rms.exit_confirmed)
+    latencies = []
+    replay_start = recorded_start = None
+    started = time.perf_counter()
+    for tick in ticks:
+        timestamp, symbol, ltp = tick
+        if speed:
+            if recorded_start is None:
+                replay_start, recorded_start = time.perf_counter(), timestamp
+            delay = (timestamp - recorded_start) / speed - (time.perf_counter() - replay_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sink.tick = tick
+        t0 = time.perf_counter()
+        rms.evaluate_stop_losses(exits, symbol, ltp)
+        latencies.append(time.perf_counter() - t0)
+        if exits.in_flight:
+            await asyncio.sleep(0)  # let the exits run and confirm, as between live ticks
+    await exits.drain()
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'scenario': 'replay',
+        'ticks': len(latencies),
+        'speed': speed or None,
+        'elapsed_s': round(elapsed, 3),
+        'ticks_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'open_trades': seeded,
+        'triggers': len(sink.orders),
+        'remaining_trades': rms.get_trade_store().open_count,
+        **{'tick_' + key: value for key, value in summarize(latencies).items()},
+    }
+    rms.close_trade_store()
+    return report, sink.orders
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('ticks', nargs='+', help='CSV or Parquet tick files, replayed in order')
+    parser.add_argument('--trades', help='open trades to monitor, in trades.json format')
+    parser.add_argument('--seed-trades', type=int, default=1000, help='generated open trades when --trades is not given')
+    parser.add_argument('--stop-band', type=float, default=0.02, help='max distance of generated stops from the first price')
+    parser.add_argument('--speed', type=float, default=0, help='multiple of the recorded pace; 0 replays as fast as possible')
+    parser.add_argument('--exits', help='write every exit order to this file as JSON lines')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    ticks = read_ticks(args.ticks)
+    if args.trades:
+        with open(args.trades) as f:
+            open_trades = json.load(f)
+    else:
+        first_ticks = list(itertools.islice(ticks, 10000))  # enough to see every traded symbol's opening price
+        open_trades = seed_trades(first_ticks, args.seed_trades, args.stop_band)
+        ticks = itertools.chain(first_ticks, ticks)
+
+    report, orders = asyncio.run(replay(ticks, open_trades, args.speed))
+    if args.exits:
+        with open(args.exits, 'w') as f:
+            f.writelines(json.dumps(order) + '\n' for order in orders)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
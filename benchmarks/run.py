@@ -0,0 +1,326 @@
+"""
+End-to-end benchmarks for the order and stop-loss hot paths, run against MockBroker.
+
+    python -m benchmarks.run --accounts 1,10,100,1000 --open-trades 10000,50000 --latency 0.02
+
+Scenarios:
+
+- webhook: POSTs signals to /opentrade through the full FastAPI app and reports
+  p50/p95/p99 latency and orders placed per second, per account count.
+- monitor: seeds N open trades and times poll_tick (batched price fetch, stop
+  index lookup, exit submission), per open-trade count, along with the memory
+  held per open trade by the trade store and the stop-loss index.
+- startup: median cold `import main` in a fresh interpreter and app lifespan
+  start-up time.
+- instrumentation: per-sample cost of the Prometheus metrics recorded on the
+  hot paths and the cost of one /metrics scrape, to compare against the
+  webhook and monitor latencies above.
+
+Results are printed (or written with --output) as JSON so runs can be diffed.
+To replay recorded price ticks through the monitor instead, see benchmarks/replay.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.mock_broker import MockBroker
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def configure_environment(broker: MockBroker, workdir: str, rate_limits: bool = False):
+    os.environ.update({
+        'USERS_URL': f'{broker.url}/users',
+        'STOCKS_DEVELOPER_URL': broker.url,
+        'SMART_API_ROOT': broker.url,
+        'SMART_API_USER': 'bench',
+        'SMART_API_PASS': 'bench',
+        'SMART_API_KEY': 'bench',
+        'TOTP_KEY': 'JBSWY3DPEHPK3PXP',
+        'STOCK_DEVELOPERS_API_KEY': 'bench',
+        'TRADE_STORE_PATH': os.path.join(workdir, 'trades.journal'),
+    })
+    if not rate_limits:
+        # the mock broker does not throttle, so by default measure the service without its limits
+        os.environ.update({'ORDER_RATE_LIMIT': '0', 'MARGIN_RATE_LIMIT': '0', 'QUOTE_RATE_LIMIT': '0', 'SEARCH_RATE_LIMIT': '0'})
+    reload_settings()
+
+
+def reload_settings():
+    """Makes an already imported app pick up the current environment."""
+    import utils
+    utils.setting.cache_clear()
+    utils.smartApi = None  # recreated against the current SMART_API_ROOT on next use
+    utils.broker_scheduler.configure(utils.setting())
+    utils.broker_session.configure(utils.setting())
+
+
+def reset_trade_state(workdir: str, name: str):
+    """Points the RMS layer at a fresh, empty trade store."""
+    import rms
+    from stoploss_index import StopLossIndex
+    from trade_store import create_trade_store
+
+    rms.close_trade_store()
+    rms.stoploss_index = StopLossIndex()
+    rms.trade_store = create_trade_store('journal', os.path.join(workdir, name))
+    rms.trade_store.load()
+
+
+async def bench_webhook(broker: MockBroker, workdir: str, accounts: int, signals: int):
+    import httpx
+    import main
+
+    broker.accounts = accounts
+    reset_trade_state(workdir, f'webhook-{accounts}.journal')
+    start_monitoring = main.start_monitoring
+    main.start_monitoring = lambda: None  # measure the webhook alone
+
+    latencies = []
+    try:
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+                signal = {'symbolname': 'WARMUP-EQ', 'signal': 'buy', 'price': 100, 'type': 'equity', 'strategyname': 'bench'}
+                await client.post('/opentrade', json=signal)  # warm the connection pool and caches
+
+                orders_before = broker.calls['place_order']
+                started = time.perf_counter()
+                for i in range(signals):
+                    signal = {**signal, 'symbolname': f'SYM{i}-EQ', 'signal': 'buy' if i % 2 else 'sell'}
+                    t0 = time.perf_counter()
+                    response = await client.post('/opentrade', json=signal)
+                    latencies.append(time.perf_counter() - t0)
+                    response.raise_for_status()
+                elapsed = time.perf_counter() - started
+                orders = broker.calls['place_order'] - orders_before
+
+    finally:
+        main.start_monitoring = start_monitoring
+
+    return {
+        'scenario': 'webhook',
+        'accounts': accounts,
+        'signals': signals,
+        'orders': orders,
+        'orders_per_sec': round(orders / elapsed, 1) if elapsed else None,
+        **summarize(latencies),
+    }
+
+
+async def bench_monitor(broker: MockBroker, workdir: str, open_trades: int, symbols: int, ticks: int, seed: int = 0):
+    import rms
+    from exit_executor import ExitExecutor
+    from services.http_pool import create_http_session
+    from services.trading_service import TradingService
+
+    reset_trade_state(workdir, f'monitor-{open_trades}.journal')
+    rng = random.Random(seed)
+    by_symbol = {}
+    for i in range(open_trades):
+        side = 'BUY' if i % 2 else 'SELL'
+        stop = rng.uniform(80, 99.9) if side == 'BUY' else rng.uniform(100.1, 120)
+        by_symbol.setdefault(f'SYM{i % symbols}-EQ', []).append({
+            'pseudo_account': f'ACC{i:06d}', 'falcon_account': f'ID{i:06d}', 'symbol': f'sym{i % symbols}-eq',
+            'order_id': f'SEED{i}', 'quantity': 10, 'price': 100, 'balance': 100000,
+            'trade_type': side, 'stoploss_price': stop,
+        })
+    for symbol, trades in by_symbol.items():
+        rms.add_successful_trade(symbol, trades)
+    store_bytes = rms.get_trade_store().memory_footprint()
+    index_bytes = rms.stoploss_index.memory_footprint()
+
+    session = create_http_session()
+    try:
+        exits = ExitExecutor(TradingService(session), on_confirmed=rms.exit_confirmed)
+        await rms.fetch_latest_prices(rms.stoploss_index.symbols())  # resolve tokens once
+
+        tick_times = []
+        exits_before = broker.calls['place_order']
+        for _ in range(ticks):
+            t0 = time.perf_counter()
+            await rms.poll_tick(exits)
+            tick_times.append(time.perf_counter() - t0)
+        await exits.drain()
+    finally:
+        await session.close()
+
+    return {
+        'scenario': 'monitor',
+        'open_trades': open_trades,
+        'symbols': symbols,
+        'ticks': ticks,
+        'exits': broker.calls['place_order'] - exits_before,
+        'remaining_trades': len(rms.stoploss_index),
+        'store_bytes_per_trade': round(store_bytes / open_trades) if open_trades else None,
+        'index_bytes_per_trade': round(index_bytes / open_trades) if open_trades else None,
+        **{'tick_' + key: value for key, value in summarize(tick_times).items()},
+    }
+
+
+async def bench_startup(runs: int = 3):
+    """
+    Cold `import main` in a fresh interpreter (what every test run and forked
+    worker pays) and the app lifespan start-up, in milliseconds.
+    """
+    import subprocess
+    import main
+
+    probe = 'import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)'
+    imports = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, env=os.environ.copy(),
+                             capture_output=True, text=True, check=True).stdout
+        imports.append(float(out.strip().splitlines()[-1]))
+
+    start_monitoring = main.start_monitoring
+    main.start_monitoring = lambda: None
+    lifespans = []
+    try:
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            async with main.lifespan(main.app):
+                lifespans.append(time.perf_counter() - t0)
+    finally:
+        main.start_monitoring = start_monitoring
+
+    return {
+        'scenario': 'startup',
+        'import_main_ms': round(sorted(imports)[len(imports) // 2] * 1000, 1),
+        'lifespan_start_ms': round(sorted(lifespans)[len(lifespans) // 2] * 1000, 3),
+    }
+
+
+def bench_instrumentation(iterations: int = 100000):
+    """
+    Cost of recording metrics on the hot paths: one timed histogram sample and one
+    counter increment, in nanoseconds. A signal records about two histogram samples
+    and one counter per account plus one histogram sample for the whole signal.
+    """
+    from prometheus_client import CollectorRegistry, Counter, Histogram
+    import metrics
+
+    # same metric types as the app records, in a throwaway registry so /metrics stays clean
+    registry = CollectorRegistry()
+    histogram = Histogram('bench_seconds', 'bench', ['call'], buckets=metrics.LATENCY_BUCKETS, registry=registry).labels('bench')
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with histogram.time():
+            pass
+    timed_ns = (time.perf_counter() - started) / iterations * 1e9
+
+    counter = Counter('bench', 'bench', ['kind', 'status'], registry=registry).labels('bench', 'bench')
+    started = time.perf_counter()
+    for _ in range(iterations):
+        counter.inc()
+    counter_ns = (time.perf_counter() - started) / iterations * 1e9
+
+    started = time.perf_counter()
+    body, _ = metrics.render()
+    render_ms = (time.perf_counter() - started) * 1000
+
+    return {
+        'scenario': 'instrumentation',
+        'histogram_time_ns': round(timed_ns),
+        'counter_inc_ns': round(counter_ns),
+        'per_account_us': round((2 * timed_ns + counter_ns) / 1000, 2),
+        'scrape_ms': round(render_ms, 3),
+        'scrape_bytes': len(body),
+    }
+
+
+async def run_benchmarks(accounts=(1, 10, 100), open_trades=(1000, 10000), signals=20, symbols=40, ticks=20,
+                         latency=0.0, error_rate=0.0, rate_limits=False):
+    workdir = tempfile.mkdtemp(prefix='falcon-bench-')
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    results = []
+    with MockBroker(latency=latency, error_rate=error_rate) as broker:
+        configure_environment(broker, workdir, rate_limits)
+        os.chdir(workdir)  # token file and logs stay out of the repo
+        try:
+            for count in accounts:
+                results.append(await bench_webhook(broker, workdir, count, signals))
+            for count in open_trades:
+                results.append(await bench_monitor(broker, workdir, count, symbols, ticks))
+            results.append(bench_instrumentation())
+            results.append(await bench_startup())
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+            import rms
+            rms.close_trade_store()
+            reload_settings()
+
+    return {
+        'config': {
+            'latency_s': latency,
+            'error_rate': error_rate,
+            'signals': signals,
+            'symbols': symbols,
+            'ticks': ticks,
+            'rate_limits': rate_limits,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+def parse_counts(value):
+    return [int(count) for count in value.split(',') if count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=parse_counts, default=[1, 10, 100, 1000])
+    parser.add_argument('--open-trades', type=parse_counts, default=[10000, 50000])
+    parser.add_argument('--signals', type=int, default=20, help='signals per webhook scenario')
+    parser.add_argument('--symbols', type=int, default=40, help='distinct symbols in the monitor scenario')
+    parser.add_argument('--ticks', type=int, default=20, help='monitor ticks per scenario')
+    parser.add_argument('--latency', type=float, default=0.02, help='mock broker latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of broker calls that fail')
+    parser.add_argument('--rate-limits', action='store_true', help='keep the configured broker rate limits')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmarks(
+        accounts=args.accounts, open_trades=args.open_trades, signals=args.signals, symbols=args.symbols,
+        ticks=args.ticks, latency=args.latency, error_rate=args.error_rate,
+        rate_limits=args.rate_limits,
+    ))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+import metrics
+from logger import logger
+
+# SmartAPI error codes: the JWT is invalid, expired or missing -> renew it
+TOKEN_ERRORS = {"AG8001", "AG8002", "AG8003"}
+# the refresh token itself is unusable -> full TOTP login
+LOGIN_ERRORS = {"AB8050", "AB8051", "AB1011"}
+
+
+def jwt_expiry(jwt_token):
+    """Returns the `exp` claim of a JWT as a unix timestamp, or None if it cannot be read."""
+    try:
+        payload = jwt_token.split()[-1].split('.')[1]  # tokens may carry a "Bearer " prefix
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return None
+
+
+class BrokerSession:
+    """
+    Owns the SmartAPI login and keeps it fresh.
+
+    - `keep_alive()` runs in the background and renews the session
+      `refresh_margin` seconds before the JWT expires, so requests never wait
+      for a login.
+    - Renewals are single-flight: concurrent callers that hit an expired
+      session share one renewal instead of each doing their own TOTP login.
+    - `call()` retries a failed SmartAPI call exactly once after renewing.
+
+    Renewal first tries the refresh token and falls back to a full login.
+    SmartConnect is synchronous, so callers on the event loop should run
+    `call()` in a thread.
+    """
+
+    def __init__(self, login, refresh, session_ttl: float = 6 * 3600, refresh_margin: float = 300,
+                 retry_delay: float = 30, timer=time.time, settings=None):
+        self.login = login  # () -> generateSession response
+        self.refresh = refresh  # (refresh_token) -> generateToken response
+        self.session_ttl = session_ttl  # assumed lifetime when the JWT has no readable expiry
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.timer = timer
+        self.user_data = {}
+        self.expires_at = 0.0
+        self.generation = 0  # bumped on every successful renewal
+        self.logins = 0
+        self.token_refreshes = 0
+        self._lock = threading.Lock()
+        self._settings = settings  # callable returning Settings, applied on first use
+
+    def configure(self, config):
+        self._settings = None
+        self.session_ttl = config.smart_session_ttl
+        self.refresh_margin = config.smart_refresh_margin
+        return self
+
+    @property
+    def active(self):
+        return bool(self.user_data.get('status')) and self.timer() < self.expires_at
+
+    def ensure(self) -> bool:
+        """Makes sure there is a usable session; free when there already is one."""
+        if self.active:
+            return True
+        return self.renew(self.generation)
+
+    def renew(self, seen_generation: int, force_login: bool = False) -> bool:
+        """
+        Renews the session unless another caller already did so since `seen_generation`.
+        Callers that arrive while a renewal is running wait for it and share its result.
+        """
+        if self._settings is not None:
+            self.configure(self._settings())
+        with self._lock:
+            if self.generation != seen_generation and self.active:
+                return True
+            if not force_login and self._refresh_token():
+                return True
+            return self._login()
+
+    def _login(self) -> bool:
+        try:
+            user = self.login()
+        except Exception as e:
+            logger.exception("An error occurred during login:", exc_info=e)
+            user = None
+        if user and user.get('status'):
+            self._store(user['data'])
+            self.logins += 1
+            metrics.AUTH_LOGINS.inc()
+            return True
+        self.user_data['status'] = False
+        logger.error("SmartAPI login failed: %s", (user or {}).get('message'))
+        return False
+
+    def _refresh_token(self) -> bool:
+        refresh_token = self.user_data.get('refreshToken')
+        if not refresh_token:
+            return False
+        try:
+            response = self.refresh(refresh_token)
+        except Exception as e:
+            logger.warning("Token refresh failed, logging in again: %s", e)
+            return False
+        # some SmartAPI versions return None here; treat that like a failed refresh
+        if not response or not response.get('status') or not (response.get('data') or {}).get('jwtToken'):
+            return False
+        self._store(response['data'])
+        self.token_refreshes += 1
+        metrics.AUTH_TOKEN_REFRESHES.inc()
+        return True
+
+    def _store(self, data):
+        jwt_token = data['jwtToken']
+        self.user_data['status'] = True
+        self.user_data['jwtToken'] = jwt_token
+        self.user_data['refreshToken'] = data.get('refreshToken') or self.user_data.get('refreshToken')
+        if data.get('feedToken'):
+            self.user_data['feedToken'] = data['feedToken']
+        self.expires_at = jwt_expiry(jwt_token) or self.timer() + self.session_ttl
+        self.generation += 1
+
+    def call(self, method, *args):
+        """
+        Calls a SmartConnect method with a live session. On an auth error code
+        the session is renewed (once, shared with concurrent callers) and the
+        call is retried exactly once.
+        """
+        self.ensure()
+        generation = self.generation
+        response = method(*args)
+        errorcode = response.get('errorcode') if isinstance(response, dict) else None
+        if errorcode in TOKEN_ERRORS or errorcode in LOGIN_ERRORS:
+            if self.renew(generation, force_login=errorcode in LOGIN_ERRORS):
+                response = method(*args)
+        return response
+
+    async def keep_alive(self):
+        """Background task: logs in right away, then renews ahead of every expiry."""
+        while True:
+            delay = self.expires_at - self.refresh_margin - self.timer()
+            if delay > 0 and self.user_data.get('status'):
+                await asyncio.sleep(delay)
+                continue
+            renewed = await asyncio.to_thread(self.renew, self.generation)
+            if not renewed or self.expires_at - self.refresh_margin <= self.timer():
+                await asyncio.sleep(self.retry_delay)  # don't spin on a failing or short-lived session
@@ -0,0 +1,112 @@
+import asyncio
+import random
+import time
+from logger import log_context, logger
+
+
+class ExitExecutor:
+    """
+    Places RMS exit orders concurrently through a bounded pool of workers.
+
+    Every exit is registered in flight under (order_id, pseudo_account, symbol, side)
+    until it finishes, so a trade that is still breached on the next tick is not
+    exited twice. Exits the broker rejected are retried with jittered exponential
+    backoff; `on_confirmed(symbol, trade)` runs only once the broker has accepted
+    the exit. A trade whose retries are exhausted stays open and is picked up
+    again by a later tick.
+
+    An exit whose placement ended ambiguously (timed out or dropped after it was
+    sent) is never simply resent, as the broker may already hold it: the
+    account's order book is checked after `settle_delay` seconds. If the book
+    can't be read either, the exit is parked in `in_doubt`, and the next breach
+    checks again instead of placing another order.
+    """
+
+    def __init__(self, trading_service, on_confirmed, workers: int = 10, max_attempts: int = 3,
+                 base_delay: float = 0.25, max_delay: float = 5.0, settle_delay: float = 1.0):
+        self.trading_service = trading_service
+        self.on_confirmed = on_confirmed
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.settle_delay = settle_delay
+        self.semaphore = asyncio.Semaphore(workers)
+        self.in_flight: dict[tuple, asyncio.Task] = {}
+        self.in_doubt: dict[tuple, tuple] = {}  # key -> (trade, trade_request, sent_at, result) of an unclear exit
+
+    @staticmethod
+    def exit_key(symbol, trade):
+        return (trade.get('order_id'), trade['pseudo_account'], symbol, trade['trade_type'])
+
+    def is_exiting(self, symbol: str, trade) -> bool:
+        return self.exit_key(symbol, trade) in self.in_flight
+
+    def submit(self, symbol: str, trade, trade_request) -> bool:
+        """Schedules the exit unless one is already in flight for this trade. Returns True if scheduled."""
+        key = self.exit_key(symbol, trade)
+        if key in self.in_flight:
+            return False
+        doubt = self.in_doubt.pop(key, None)
+        if doubt is not None:  # settle the unclear exit first; it covers what it was sized for
+            trade, trade_request = doubt[:2]
+        self.in_flight[key] = asyncio.get_running_loop().create_task(
+            self._execute(key, symbol, trade, trade_request, doubt))
+        return True
+
+    async def _execute(self, key, symbol, trade, trade_request, doubt=None):
+        with log_context(signal=symbol, account=trade['pseudo_account'], order_id=trade.get('order_id')):
+            return await self._attempt(key, symbol, trade, trade_request, doubt)
+
+    async def _attempt(self, key, symbol, trade, trade_request, doubt=None):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                if doubt is not None:
+                    sent_at, res = doubt[2:]
+                    doubt = None
+                else:
+                    async with self.semaphore:  # held per attempt, not across the backoff
+                        sent_at = time.time()
+                        try:
+                            res = await self.trading_service.place_rms_order(trade_request)
+                        except Exception as e:
+                            logger.exception("An error occurred placing RMS exit:", exc_info=e)
+                            res = {'status': False, 'message': str(e)}
+                if res.get('ambiguous'):
+                    res = await self._settle(trade_request, sent_at, res)
+
+                if res['status']:
+                    self.on_confirmed(symbol, trade)
+                    return True
+
+                if res.get('ambiguous'):
+                    logger.error("RMS exit for %s %s may have been placed (%s); not resending until the order book shows it wasn't",
+                                 trade['pseudo_account'], symbol, res.get('message'))
+                    self.in_doubt[key] = (trade, trade_request, sent_at, res)
+                    return False
+
+                if attempt < self.max_attempts:
+                    # full jitter keeps many failing exits from retrying in lockstep; the freed
+                    # slot lets fresh breaches go out meanwhile
+                    await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+
+            logger.error("RMS exit for %s %s failed after %d attempts: %s",
+                         trade['pseudo_account'], symbol, self.max_attempts, res.get('message'))
+            return False
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def _settle(self, trade_request, sent_at: float, res: dict) -> dict:
+        """Looks the unclear exit up in the order book: placed, definitely not placed, or still `res` if it can't tell."""
+        for check in range(self.max_attempts):
+            await asyncio.sleep(self.settle_delay * 2 ** check)  # give the broker time to record it
+            found = await self.trading_service.find_rms_order(trade_request, sent_at)
+            if found:
+                return {'status': True}
+            if found is not None:
+                return {'status': False, 'message': f"{res.get('message')}; not in the order book"}
+        return res
+
+    async def drain(self):
+        """Waits for every exit currently in flight."""
+        while self.in_flight:
+            await asyncio.gather(*self.in_flight.values(), return_exceptions=True)
@@ -0,0 +1,58 @@
+import asyncio
+import time
+from logger import logger
+
+
+class HealthChecker:
+    """
+    Probes the service's dependencies in the background every `interval`
+    seconds and keeps the latest result of each, so /readyz and /health only
+    read memory and probe traffic doesn't grow with how often they are polled.
+
+    `checks` maps a dependency name to an async callable that returns something
+    truthy when the dependency is usable; returning a falsy value, raising or
+    taking longer than `timeout` marks it down. A dependency that has not been
+    checked yet is not ready.
+    """
+
+    def __init__(self, checks: dict, interval: float = 30, timeout: float = 5, clock=time.time):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock
+        self.results = {
+            name: {'status': None, 'latency_ms': None, 'checked_at': None, 'last_success_at': None, 'last_error': None}
+            for name in checks
+        }
+
+    @property
+    def ready(self) -> bool:
+        return all(result['status'] for result in self.results.values())
+
+    async def run(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self):
+        await asyncio.gather(*(self._check(name, check) for name, check in self.checks.items()))
+
+    async def _check(self, name, check):
+        result = self.results[name]
+        started = time.perf_counter()
+        try:
+            ok = await asyncio.wait_for(check(), self.timeout)
+            error = None if ok else 'check returned no result'
+        except asyncio.TimeoutError:
+            ok, error = False, f'timed out after {self.timeout}s'
+        except Exception as e:
+            ok, error = False, f'{type(e).__name__}: {e}'
+        result['latency_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        result['checked_at'] = self.clock()
+        if ok:
+            result['last_success_at'] = result['checked_at']
+        else:
+            result['last_error'] = error
+            if result['status'] is not False:
+                logger.warning("Health check %s failed: %s", name, error)
+        result['status'] = bool(ok)
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+import metrics
+from cache import TTLCache
+
+_MISSING = object()
+
+
+class IdempotencyCache:
+    """
+    Remembers the result of each webhook signal for `ttl` seconds so retried
+    deliveries get the original response instead of a second order fan-out.
+
+    Signals are keyed by the sender's Idempotency-Key header when present, else
+    by a hash of the signal content and the `ttl`-sized time bucket it arrived
+    in. Results live in an in-memory LRU; with `spill_path` they are also
+    written to SQLite, which keeps them across restarts and after LRU eviction.
+    Requests arriving while the first one with their key is still running wait
+    for its result.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 60, spill_path: str = None, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.spill_path = spill_path
+        self._db = None
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._spilled = 0
+
+    def key_for(self, signal, idempotency_key: str = None) -> str:
+        """Key for a signal, or for a list of signals sent as one batch."""
+        if idempotency_key:
+            return 'key:' + idempotency_key
+        bucket = int(self.clock() // self.ttl)
+        if isinstance(signal, list):
+            content = json.dumps([item.model_dump(mode='json') for item in signal], sort_keys=True)
+        else:
+            content = json.dumps(signal.model_dump(mode='json'), sort_keys=True)
+        return 'signal:' + hashlib.sha256(f'{bucket}:{content}'.encode()).hexdigest()
+
+    async def run(self, key: str, execute):
+        """Returns the stored result for `key`, or awaits `execute()` once and stores what it returns."""
+        result = self._lookup(key)
+        if result is not _MISSING:
+            metrics.IDEMPOTENT_REPLAYS.inc()
+            return result
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            metrics.IDEMPOTENT_REPLAYS.inc()
+        else:
+            # a task of its own, so a caller disconnecting mid fan-out doesn't cancel it for the others
+            task = self._in_flight[key] = asyncio.ensure_future(execute())
+            task.add_done_callback(lambda task: self._finished(key, task))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:  # failures are not remembered, a retry runs again
+            self._store(key, task.result())
+
+    def _lookup(self, key):
+        result = self.results.get(key, _MISSING)
+        if result is _MISSING and self.spill_path:
+            row = self._connect().execute(
+                "SELECT result FROM idempotency WHERE key = ? AND expires_at > ?", (key, self.clock())
+            ).fetchone()
+            if row is not None:
+                result = json.loads(row[0])
+                self.results.set(key, result)
+        return result
+
+    def _store(self, key, result):
+        self.results.set(key, result)
+        if self.spill_path:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, expires_at, result) VALUES (?, ?, ?)",
+                    (key, self.clock() + self.ttl, json.dumps(result))
+                )
+                self._spilled += 1
+                if self._spilled % 1000 == 0:
+                    db.execute("DELETE FROM idempotency WHERE expires_at <= ?", (self.clock(),))
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.spill_path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, result TEXT NOT NULL)"
+            )
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
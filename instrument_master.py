@@ -0,0 +1,238 @@
+"""
+The broker's instrument master (OpenAPIScripMaster.json) as a memory-mapped
+lookup table: trading symbol -> token, exchange, lot size and tick size.
+
+The master is a JSON array of tens of MB. `iter_instruments` streams it with
+JSONDecoder.raw_decode over a fixed-size read buffer, so only one chunk and one
+instrument are in memory at a time, and `build_index` writes each instrument as
+a packed record while remembering just its hash and offset. The index file is:
+
+    header | records | slot table
+
+where the slot table is an open-addressing hash table (crc32 of "EXCHANGE:SYMBOL",
+linear probing, load factor <= 0.5) of record offsets. InstrumentIndex mmaps the
+file, so a lookup is a hash, a probe or two and a struct unpack: no parsing at
+startup, no network round-trip, and pages shared between workers.
+
+    python -m instrument_master OpenAPIScripMaster.json instruments.idx
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import NamedTuple
+from logger import logger
+
+MAGIC = b'FIDX'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIQ')  # magic, version, records, slots, slot table offset
+RECORD = struct.Struct('<IdHBB')  # lot size, tick size, key length, token length, name length
+OPTION_EXCHANGES = ('NFO', 'BFO')
+
+
+class Instrument(NamedTuple):
+    token: str
+    exchange: str
+    symbol: str
+    name: str  # the underlying for derivatives, e.g. BANKNIFTY
+    lot_size: int
+    tick_size: float  # in rupees
+
+
+def iter_instruments(path: str, chunk_size: int = 1 << 20):
+    """Yields the objects of a top-level JSON array one at a time, reading `chunk_size` characters at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, position, eof = '', 0, False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("buffer exhausted", buffer, position)
+                instrument, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    if position == len(buffer):
+                        return
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0  # keep the partial object, drop what was parsed
+                continue
+            yield instrument
+
+
+def _key(symbol: str, exchange: str) -> bytes:
+    return f'{exchange}:{symbol}'.upper().encode()
+
+
+def _number(value, default=0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def build_index(instruments, path: str) -> int:
+    """
+    Writes the index of `instruments` (dicts in the instrument-master format) to
+    `path`, atomically. Returns the number of instruments indexed. When a symbol
+    is listed twice on an exchange, the first listing wins.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'  # workers starting together may each rebuild
+    try:
+        count = _write_index(instruments, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)  # a malformed master leaves no half-written index behind
+        raise
+    os.replace(tmp_path, path)
+    return count
+
+
+def _write_index(instruments, tmp_path: str) -> int:
+    hashes, offsets = array('I'), array('Q')
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))  # rewritten once the counts are known
+        for instrument in instruments:
+            if not isinstance(instrument, dict):
+                continue
+            symbol, exchange, token = instrument.get('symbol'), instrument.get('exch_seg'), instrument.get('token')
+            if not symbol or not exchange or not token:
+                continue
+            key = _key(symbol, exchange)
+            token = str(token).encode()
+            name = (instrument.get('name') or '').encode()[:255]
+            lot_size = int(_number(instrument.get('lotsize'), 1)) or 1
+            tick_size = _number(instrument.get('tick_size')) / 100  # the master lists ticks in paise
+            hashes.append(zlib.crc32(key))
+            offsets.append(f.tell())
+            f.write(RECORD.pack(lot_size, tick_size, len(key), len(token), len(name)) + key + token + name)
+
+        slot_count = 8
+        while slot_count < 2 * len(offsets):
+            slot_count *= 2
+        mask = slot_count - 1
+        slots = array('Q', bytes(8 * slot_count))  # 0 = empty; offset 0 is the header, never a record
+        for hash_value, offset in zip(hashes, offsets):
+            slot = hash_value & mask
+            while slots[slot]:
+                slot = (slot + 1) & mask
+            slots[slot] = offset
+
+        f.write(bytes(-f.tell() % 8))  # align the slot table for the memoryview cast
+        slots_offset = f.tell()
+        f.write(slots.tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(offsets), slot_count, slots_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    return len(offsets)
+
+
+class InstrumentIndex:
+    """
+    Read-only lookups into a memory-mapped instrument index. Until `open` (or
+    `load`) succeeds every lookup returns None, so callers fall back to their
+    previous behaviour when no instrument master is configured.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._mmap = None
+        self._slots = None
+        self._mask = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def load(self, master_path: str, index_path: str):
+        """
+        Opens `index_path`, rebuilding it first if `master_path` is newer. Returns
+        True if an index is open. If the master can't be read (truncated,
+        malformed), the index built from the last good one is kept.
+        """
+        if master_path and os.path.exists(master_path) and (
+                not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(master_path)):
+            try:
+                count = build_index(iter_instruments(master_path), index_path)
+            except (OSError, ValueError) as e:
+                logger.exception("Could not index instrument master %s:", master_path, exc_info=e)
+            else:
+                logger.info("Indexed %d instruments from %s", count, master_path)
+        if not os.path.exists(index_path):
+            return False
+        try:
+            self.open(index_path)
+        except (OSError, ValueError) as e:
+            logger.exception("Could not open instrument index %s:", index_path, exc_info=e)
+            return False
+        return True
+
+    def open(self, path: str):
+        self.close()
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, slot_count, slots_offset = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION:
+            mapped.close()
+            raise ValueError(f"{path} is not a version {VERSION} instrument index")
+        self.path = path
+        self._mmap = mapped
+        self._slots = memoryview(mapped)[slots_offset:slots_offset + 8 * slot_count].cast('Q')
+        self._mask = slot_count - 1
+        self.count = count
+
+    def close(self):
+        if self._slots is not None:
+            self._slots.release()  # the mmap cannot close while a view is exported
+            self._slots = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.count = 0
+
+    def get(self, symbol: str, exchange: str = 'NSE') -> Instrument:
+        if self._slots is None:
+            return None
+        key = _key(symbol, exchange)
+        mapped, slots, mask = self._mmap, self._slots, self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            offset = slots[slot]
+            if not offset:
+                return None
+            lot_size, tick_size, key_length, token_length, name_length = RECORD.unpack_from(mapped, offset)
+            start = offset + RECORD.size
+            if key_length == len(key) and mapped[start:start + key_length] == key:
+                start += key_length
+                token = mapped[start:start + token_length].decode()
+                start += token_length
+                name = mapped[start:start + name_length].decode()
+                exchange, _, symbol = key.decode().partition(':')
+                return Instrument(token, exchange, symbol, name, lot_size, tick_size)
+            slot = (slot + 1) & mask
+
+    def option(self, symbol: str) -> Instrument:
+        """The derivative contract `symbol`, on whichever F&O segment lists it."""
+        for exchange in OPTION_EXCHANGES:
+            instrument = self.get(symbol, exchange)
+            if instrument is not None:
+                return instrument
+        return None
+
+
+instruments = InstrumentIndex()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        raise SystemExit("usage: python -m instrument_master OpenAPIScripMaster.json instruments.idx")
+    print(f"Indexed {build_index(iter_instruments(sys.argv[1]), sys.argv[2])} instruments into {sys.argv[2]}")
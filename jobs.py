@@ -0,0 +1,302 @@
+"""
+In-process job queue for asynchronous webhook signals.
+
+`/opentrade?async=true` validates the signal, queues it here and answers 202
+with a job id straight away; a pool of workers runs the usual fan-out and
+`GET /jobs/{id}` reports each account's outcome as it lands.
+
+- Backpressure: at most `max_pending` jobs wait in the queue; beyond that
+  submit raises QueueFull and the webhook answers 503 with Retry-After.
+- Deadlines: a job that hasn't started within `deadline` seconds of being
+  accepted expires without placing orders, so a backlog never trades on stale
+  signals. Once started, a job runs to completion (orders may be in flight).
+- Persistence: with `path`, jobs are kept in SQLite. Jobs still queued when a
+  process stops or dies are picked up by the next one to start; jobs that were
+  mid fan-out when a process died are marked interrupted rather than re-run, as
+  some of their orders may already have been placed. Each job records its
+  owner as pid, process start time and a random instance id, so neither a
+  restart under the same pid (PID 1 in a container) nor a reused pid is taken
+  for the old process, and a job is claimed with a conditional UPDATE so
+  workers starting together never take the same one.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import deque
+from logger import log_context, logger
+import metrics
+
+QUEUED, RUNNING, DONE, FAILED, EXPIRED = 'queued', 'running', 'done', 'failed', 'expired'
+OUTCOMES = {DONE: metrics.SIGNAL_JOBS_DONE, FAILED: metrics.SIGNAL_JOBS_FAILED, EXPIRED: metrics.SIGNAL_JOBS_EXPIRED}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class SignalJob:
+    """One queued signal and its per-account progress. Also the progress sink handed to OrderFanout."""
+
+    def __init__(self, job_id: str, signal: dict, created_at: float, deadline: float, state: str = QUEUED,
+                 accounts: dict = None, result=None, error: str = None, finished_at: float = None):
+        self.id = job_id
+        self.signal = signal
+        self.created_at = created_at
+        self.deadline = deadline
+        self.state = state
+        self.accounts = accounts or {}
+        self.result = result
+        self.error = error
+        self.finished_at = finished_at
+
+    def started(self, pseudo_accounts):
+        self.accounts = {name: {'status': 'pending'} for name in pseudo_accounts}
+
+    def finished(self, pseudo_account, result):
+        if result.get('status'):
+            data = result['data']
+            self.accounts[pseudo_account] = {
+                'status': 'placed',
+                'order_id': data.get('order_id'),
+                'quantity': data.get('quantity'),
+                'stoploss_price': data.get('stoploss_price'),
+            }
+        else:
+            self.accounts[pseudo_account] = {'status': 'failed', 'message': result.get('message')}
+
+    def to_dict(self):
+        done = sum(1 for outcome in self.accounts.values() if outcome['status'] != 'pending')
+        return {
+            'job_id': self.id,
+            'state': self.state,
+            'signal': self.signal,
+            'created_at': self.created_at,
+            'deadline': self.deadline,
+            'finished_at': self.finished_at,
+            'progress': {'accounts': len(self.accounts), 'done': done},
+            'accounts': self.accounts,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class SignalJobQueue:
+    """
+    `execute(signal, progress)` runs one job's signal (a dict) and returns its
+    result; `progress` is the SignalJob, which records per-account outcomes.
+    Finished jobs stay queryable for `retention` seconds.
+    """
+
+    def __init__(self, execute, workers: int = 4, max_pending: int = 100, deadline: float = 30,
+                 path: str = None, retention: float = 3600, clock=time.time):
+        self.execute = execute
+        self.workers = workers
+        self.max_pending = max_pending
+        self.deadline = deadline
+        self.path = path
+        self.retention = retention
+        self.clock = clock
+        self.jobs: dict[str, SignalJob] = {}
+        self._finished = deque()  # job ids in the order they finished, for retention
+        self._queue: asyncio.Queue = None
+        self._workers: list[asyncio.Task] = []
+        self._running: set[asyncio.Task] = set()
+        self._db = None
+        self.owner = None  # this process's instance id, see _instance_id
+
+    def __len__(self):
+        """Jobs waiting for a worker."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self.owner = _instance_id()
+        if self.path:
+            self._recover()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Lets running jobs finish; jobs still queued are left for the next process to start."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        if self._db is not None:
+            with self._db:
+                self._db.execute("UPDATE signal_jobs SET owner = NULL WHERE state = ? AND owner = ?", (QUEUED, self.owner))
+            self._db.close()
+            self._db = None
+
+    def submit(self, signal: dict) -> SignalJob:
+        if self._queue is None:
+            raise RuntimeError("job queue is not started")
+        if self._queue.qsize() >= self.max_pending:
+            metrics.SIGNAL_JOBS_REJECTED.inc()
+            raise QueueFull(f"{self.max_pending} signals already waiting")
+        now = self.clock()
+        job = SignalJob(uuid.uuid4().hex, signal, now, now + self.deadline)
+        self.jobs[job.id] = job
+        self._persist(job)
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> dict:
+        """The job's current state, or None. Jobs of other worker processes are read from the database."""
+        job = self.jobs.get(job_id)
+        if job is None and self.path:
+            row = self._connect().execute(
+                "SELECT id, signal, created_at, deadline, state, accounts, result, error, finished_at "
+                "FROM signal_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is not None:
+                job = self._from_row(row)
+        return job.to_dict() if job is not None else None
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            # its own task, so stopping the pool doesn't cancel a fan-out half way
+            task = asyncio.ensure_future(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            await asyncio.shield(task)
+
+    async def _run(self, job: SignalJob):
+        if self.clock() > job.deadline:
+            job.error = 'deadline passed before a worker was free'
+            self._finish(job, EXPIRED)
+            return
+        job.state = RUNNING
+        self._persist(job)
+        with log_context(job=job.id):
+            try:
+                job.result = await self.execute(job.signal, job)
+                self._finish(job, DONE)
+            except Exception as e:
+                job.error = str(getattr(e, 'detail', None) or e) or type(e).__name__
+                if not hasattr(e, 'detail'):  # HTTPExceptions were logged where they were raised
+                    logger.exception("An error occurred running signal job %s:", job.id, exc_info=e)
+                self._finish(job, FAILED)
+
+    def _finish(self, job: SignalJob, state: str):
+        job.state = state
+        job.finished_at = self.clock()
+        self._persist(job)
+        OUTCOMES[state].inc()
+        self._finished.append(job.id)
+        while self._finished and self.jobs[self._finished[0]].finished_at < job.finished_at - self.retention:
+            del self.jobs[self._finished.popleft()]
+
+    # -- persistence --
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS signal_jobs (id TEXT PRIMARY KEY, signal TEXT NOT NULL, "
+                "created_at REAL NOT NULL, deadline REAL NOT NULL, state TEXT NOT NULL, owner TEXT, "
+                "accounts TEXT, result TEXT, error TEXT, finished_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS signal_jobs_state ON signal_jobs (state)")
+        return self._db
+
+    def _persist(self, job: SignalJob):
+        if not self.path:
+            return
+        db = self._connect()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO signal_jobs "
+                "(id, signal, created_at, deadline, state, owner, accounts, result, error, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, json.dumps(job.signal), job.created_at, job.deadline, job.state, self.owner,
+                 json.dumps(job.accounts), json.dumps(job.result), job.error, job.finished_at)
+            )
+            if job.finished_at is not None and len(self._finished) % 1000 == 0:
+                db.execute("DELETE FROM signal_jobs WHERE finished_at < ?", (job.finished_at - self.retention,))
+
+    def _recover(self):
+        """Takes over the jobs of processes that are gone: queued ones run again, running ones are marked interrupted."""
+        db = self._connect()
+        rows = db.execute(
+            "SELECT id, signal, created_at, deadline, state, accounts, result, error, finished_at, owner "
+            "FROM signal_jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchall()
+        recovered = 0
+        for row in rows:
+            owner = row[-1]
+            if owner is not None and _alive(owner):
+                continue  # a live worker's job
+            if not self._claim(row[0], row[4], owner):
+                continue  # another worker starting alongside got it first
+            job = self._from_row(row[:-1])
+            self.jobs[job.id] = job
+            if job.state == RUNNING:
+                job.error = 'interrupted by a restart; some orders may have been placed'
+                self._finish(job, FAILED)
+            else:
+                self._queue.put_nowait(job)
+                recovered += 1
+        if recovered:
+            logger.warning("Resuming %d queued signal jobs from %s", recovered, self.path)
+
+    def _claim(self, job_id: str, state: str, owner) -> bool:
+        """Takes the job over from `owner` (None: released). False if the row changed since it was read."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            claimed = db.execute(
+                "UPDATE signal_jobs SET owner = ? WHERE id = ? AND state = ? AND owner IS ?",
+                (self.owner, job_id, state, owner)
+            ).rowcount == 1
+        except BaseException:
+            db.rollback()
+            raise
+        db.commit()
+        return claimed
+
+    @staticmethod
+    def _from_row(row) -> SignalJob:
+        job_id, signal, created_at, deadline, state, accounts, result, error, finished_at = row
+        return SignalJob(job_id, json.loads(signal), created_at, deadline, state,
+                         json.loads(accounts) if accounts else {}, json.loads(result) if result else None,
+                         error, finished_at)
+
+
+def _start_time(pid: int) -> str:
+    """The process's start time in clock ticks since boot, or '' where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]  # field 22; the command name may contain spaces
+    except (OSError, IndexError):
+        return ''
+
+
+def _instance_id() -> str:
+    pid = os.getpid()
+    return f'{pid}:{_start_time(pid)}:{uuid.uuid4().hex}'
+
+
+def _alive(owner: str) -> bool:
+    """Whether the process that wrote `owner` (see _instance_id) is still running."""
+    try:
+        pid, started, _ = str(owner).split(':')
+        pid = int(pid)
+    except ValueError:
+        return False  # a bare pid from an older version, which a restart may have reused
+    if started:
+        return _start_time(pid) == started  # a reused pid has a different start time
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
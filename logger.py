@@ -1,7 +1,127 @@
+"""
+Logging that never does I/O on the caller's thread.
+
+`logger` only puts records on an in-memory queue; a QueueListener thread
+formats them (tracebacks included) and writes the daily log file and the
+console. Records carry the fields bound with `log_context(...)` (signal,
+account, ...), which show up in the text output and, with `log_json`, as JSON
+keys. Warnings and errors from the same line of code are rate limited, so an
+outage that fails every account doesn't flood the disk.
+"""
+import atexit
+import contextvars
+import copy
 import logging
 import os
+import queue
 import datetime
-from logging.handlers import TimedRotatingFileHandler
+import threading
+import time
+import metrics
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+# Fields attached to every record logged from the current task, see log_context
+_context: contextvars.ContextVar[dict] = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """Adds `fields` to records logged inside the block (and tasks started from it)."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Lets through at most `burst` records at `level` or above per line of code
+    every `window` seconds. The first record after a quiet window reports how
+    many were dropped in `record.suppressed`.
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60, level: int = logging.WARNING, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self.clock = clock
+        self._seen: dict[tuple, list] = {}  # (pathname, lineno) -> [window start, emitted, suppressed]
+        self._lock = threading.Lock()  # records also come from to_thread workers
+
+    def filter(self, record):
+        if record.levelno < self.level or not self.burst:
+            return True
+        key = (record.pathname, record.lineno)
+        now = self.clock()
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is None or now - seen[0] >= self.window:
+                if seen is not None and seen[2]:
+                    record.suppressed = seen[2]
+                self._seen[key] = [now, 1, 0]
+                return True
+            if seen[1] < self.burst:
+                seen[1] += 1
+                return True
+            seen[2] += 1
+            metrics.LOG_RECORDS_SUPPRESSED.inc()
+            return False
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Enqueues a copy of the record with its message rendered and the current log
+    context attached. Unlike QueueHandler, exception info is kept as is so the
+    traceback is formatted by the listener thread instead of the caller.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.context = _context.get()
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """The message, followed by the record's context and suppression count if any."""
+
+    def format(self, record):
+        text = super().format(record)
+        context = getattr(record, 'context', None)
+        if context:
+            text += ' [' + ' '.join(f'{key}={value}' for key, value in context.items()) + ']'
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += f' ({suppressed} similar messages suppressed)'
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, serialised with orjson."""
+
+    def __init__(self):
+        super().__init__()
+        import orjson  # deferred: only needed when log_json is on
+        self._dumps = orjson.dumps
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or {})
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return self._dumps(entry, default=str).decode()
+
 
 # Create logs directory if it doesn't exist
 log_directory = "logs"
@@ -10,16 +130,36 @@ os.makedirs(log_directory, exist_ok=True)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# File handler - Rotates daily 
+# File handler - Rotates daily
 file_handler = TimedRotatingFileHandler(
     os.path.join(log_directory, "app_{}.log".format(datetime.date.today())),
-    when="D",  # D stands for daily rotation 
-    interval=1, 
+    when="D",  # D stands for daily rotation
+    interval=1,
     backupCount=7  # Keep up to 7 days of logs
 )
 file_handler.setLevel(logging.WARNING)
 
 console_handler = logging.StreamHandler()  # Keep console handler as is
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+for handler in (file_handler, console_handler):
+    handler.setFormatter(TextFormatter())
+
+# The hot path stops at the queue; the listener thread does the formatting and writing
+log_queue = queue.SimpleQueue()
+repeat_filter = RepeatFilter()
+queue_handler = ContextQueueHandler(log_queue)
+queue_handler.addFilter(repeat_filter)
+listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)  # drains the queue before the process exits
+
+logger.addHandler(queue_handler)
+
+
+def configure_logging(json_format: bool = False, error_burst: int = 10, error_window: float = 60):
+    """Applies the log settings; called once at startup."""
+    formatter = JsonFormatter() if json_format else TextFormatter()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    repeat_filter.burst = error_burst
+    repeat_filter.window = error_window
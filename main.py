@@ -1,88 +1,240 @@
-from logger import logger
-from fastapi import FastAPI, HTTPException
-from models import TradeSignal, TradeType, TradeRequest, OrderType, ProductType, Account, TradeSignal
+from logger import configure_logging, log_context, logger
+from typing import Annotated, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from models import TradeSignal, Account
 from services import trading_service, account_service
+from services.http_pool import create_http_session
+from services.order_fanout import OrderFanout
+from contextlib import asynccontextmanager
 import asyncio
-import aiohttp
-from rms import add_successful_trade, load_trade_data, monitor_stop_losses
-from utils import get_symbol_info, setting
-
-app = FastAPI()
-
-global is_monitoring_running
+import math
+from rms import (add_successful_trades, load_trade_data, close_trade_store, monitor_stop_losses,
+                 feed_silence, last_tick_age, open_trade_count, stored_handoffs, sync_trade_store, tick_lag)
+from utils import broker_session, get_symbol_info, setting
+from token_index import token_index
+from instrument_master import instruments
+from monitor_leader import MonitorCoordinator
+from idempotency import IdempotencyCache
+from health import HealthChecker
+from jobs import QueueFull, SignalJobQueue
+import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = setting()
+    configure_logging(config.log_json, config.log_error_burst, config.log_error_window)
+    # One connection pool for the whole process, shared by every broker call
+    app.state.http_session = create_http_session()
+    app.state.account_service = create_account_service(app.state.http_session)
+    # Log in to SmartAPI up front and keep the session fresh, so no request waits on a login
+    session_keeper = asyncio.create_task(broker_session.keep_alive())
+    token_index.load()
+    await asyncio.to_thread(instruments.load, config.instrument_master_path, config.instrument_index_path)
+    app.state.idempotency = create_idempotency_cache()
+    app.state.health = create_health_checker(app.state.account_service)
+    health_checks = asyncio.create_task(app.state.health.run())
+    app.state.coordinator = create_coordinator() if setting().multi_worker else None
+    if app.state.coordinator is not None:
+        # only the elected worker owns the trade store and runs the monitor
+        election = asyncio.create_task(app.state.coordinator.run())
+    else:
+        resume_monitoring()
+    app.state.jobs = create_job_queue()
+    if app.state.jobs is not None:
+        await app.state.jobs.start()
+    try:
+        yield
+    finally:
+        if app.state.jobs is not None:
+            # running jobs finish and hand off their trades; queued ones wait for the next start
+            await app.state.jobs.stop()
+            app.state.jobs = None
+        if app.state.coordinator is not None:
+            election.cancel()
+            await asyncio.gather(election, return_exceptions=True)
+        session_keeper.cancel()
+        health_checks.cancel()
+        if app.state.idempotency is not None:
+            app.state.idempotency.close()
+            app.state.idempotency = None
+        close_trade_store()
+        await token_index.close()
+        instruments.close()
+        await app.state.http_session.close()
+
+app = FastAPI(lifespan=lifespan)
+
+is_monitoring_running = False
 
 def get_trading_service(): 
-    return trading_service.TradingService() 
+    return trading_service.TradingService(app.state.http_session)
+
+def create_account_service(session):
+    config = setting()
+    return account_service.AccountService(
+        config.users_url,
+        session,
+        accounts_ttl=config.accounts_cache_ttl,
+        stale_ttl=config.accounts_stale_ttl,
+        margin_ttl=config.margin_cache_ttl,
+        margin_cache_size=config.margin_cache_size,
+    )
 
 def get_account_service():
-    url = setting().users_url
-    return account_service.AccountService(url)
+    # long-lived, so its account and margin caches are shared by every request
+    return app.state.account_service
+
+def create_idempotency_cache():
+    config = setting()
+    if not config.idempotency_window:
+        return None
+    return IdempotencyCache(
+        maxsize=config.idempotency_cache_size,
+        ttl=config.idempotency_window,
+        spill_path=config.idempotency_spill_path or None,
+    )
+
+def create_health_checker(account_service):
+    config = setting()
+
+    async def smartapi():
+        return await get_symbol_info("SBIN-EQ")  # lowest priority, never delays orders
+
+    return HealthChecker(
+        {'accounts': account_service.get_active_accounts, 'smartapi': smartapi},
+        interval=config.health_check_interval,
+        timeout=config.health_check_timeout,
+    )
+
+def create_job_queue():
+    config = setting()
+    if not config.signal_job_workers:
+        return None
+    jobs = SignalJobQueue(
+        run_signal_job,
+        workers=config.signal_job_workers,
+        max_pending=config.signal_job_queue_size,
+        deadline=config.signal_job_deadline,
+        path=config.signal_jobs_path or None,
+        retention=config.signal_job_retention,
+    )
+    metrics.SIGNAL_JOBS_QUEUED.set_function(jobs.__len__)
+    return jobs
+
+async def run_signal_job(signal: dict, progress):
+    with metrics.SIGNAL_SECONDS.time():
+        return await execute_trade_signal(TradeSignal.model_validate(signal), progress)
+
+def create_coordinator():
+    config = setting()
+    return MonitorCoordinator(
+        config.monitor_lock_path,
+        config.monitor_socket_path,
+        config.monitor_spool_path,
+        on_trades=monitor_trades,
+        on_elected=resume_monitoring,
+        sync=sync_trade_store,
+        handled=stored_handoffs,
+    )
+
+def resume_monitoring():
+    if load_trade_data():  # resume monitoring trades left open by the previous run
+        start_monitoring()
+
+def monitor_trades(trades_by_symbol, handoff=None):
+    add_successful_trades(trades_by_symbol, handoff)
+    start_monitoring()
+
+async def hand_off_trades(trades_by_symbol):
+    # With several workers, trades go to whichever worker runs the monitor
+    coordinator = getattr(app.state, 'coordinator', None)
+    if coordinator is not None:
+        await coordinator.submit_many(trades_by_symbol)
+    else:
+        monitor_trades(trades_by_symbol)
+
+def start_monitoring():
+    # Start the stop-loss monitor if not running
+    global is_monitoring_running
+    if not is_monitoring_running:
+        task = asyncio.create_task(monitor_stop_losses())
+        task.add_done_callback(monitoring_stopped)
+        is_monitoring_running = True
+
+def monitoring_stopped(task):
+    # The monitor exits once no trades are open; allow the next signal to restart it
+    global is_monitoring_running
+    is_monitoring_running = False
 
 @app.post("/opentrade")
-async def process_trade_signal(signal: TradeSignal):
+async def process_trade_signal(signal: TradeSignal, idempotency_key: Annotated[Optional[str], Header()] = None,
+                               run_async: Annotated[bool, Query(alias='async')] = False):
+    if run_async:
+        return await enqueue_trade_signal(signal, idempotency_key)
+    with metrics.SIGNAL_SECONDS.time():
+        idempotency = getattr(app.state, 'idempotency', None)
+        if idempotency is None:
+            return await execute_trade_signal(signal)
+        # retried deliveries get the first result instead of a second fan-out
+        key = idempotency.key_for(signal, idempotency_key)
+        return await idempotency.run(key, lambda: execute_trade_signal(signal))
+
+async def enqueue_trade_signal(signal: TradeSignal, idempotency_key: Optional[str] = None):
+    # The signal is validated and queued; a worker fans it out and GET /jobs/{id} follows it
+    jobs = getattr(app.state, 'jobs', None)
+    if jobs is None:
+        raise HTTPException(status_code=400, detail="Asynchronous signals are disabled")
+
+    async def submit():
+        try:
+            job = jobs.submit(signal.model_dump(mode='json'))
+        except QueueFull as e:
+            logger.warning("Rejected async signal for %s: %s", signal.symbolname, e)
+            raise HTTPException(status_code=503, detail="Signal queue is full", headers={'Retry-After': '1'})
+        return {'status': True, 'job_id': job.id, 'state': job.state}
+
+    idempotency = getattr(app.state, 'idempotency', None)
+    if idempotency is None:
+        body = await submit()
+    else:
+        # a retried delivery gets the job of the first one
+        body = await idempotency.run('job:' + idempotency.key_for(signal, idempotency_key), submit)
+    return JSONResponse(body, status_code=202, headers={'Location': f"/jobs/{body['job_id']}"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    jobs = getattr(app.state, 'jobs', None)
+    job = jobs.get(job_id) if jobs is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+async def execute_trade_signal(signal: TradeSignal, progress=None):
+    with log_context(signal=signal.symbolname, strategy=signal.strategyname):
+        return await _execute_trade_signal(signal, progress)
+
+async def _execute_trade_signal(signal: TradeSignal, progress=None):
     try:
 
         trading_service = get_trading_service()
         account_service = get_account_service()
 
-        accounts: list[Account] = account_service.get_active_accounts()
-
-        successful_trades = [] 
+        accounts: list[Account] = await account_service.get_active_accounts()
 
         if accounts: 
-            tasks = []
-            open_trades = await load_trade_data() # Load open trades from file
-            
-            if signal.type == TradeType.equity:
-                async with aiohttp.ClientSession() as session:  # Shared session for efficiency
-                    for account in accounts:
-                        demat_margin = account_service.get_user_demat(account.pseudoAccountName)
-
-                        if demat_margin:
-                            account.fund = demat_margin
-
-                        lot_size = trading_service.calculate_lot_size(account, signal)
-                        trade_request = build_trade_request(account, signal, lot_size)
-                        tasks.append(asyncio.create_task(trading_service.place_order(trade_request, account)))
-
-                        results = await asyncio.gather(*tasks)  
-                        successful_trades = get_successful_trades(results)
-                        add_successful_trade(open_trades, signal.symbolname, successful_trades)
-
-                        # Start the monitoring thread if not running
-                        if not is_monitoring_running:
-                            asyncio.create_task(monitor_stop_losses()) 
-                            is_monitoring_running = True
-                return {
-                    'status': True,
-                    'data': successful_trades
-                }
-
-            elif signal.type == TradeType.option:
-                async with aiohttp.ClientSession() as session:  # Shared session for efficiency
-                    for account in accounts:
-                        demat_margin = account_service.get_user_demat(account.pseudoAccountName)
-
-                        if demat_margin:
-                            account.fund = demat_margin
-                        if account.fund < 100000:
-                            continue
-                        lot_size = trading_service.get_predefined_option_lot_size(account, signal)
-                        trade_request = build_trade_request(account, signal, lot_size)
-                        tasks.append(asyncio.create_task(trading_service.place_order(trade_request)))
-
-                        results = await asyncio.gather(*tasks)  
-                        successful_trades = get_successful_trades(results)
-                        add_successful_trade(open_trades, signal.symbolname, successful_trades)
-
-                        # Start the monitoring thread if not running
-                        if not is_monitoring_running:
-                            asyncio.create_task(monitor_stop_losses()) 
-                            is_monitoring_running = True
-                return {
-                    'status': True,
-                    'data': successful_trades
-                }
+            fanout = OrderFanout(trading_service, account_service, setting().fanout_concurrency, progress)
+            results = await fanout.run(accounts, signal)
+
+            successful_trades = get_successful_trades(results)
+            if successful_trades:
+                await hand_off_trades({signal.symbolname: successful_trades})
+
+            return {
+                'status': True,
+                'data': successful_trades
+            }
         else:
             return {
                 'status': False,
@@ -102,43 +254,132 @@ async def process_trade_signal(signal: TradeSignal):
         raise HTTPException(status_code=500, detail="Internal server error")
     
 
-@app.get("/health")
-async def health_check():
+@app.post("/opentrade/batch")
+async def process_trade_signals(signals: list[TradeSignal], idempotency_key: Annotated[Optional[str], Header()] = None):
+    with metrics.SIGNAL_BATCH_SECONDS.time():
+        idempotency = getattr(app.state, 'idempotency', None)
+        if idempotency is None:
+            return await execute_trade_signals(signals)
+        key = idempotency.key_for(signals, idempotency_key)
+        return await idempotency.run(key, lambda: execute_trade_signals(signals))
+
+async def execute_trade_signals(signals: list[TradeSignal]):
+    # Several signals share one account lookup, one margin lookup per account and one trade store write
     try:
-        check1 = False
-        check2 = False
+        if not signals:
+            return {
+                'status': False,
+                'data': 'No signals'
+            }
+
+        trading_service = get_trading_service()
         account_service = get_account_service()
-        accounts: list[Account] = account_service.get_active_accounts()
+
+        accounts: list[Account] = await account_service.get_active_accounts()
+
         if accounts:
-            check1 = True
-        check2 = await get_symbol_info("SBIN-EQ")
+            fanout = OrderFanout(trading_service, account_service, setting().fanout_concurrency)
+            batch_results = await fanout.run_batch(accounts, signals)
+
+            trades_by_symbol = {}
+            data = []
+            for signal, results in zip(signals, batch_results):
+                accounts_data = get_account_results(results)
+                trades_by_symbol.setdefault(signal.symbolname, []).extend(
+                    result['trade'] for result in accounts_data if result['status']
+                )
+                data.append({
+                    'symbol': signal.symbolname,
+                    'signal': signal.signal,
+                    'accounts': accounts_data
+                })
+
+            trades_by_symbol = {symbol: trades for symbol, trades in trades_by_symbol.items() if trades}
+            if trades_by_symbol:
+                await hand_off_trades(trades_by_symbol)
 
-        if check1 and check2:
             return {
                 'status': True,
-                'message': 'Service is healthy'
-        }
+                'data': data
+            }
+        else:
+            return {
+                'status': False,
+                'data': 'No active accounts found'
+            }
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail="Trade data file not found")
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid trade data format")
+
     except Exception as e:
-        logger.exception("An error occured during health check:", exc_info=e)
+        logger.exception("An error occured during batch trade processing:", exc_info=e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/livez")
+async def liveness():
+    # answered from memory; if the event loop is wedged this times out, which is the point
+    return {'status': True}
+
+@app.get("/readyz")
+async def readiness():
+    report = readiness_report()
+    return JSONResponse(report, status_code=200 if report['status'] else 503)
+
+@app.get("/health")
+async def health_check():
+    if readiness_report()['status']:
         return {
-            'status': False,
-            'message': 'Service is unhealthy'
+            'status': True,
+            'message': 'Service is healthy'
         }
+    return {
+        'status': False,
+        'message': 'Service is unhealthy'
+    }
+
+def readiness_report():
+    """Dependency results cached by the background checker, plus the stop-loss monitor's state."""
+    health = getattr(app.state, 'health', None)
+    dependencies = health.results if health is not None else {}
+    monitor = monitor_health()
+    return {
+        'status': health is not None and health.ready and monitor['status'],
+        'dependencies': dependencies,
+        'monitor': monitor,
+    }
+
+def monitor_health():
+    coordinator = getattr(app.state, 'coordinator', None)
+    owner = coordinator is None or coordinator.is_leader  # followers hand their trades to the leader
+    open_trades = open_trade_count() if owner else None
+    lag = tick_lag()
+    age = last_tick_age()
+    silence = feed_silence()
+    config = setting()
+    if silence is not None:
+        live = silence <= config.feed_max_silence  # streaming: ticks only come for symbols that trade
+    else:
+        live = lag <= config.monitor_max_tick_age
+    return {
+        'status': not owner or not open_trades or (is_monitoring_running and live),
+        'role': 'monitor' if owner else 'follower',
+        'running': is_monitoring_running,
+        'mode': 'stream' if silence is not None else 'poll',
+        'open_trades': open_trades,
+        'last_tick_age_s': round(age, 3) if age is not None else None,
+        'tick_lag_s': round(lag, 3),
+        'feed_silence_s': round(silence, 3) if silence is not None and math.isfinite(silence) else None,
+    }
 
 # Helper functions
-def build_trade_request(account: Account, signal: TradeSignal, lot_size: int):
-    trade_request = TradeRequest(
-        pseudoAccount=account.pseudoAccountName,
-        symbol=signal.symbolname.lower(),
-        tradeType=signal.signal.upper(), 
-        orderType=OrderType.market,  
-        productType=ProductType.INTRADAY,  
-        quantity=lot_size,
-        price=signal.price,  
-        triggerPrice=0
-    )
-    return trade_request
-
 def get_successful_trades(results):
     successful_trades = []
     for result in results:
@@ -158,7 +399,10 @@ def get_successful_trades(results):
                 'trade_type': result['data']['trade_type'],
             }
 
-            stoploss_price = calculate_stop_loss_price(trade_data, stoploss_type, stoploss_value)
+            if 'stoploss_price' in result['data']:
+                stoploss_price = result['data']['stoploss_price']  # sized together with the lot
+            else:
+                stoploss_price = calculate_stop_loss_price(trade_data, stoploss_type, stoploss_value, trade_data['balance'])
 
             successful_trades.append({
                 **trade_data,  # Unpack previous trade data
@@ -166,6 +410,21 @@ def get_successful_trades(results):
             })
     return successful_trades
 
+def get_account_results(results):
+    """One entry per account: the opened trade, or why no trade was opened."""
+    account_results = []
+    for result in results:
+        if result['status']:
+            trade = get_successful_trades([result])[0]
+            account_results.append({'account': trade['pseudo_account'], 'status': True, 'trade': trade})
+        else:
+            account_results.append({
+                'account': result.get('account'),
+                'status': False,
+                'message': result.get('message')
+            })
+    return account_results
+
 
 def calculate_stop_loss_price(trade_data, stoploss_type: str, stoploss_value: float, balance: float):
     """
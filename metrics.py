@@ -0,0 +1,70 @@
+"""
+Prometheus metrics for the hot paths, served at GET /metrics.
+
+Label values are bound once at import (`.labels(...)` children), so recording a
+sample on the hot path is a lock-protected add and never a label lookup.
+"""
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Broker round-trips are 10ms..1s; a signal fans out to many of them
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+IO_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+SIGNAL_SECONDS = Histogram(
+    'falcon_signal_seconds', 'process_trade_signal end to end, from webhook to stored trades',
+    buckets=LATENCY_BUCKETS,
+)
+
+SIGNAL_BATCH_SECONDS = Histogram(
+    'falcon_signal_batch_seconds', 'process_trade_signals end to end, for a whole /opentrade/batch request',
+    buckets=LATENCY_BUCKETS,
+)
+
+BROKER_CALL_SECONDS = Histogram(
+    'falcon_broker_call_seconds', 'Latency of one broker API call', ['call'], buckets=LATENCY_BUCKETS,
+)
+PLACE_ORDER_SECONDS = BROKER_CALL_SECONDS.labels('place_order')
+PLACE_RMS_ORDER_SECONDS = BROKER_CALL_SECONDS.labels('place_rms_order')
+FETCH_PRICE_SECONDS = BROKER_CALL_SECONDS.labels('fetch_price')
+GET_SYMBOL_INFO_SECONDS = BROKER_CALL_SECONDS.labels('get_symbol_info')
+GET_USER_DEMAT_SECONDS = BROKER_CALL_SECONDS.labels('get_user_demat')
+
+TRADE_STORE_SECONDS = Histogram(
+    'falcon_trade_store_seconds', 'Trade store disk I/O', ['op'], buckets=IO_BUCKETS,
+)
+TRADE_STORE_LOAD_SECONDS = TRADE_STORE_SECONDS.labels('load')
+TRADE_STORE_OPEN_SECONDS = TRADE_STORE_SECONDS.labels('open')
+TRADE_STORE_CLOSE_SECONDS = TRADE_STORE_SECONDS.labels('close')
+
+ORDERS = Counter('falcon_orders', 'Orders sent to the broker', ['kind', 'status'])
+ENTRY_ORDERS_PLACED = ORDERS.labels('entry', 'placed')
+ENTRY_ORDERS_FAILED = ORDERS.labels('entry', 'failed')
+EXIT_ORDERS_PLACED = ORDERS.labels('exit', 'placed')
+EXIT_ORDERS_FAILED = ORDERS.labels('exit', 'failed')
+
+SIGNAL_JOBS = Counter('falcon_signal_jobs', 'Asynchronous /opentrade?async=true jobs by outcome', ['state'])
+SIGNAL_JOBS_REJECTED = SIGNAL_JOBS.labels('rejected')  # queue full
+SIGNAL_JOBS_DONE = SIGNAL_JOBS.labels('done')
+SIGNAL_JOBS_FAILED = SIGNAL_JOBS.labels('failed')
+SIGNAL_JOBS_EXPIRED = SIGNAL_JOBS.labels('expired')
+SIGNAL_JOBS_QUEUED = Gauge('falcon_signal_jobs_queued', 'Asynchronous signal jobs waiting for a worker')
+
+IDEMPOTENT_REPLAYS = Counter('falcon_idempotent_replays', 'Duplicate webhook signals answered from the idempotency cache')
+
+EXITS_TRIGGERED = Counter('falcon_exits_triggered', 'Stop-losses breached and submitted for exit')
+
+LOG_RECORDS_SUPPRESSED = Counter('falcon_log_records_suppressed', 'Repeated warnings and errors dropped by the log rate limit')
+
+AUTH_REFRESHES = Counter('falcon_auth_refreshes', 'SmartAPI session renewals', ['method'])
+AUTH_TOKEN_REFRESHES = AUTH_REFRESHES.labels('refresh_token')
+AUTH_LOGINS = AUTH_REFRESHES.labels('login')
+
+OPEN_TRADES = Gauge('falcon_open_trades', 'Open trades being monitored')
+OPEN_SYMBOLS = Gauge('falcon_open_symbols', 'Symbols with at least one open trade')
+MONITOR_TICK_SECONDS = Gauge('falcon_monitor_tick_seconds', 'Duration of the last stop-loss evaluation pass')
+MONITOR_TICK_LAG_SECONDS = Gauge('falcon_monitor_tick_lag_seconds', 'Seconds since the stop-loss monitor last evaluated prices')
+
+
+def render():
+    """(body, content type) of the current metrics in Prometheus text format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -67,4 +67,91 @@ class Settings(BaseSettings):
     totp_key:str
     stock_developers_api_key:str
 
+    # broker endpoints, overridable for local mocks
+    stocks_developer_url: str = "https://api.stocksdeveloper.in"
+    smart_api_root: str = ""  # empty uses the SmartAPI production endpoint
+
+    # SmartAPI session: renewed this many seconds before the JWT expires;
+    # smart_session_ttl is assumed when the JWT carries no readable expiry
+    smart_session_ttl: float = 6 * 3600
+    smart_refresh_margin: float = 300
+
+    # shared HTTP connection pool for broker calls
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 50
+    http_dns_cache_ttl: int = 300  # seconds
+    http_keepalive_timeout: float = 30  # seconds
+    http_timeout: float = 10  # seconds, per request
+
+    # users-service and margin caching
+    accounts_cache_ttl: float = 2.0  # seconds an accounts list is fresh
+    accounts_stale_ttl: float = 30.0  # further seconds it is served while refreshing in the background
+    margin_cache_ttl: float = 5.0
+    margin_cache_size: int = 1024
+
+    # duplicate webhook deliveries (same Idempotency-Key, or same signal within the
+    # same window) get the first response; 0 disables. The spill keeps results on disk.
+    idempotency_window: float = 60  # seconds
+    idempotency_cache_size: int = 4096
+    idempotency_spill_path: str = ""
+
+    # broker instrument master (OpenAPIScripMaster.json) and the index built from it;
+    # the index is rebuilt at startup whenever the master file is newer
+    instrument_master_path: str = ""
+    instrument_index_path: str = "instruments.idx"
+
+    # /readyz and /health report the results of background dependency checks run every
+    # health_check_interval seconds; the monitor counts as down once open trades have
+    # gone monitor_max_tick_age seconds without a price evaluation. With the websocket
+    # feed, quiet symbols send no ticks, so it counts as down once the feed has sent
+    # nothing, heartbeats included, for feed_max_silence seconds
+    health_check_interval: float = 30
+    health_check_timeout: float = 5
+    monitor_max_tick_age: float = 10
+    feed_max_silence: float = 30
+
+    # log records as JSON objects instead of text; warnings/errors from the same line
+    # of code beyond log_error_burst per log_error_window seconds are dropped (0 disables)
+    log_json: bool = False
+    log_error_burst: int = 10
+    log_error_window: float = 60  # seconds
+
+    # /opentrade?async=true queues the signal and answers 202 with a job id; 0 workers
+    # disables it. A job not started within signal_job_deadline seconds expires unplaced,
+    # and queued jobs survive restarts in signal_jobs_path ("" keeps them in memory only)
+    signal_job_workers: int = 4
+    signal_job_queue_size: int = 100
+    signal_job_deadline: float = 30  # seconds
+    signal_job_retention: float = 3600  # seconds finished jobs stay queryable
+    signal_jobs_path: str = "signal_jobs.db"
+
+    # max accounts processed concurrently per signal
+    fanout_concurrency: int = 50
+
+    # open-trade persistence: "journal" (append-only file) or "sqlite" (WAL)
+    trade_store_backend: str = "journal"
+    trade_store_path: str = ""  # defaults to trades.journal / trades.db
+
+    # stop-loss price source: "poll" (REST LTP every second) or "websocket" (SmartAPI streaming feed)
+    price_feed: str = "poll"
+
+    # broker requests per second per endpoint, 0 disables a limit; order_rate_reserve
+    # tokens of the order burst are kept for RMS exits
+    order_rate_limit: float = 10
+    order_rate_reserve: float = 2
+    margin_rate_limit: float = 10
+    quote_rate_limit: float = 10
+    search_rate_limit: float = 1
+
+    # uvicorn --workers N: one worker, elected through the lock file, owns the trade
+    # store and runs the monitor; the others hand new trades to it over the socket
+    multi_worker: bool = False
+    monitor_lock_path: str = "monitor.lock"
+    monitor_socket_path: str = "monitor.sock"
+    monitor_spool_path: str = "monitor.spool"
+
+    # concurrent RMS exits and retries per exit
+    exit_workers: int = 10
+    exit_max_attempts: int = 3
+
     model_config = SettingsConfigDict(env_file=".env")
\ No newline at end of file
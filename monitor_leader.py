@@ -0,0 +1,218 @@
+"""
+Multi-worker coordination: under `uvicorn --workers N` every worker handles
+webhooks, but only one of them (the leader) owns the trade store and runs the
+stop-loss monitor.
+
+- Election: the leader holds an exclusive flock on `lock_path`. The OS drops
+  the lock when the process dies, and the other workers, which keep retrying,
+  take over within `poll_interval`.
+- Hand-off: followers send newly opened trades to the leader over a unix
+  socket and wait for its acknowledgement, which comes once `sync()` reports
+  the trades are on disk. Trades that cannot be delivered within `handoff_timeout` (no
+  leader reachable) are appended to a spool file that the next leader replays.
+- Duplicates: every hand-off message carries an id and the leader skips ids
+  it has already stored, so a batch that was persisted but acknowledged too
+  late (and therefore resent or spooled as well) is not opened twice. The ids
+  are stored with the trades, and a newly elected leader starts from
+  `handled()`, so this holds across a leader dying before its ack went out.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import uuid
+from logger import logger
+
+HANDLED_IDS = 10000  # hand-off message ids the leader remembers
+
+
+def unpack(message: dict) -> dict:
+    """Trades by symbol from a hand-off message; single-symbol messages predate batches."""
+    if 'batch' in message:
+        return message['batch']
+    return {message['symbol']: message['trades']}
+
+
+class MonitorLease:
+    """Non-blocking exclusive flock on a lock file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())  # informational: who is monitoring
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class MonitorCoordinator:
+    """
+    Runs the election loop for one worker. `on_trades(trades_by_symbol, handoff_id)`
+    stores and monitors trades on the leader, recording the hand-off id (None for
+    local trades and old spooled messages) with them; `on_elected()` runs once
+    when this worker becomes the leader. Optional: `await sync()` returns once
+    stored trades are durable, and `handled()` lists the hand-off ids already
+    in the store.
+    """
+
+    def __init__(self, lock_path: str, socket_path: str, spool_path: str, on_trades, on_elected,
+                 poll_interval: float = 1.0, handoff_timeout: float = 10.0, sync=None, handled=None):
+        self.lease = MonitorLease(lock_path)
+        self.socket_path = socket_path
+        self.spool_path = spool_path
+        self.on_trades = on_trades
+        self.on_elected = on_elected
+        self.poll_interval = poll_interval
+        self.handoff_timeout = handoff_timeout
+        self.sync = sync
+        self.handled = handled
+        self._server: asyncio.AbstractServer = None
+        self._handled: dict[str, None] = {}  # ids of the messages stored, oldest first
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lease.held
+
+    async def run(self):
+        """Tries to become the leader every `poll_interval` until elected, then stays leader."""
+        try:
+            while True:
+                if not self.lease.held and self.lease.try_acquire():
+                    await self._become_leader()
+                if self.lease.held:
+                    await self._replay_spool()  # trades spooled while no leader was reachable
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            await self.close()
+
+    async def _become_leader(self):
+        logger.warning("Worker %d elected as the stop-loss monitor", os.getpid())
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left behind by the previous leader
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        self.on_elected()
+        if self.handled is not None:  # batches the previous leader stored, whether or not it acknowledged them
+            self._handled = dict.fromkeys(self.handled())
+        await self._replay_spool()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        self.lease.release()
+
+    # -- leader side --
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                self._accept(json.loads(line))
+                await self._synced()  # the follower forgets the trades once acknowledged
+                writer.write(b'ok\n')
+                await writer.drain()
+        except Exception as e:
+            logger.exception("An error occurred receiving trades from a worker:", exc_info=e)
+        finally:
+            writer.close()
+
+    async def _replay_spool(self):
+        try:
+            if not os.path.getsize(self.spool_path):
+                return
+        except FileNotFoundError:
+            return
+        with open(self.spool_path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            for line in f:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                self._accept(message)
+            await self._synced()
+            f.truncate(0)
+        logger.warning("Replayed spooled trades from %s", self.spool_path)
+
+    def _accept(self, message: dict):
+        """Stores the trades of a hand-off message, unless a message with its id was already stored."""
+        message_id = message.get('id')  # spooled by a version without ids if missing
+        if message_id in self._handled:
+            logger.warning("Skipping hand-off %s, its trades are already stored", message_id)
+            return
+        self.on_trades(unpack(message), message_id)
+        if message_id is not None:
+            self._handled[message_id] = None
+            if len(self._handled) > HANDLED_IDS:
+                del self._handled[next(iter(self._handled))]
+
+    async def _synced(self):
+        if self.sync is not None:
+            await self.sync()
+
+    # -- any worker --
+
+    async def submit(self, symbol: str, trades: list):
+        await self.submit_many({symbol: trades})
+
+    async def submit_many(self, trades_by_symbol: dict):
+        """Hands trades to the monitor: directly on the leader, over the socket from a follower."""
+        if self.lease.held:
+            self.on_trades(trades_by_symbol, None)
+            return
+        message = (json.dumps({'id': uuid.uuid4().hex, 'batch': trades_by_symbol}) + '\n').encode()
+        try:
+            await asyncio.wait_for(self._deliver(message), self.handoff_timeout)
+        except asyncio.TimeoutError:
+            count = sum(len(trades) for trades in trades_by_symbol.values())
+            logger.error("No stop-loss monitor reachable, spooling %d trades on %s", count, ', '.join(trades_by_symbol))
+            self._spool(message)
+
+    async def _deliver(self, message: bytes):
+        delay = 0.05
+        while True:
+            if self.lease.held:  # we were elected while retrying
+                self._accept(json.loads(message))
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                try:
+                    writer.write(message)
+                    await writer.drain()
+                    if await reader.readline() == b'ok\n':
+                        return
+                finally:
+                    writer.close()
+            except OSError:
+                pass  # leader gone or not bound yet; failover takes up to poll_interval
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    def _spool(self, message: bytes):
+        with open(self.spool_path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(message)
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,94 @@
+import sys
+from array import array
+
+_INTERNED = ('pseudo_account', 'falcon_account', 'symbol', 'trade_type')
+
+
+class OpenTrade:
+    """
+    One open trade, stored in slots instead of a per-trade dict.
+
+    Account, symbol and side strings are interned, so the thousands of trades an
+    account or symbol has share one copy of each. Item access (`trade['symbol']`,
+    `trade.get('order_id')`) is kept so code written against the old trade dicts
+    keeps working; `to_dict()` gives the dict form used for persistence.
+    """
+
+    __slots__ = ('pseudo_account', 'falcon_account', 'symbol', 'order_id', 'quantity',
+                 'price', 'balance', 'trade_type', 'stoploss_price')
+
+    def __init__(self, pseudo_account, falcon_account=None, symbol=None, order_id=None, quantity=None,
+                 price=None, balance=None, trade_type=None, stoploss_price=None):
+        trade_type = getattr(trade_type, 'value', trade_type)  # TradeSignalType or plain str
+        self.pseudo_account = _intern(pseudo_account)
+        self.falcon_account = _intern(falcon_account)
+        self.symbol = _intern(symbol)
+        self.order_id = order_id
+        self.quantity = quantity
+        self.price = price
+        self.balance = balance
+        self.trade_type = _intern(trade_type.upper()) if isinstance(trade_type, str) else trade_type
+        self.stoploss_price = stoploss_price
+
+    @classmethod
+    def from_dict(cls, trade):
+        if isinstance(trade, cls):
+            return trade
+        return cls(**{field: trade.get(field) for field in cls.__slots__})
+
+    def to_dict(self):
+        """The persisted form; fields that were never set are left out."""
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except (AttributeError, TypeError):
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __eq__(self, other):
+        if not isinstance(other, OpenTrade):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return f"OpenTrade({self.to_dict()!r})"
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def footprint(*roots, skip=()) -> int:
+    """
+    Approximate bytes held by `roots` and everything reachable from them through
+    dicts, lists, tuples, sets, arrays, slots and plain objects. Shared
+    objects (interned strings, small ints) are counted once; instances of the
+    `skip` types are not counted at all.
+    """
+    seen = set()
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, skip):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(type(obj), '__slots__'):
+            stack.extend(getattr(obj, field, None) for field in type(obj).__slots__)
+        elif isinstance(obj, array):
+            pass  # getsizeof already covers the buffer
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+    return total
@@ -0,0 +1,213 @@
+import asyncio
+import math
+import threading
+import time
+from logger import logger
+from utils import broker_session, get_smart_api, setting, user_data
+
+# SmartWebSocketV2 exchange type codes
+EXCHANGE_TYPES = {
+    "NSE": 1,
+    "NFO": 2,
+    "BSE": 3,
+    "BFO": 4,
+    "MCX": 5,
+    "NCDEX": 7,
+    "CDS": 13,
+}
+EXCHANGE_NAMES = {code: name for name, code in EXCHANGE_TYPES.items()}
+
+
+_FINISHED = object()
+
+
+class FeedClosed(Exception):
+    """Raised by PriceFeed.ticks() once the feed has disconnected for good."""
+
+
+class PriceFeed:
+    """
+    Streaming LTP source for the stop-loss monitor.
+
+    Implementations call `publish` (from any thread) for every price update and
+    `close` when the connection is lost. Ticks are coalesced per instrument: if
+    the monitor falls behind, it sees the latest price of each instrument once
+    instead of working through a backlog of stale ones.
+
+    Liveness is tracked separately from ticks, since a quiet instrument sends
+    none: `heard` is called for every message, heartbeats included.
+    """
+
+    def __init__(self):
+        self.subscriptions: set[tuple[str, str]] = set()  # (exchange, token)
+        self._latest: dict[tuple[str, str], float] = {}
+        self._pending: asyncio.Queue = None
+        self._loop = None
+        self._loop_thread = None
+        self._closed = False
+        self._heard_at = None  # time.monotonic() of the last message, or of start() until the first one
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._pending = asyncio.Queue()
+        self._heard_at = time.monotonic()
+
+    def heard(self):
+        """Records that the feed is alive. Safe to call from the feed's own thread."""
+        self._heard_at = time.monotonic()
+
+    def silence(self) -> float:
+        """Seconds since the feed was last heard from; infinite once it has closed."""
+        if self._closed or self._heard_at is None:
+            return math.inf
+        return time.monotonic() - self._heard_at
+
+    async def stop(self):
+        self.close()
+
+    def subscribe(self, exchange: str, token: str):
+        key = (exchange, str(token))
+        if key not in self.subscriptions:
+            self.subscriptions.add(key)
+            self._send_subscribe([key])
+
+    def unsubscribe(self, exchange: str, token: str):
+        key = (exchange, str(token))
+        if key in self.subscriptions:
+            self.subscriptions.discard(key)
+            self._latest.pop(key, None)
+            self._send_unsubscribe([key])
+
+    def _send_subscribe(self, keys):
+        pass
+
+    def _send_unsubscribe(self, keys):
+        pass
+
+    def publish(self, exchange: str, token: str, ltp: float):
+        """Records a price update. Safe to call from the feed's own thread."""
+        if self._loop is None:
+            return
+        self.heard()
+        if threading.get_ident() == self._loop_thread:
+            self._publish(exchange, str(token), ltp)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, exchange, str(token), ltp)
+
+    def _publish(self, exchange, token, ltp):
+        key = (exchange, token)
+        if key not in self.subscriptions:
+            return
+        first_update = key not in self._latest
+        self._latest[key] = ltp
+        if first_update:
+            self._pending.put_nowait(key)
+
+    def close(self):
+        if self._closed or self._loop is None:
+            return
+        self._closed = True
+        self._loop.call_soon_threadsafe(self._pending.put_nowait, None)
+
+    def finish(self):
+        """Ends ticks() normally, e.g. once there is nothing left to monitor."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._pending.put_nowait, _FINISHED)
+
+    async def ticks(self):
+        """Yields (exchange, token, ltp) for each instrument whose price changed."""
+        while True:
+            key = await self._pending.get()
+            if key is _FINISHED:
+                return
+            if key is None:
+                raise FeedClosed()
+            ltp = self._latest.pop(key, None)
+            if ltp is not None:
+                yield key[0], key[1], ltp
+
+
+class FakePriceFeed(PriceFeed):
+    """In-process feed for tests and offline runs; prices are pushed by the caller."""
+
+    def push(self, exchange: str, token: str, ltp: float):
+        self.publish(exchange, token, ltp)
+
+
+class SmartWebSocketFeed(PriceFeed):
+    """SmartAPI WebSocket V2 feed in LTP mode. The socket runs in its own daemon thread."""
+
+    CORRELATION_ID = "falconrms"
+
+    def __init__(self, auth_token: str, api_key: str, client_code: str, feed_token: str):
+        super().__init__()
+        from SmartApi.smartWebSocketV2 import SmartWebSocketV2  # only needed in websocket mode
+        self._ws = SmartWebSocketV2(auth_token, api_key, client_code, feed_token)
+        self._ws.on_open = self._on_open
+        self._ws.on_data = self._on_data
+        self._ws.on_error = self._on_error
+        self._ws.on_close = self._on_close
+        self._ws.on_message = self._on_heartbeat  # "pong" replies to the client's pings every 10s
+        self._ws.on_control_message = self._on_heartbeat
+        self._connected = threading.Event()
+        self._thread = None
+
+    async def start(self):
+        await super().start()
+        self._thread = threading.Thread(target=self._run, name="smartapi-feed", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._ws.close_connection()
+        await super().stop()
+
+    def _run(self):
+        try:
+            self._ws.connect()
+        except Exception as e:
+            logger.exception("SmartAPI price feed stopped:", exc_info=e)
+        finally:
+            self.close()
+
+    def _on_open(self, wsapp):
+        self.heard()
+        self._connected.set()
+        self._send_subscribe(list(self.subscriptions))
+
+    def _on_data(self, wsapp, message):
+        exchange = EXCHANGE_NAMES.get(message.get('exchange_type'))
+        ltp = message.get('last_traded_price')
+        if exchange and ltp is not None:
+            self.publish(exchange, message['token'], ltp / 100)  # feed prices are in paise
+
+    def _on_heartbeat(self, wsapp, message):
+        self.heard()
+
+    def _on_error(self, *args):
+        logger.warning("SmartAPI price feed error: %s", args)
+
+    def _on_close(self, wsapp):
+        self._connected.clear()
+        self.close()
+
+    def _token_list(self, keys):
+        tokens = {}
+        for exchange, token in keys:
+            tokens.setdefault(EXCHANGE_TYPES[exchange], []).append(token)
+        return [{'exchangeType': code, 'tokens': codes} for code, codes in tokens.items()]
+
+    def _send_subscribe(self, keys):
+        if keys and self._connected.is_set():  # otherwise sent by _on_open
+            self._ws.subscribe(self.CORRELATION_ID, self._ws.LTP_MODE, self._token_list(keys))
+
+    def _send_unsubscribe(self, keys):
+        if keys and self._connected.is_set():
+            self._ws.unsubscribe(self.CORRELATION_ID, self._ws.LTP_MODE, self._token_list(keys))
+
+
+def create_smart_feed() -> SmartWebSocketFeed:
+    """Builds a feed from the current SmartAPI session, logging in first if needed."""
+    broker_session.ensure()
+    config = setting()
+    return SmartWebSocketFeed(user_data['jwtToken'], config.smart_api_key, config.smart_api_user, get_smart_api().getfeedToken())
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from enum import IntEnum
+from heapq import heappop, heappush
+from itertools import count
+
+# Broker endpoints with their own request limits
+ORDERS = "stocksdeveloper.orders"  # placeRegularOrder: entries and RMS exits
+MARGINS = "stocksdeveloper.margins"  # readPlatformMargins, and readPlatformOrders for unclear exits
+QUOTES = "smartapi.quotes"  # getMarketData
+SEARCH = "smartapi.search"  # searchScrip
+
+
+class Priority(IntEnum):
+    """Lower values are served first whenever callers are waiting on the same endpoint."""
+    EXIT = 0
+    ENTRY = 1
+    QUOTE = 2
+    LOOKUP = 3
+
+
+class TokenBucket:
+    """`rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float = None, timer=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.timer = timer
+        self.tokens = self.burst
+        self.updated = timer()
+
+    def take(self, keep: float = 0) -> float:
+        """Takes a token if more than `keep` would remain and returns 0, else returns seconds to wait."""
+        now = self.timer()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 + keep:
+            self.tokens -= 1
+            return 0.0
+        return (1 + keep - self.tokens) / self.rate
+
+
+class EndpointLimiter:
+    """
+    One endpoint's token bucket with a priority queue of waiting callers.
+
+    Waiters are granted strictly by priority, then arrival order. `reserve`
+    tokens of the burst can only be taken by Priority.EXIT, so a burst of entry
+    orders never leaves an exit waiting for the bucket to refill.
+    """
+
+    def __init__(self, rate: float, burst: float = None, reserve: float = 0, timer=time.monotonic):
+        self.bucket = TokenBucket(rate, (burst or max(1.0, rate)) + reserve, timer)
+        self.reserve = reserve
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = count()
+        self._wakeup: asyncio.TimerHandle = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def _keep(self, priority):
+        return 0 if priority == Priority.EXIT else self.reserve
+
+    async def acquire(self, priority: Priority):
+        if not self._waiters and not self.bucket.take(self._keep(priority)):
+            return  # fast path: nobody queued and a token is free
+
+        future = asyncio.get_running_loop().create_future()
+        heappush(self._waiters, (priority, next(self._seq), future))
+        self._dispatch()
+        await future
+
+    def _dispatch(self):
+        """Grants tokens to waiters in priority order; schedules itself for when the next token is due."""
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():  # caller was cancelled
+                heappop(self._waiters)
+                continue
+            delay = self.bucket.take(self._keep(priority))
+            if delay:
+                if self._wakeup is not None:
+                    self._wakeup.cancel()
+                self._wakeup = future.get_loop().call_later(delay, self._dispatch)
+                return
+            heappop(self._waiters)
+            future.set_result(None)
+        self._wakeup = None
+
+
+class BrokerScheduler:
+    """
+    Every outbound broker call awaits `acquire(endpoint, priority)` first, so
+    calls stay within each endpoint's per-second limit and, when the limit is
+    reached, protective exits go out before entries, entries before quotes and
+    quotes before symbol lookups. Endpoints without a configured limit pass
+    straight through.
+    """
+
+    def __init__(self, limits: dict = None, timer=time.monotonic, settings=None):
+        self.timer = timer
+        self.limiters: dict[str, EndpointLimiter] = {}
+        self._settings = settings  # callable returning Settings, applied on first acquire
+        for endpoint, (rate, reserve) in (limits or {}).items():
+            self.set_limit(endpoint, rate, reserve)
+
+    def set_limit(self, endpoint: str, rate: float, reserve: float = 0):
+        """Limits `endpoint` to `rate` requests per second; a rate of 0 removes the limit."""
+        if rate:
+            self.limiters[endpoint] = EndpointLimiter(rate, reserve=reserve, timer=self.timer)
+        else:
+            self.limiters.pop(endpoint, None)
+
+    def configure(self, config):
+        self._settings = None
+        self.set_limit(ORDERS, config.order_rate_limit, config.order_rate_reserve)
+        self.set_limit(MARGINS, config.margin_rate_limit)
+        self.set_limit(QUOTES, config.quote_rate_limit)
+        self.set_limit(SEARCH, config.search_rate_limit)
+        return self
+
+    async def acquire(self, endpoint: str, priority: Priority):
+        if self._settings is not None:
+            self.configure(self._settings())
+        limiter = self.limiters.get(endpoint)
+        if limiter is not None:
+            await limiter.acquire(priority)
+
+    def queued(self) -> dict:
+        """Waiting callers per endpoint."""
+        return {endpoint: len(limiter) for endpoint, limiter in self.limiters.items()}
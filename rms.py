@@ -1,67 +1,255 @@
 from typing import List, Dict
 from logger import logger
-import json
-import aiofiles
 import asyncio
+import time
+import metrics
 from models import TradeRequest, OrderType, ProductType
-from utils import get_symbol_info, fetch_price
+from utils import fetch_prices_scheduled, setting
+from trade_store import TradeStore, create_trade_store
+from token_index import token_index
+from stoploss_index import NetPosition, StopLossIndex
+from open_trade import OpenTrade
+from price_feed import PriceFeed, create_smart_feed
+from exit_executor import ExitExecutor
 
-async def load_trade_data(filename="trades.json"):
-    """Asynchronously loads trade data from the specified JSON file."""
-    try:
-        async with aiofiles.open(filename, 'r') as f:
-            contents = await f.read()
-            return json.loads(contents)
-    except FileNotFoundError:
-        return {}  # If file doesn't exist, start with an empty dictionary
+DEFAULT_EXCHANGE = "NSE"
+
+# Net positions of the open trades ordered by stop-loss level, kept in step with add_successful_trade/remove_trade
+stoploss_index = StopLossIndex()
+
+trade_store: TradeStore = None  # created and replayed on first use, see get_trade_store
+
+# Streaming mode only: the live feed and which symbols each (exchange, token) drives
+price_feed: PriceFeed = None
+feed_symbols: Dict[tuple, set] = {}
+unresolved_symbols: set = set()  # open symbols whose token lookup failed, retried every RESOLVE_RETRY_SECONDS
+RESOLVE_RETRY_SECONDS = 30
+
+last_tick_at: float = None  # time.monotonic() of the last stop-loss evaluation pass
+
+def tick_lag() -> float:
+    """Seconds since the monitor last evaluated prices, or 0 while nothing is open."""
+    if last_tick_at is None or trade_store is None or not trade_store.open_count:
+        return 0.0
+    return time.monotonic() - last_tick_at
+
+def last_tick_age() -> float:
+    """Seconds since the monitor last evaluated prices, or None if it hasn't yet."""
+    return None if last_tick_at is None else time.monotonic() - last_tick_at
+
+def feed_silence() -> float:
+    """Seconds since the streaming feed was last heard from, or None while polling."""
+    return price_feed.silence() if price_feed is not None else None
+
+def open_trade_count() -> int:
+    return trade_store.open_count if trade_store is not None else 0
+
+metrics.OPEN_TRADES.set_function(open_trade_count)
+metrics.OPEN_SYMBOLS.set_function(lambda: len(trade_store.trades) if trade_store is not None else 0)
+metrics.MONITOR_TICK_LAG_SECONDS.set_function(tick_lag)
+
+def get_trade_store() -> TradeStore:
+    global trade_store
+    if trade_store is None:
+        config = setting()
+        trade_store = create_trade_store(config.trade_store_backend, config.trade_store_path or None)
+        with metrics.TRADE_STORE_LOAD_SECONDS.time():
+            trade_store.load()
+        stoploss_index.rebuild(trade_store.trades)
+        logger.info("Loaded %d open trades (%d KiB in memory, %d KiB stop-loss index)", trade_store.open_count,
+                    trade_store.memory_footprint() // 1024, stoploss_index.memory_footprint() // 1024)
+    return trade_store
+
+def load_trade_data() -> Dict[str, List[OpenTrade]]:
+    """Returns the open trades by symbol. Served from memory; the store is replayed from disk only once."""
+    return get_trade_store().trades
 
-async def save_trade_data(trade_data, filename="trades.json"):
-    """Asynchronously saves the trade data dictionary to the specified JSON file."""
-    async with aiofiles.open(filename, 'w') as f:
-        await f.write(json.dumps(trade_data, indent=4)) 
+async def sync_trade_store():
+    """Waits until every trade store write so far is on disk."""
+    await asyncio.wrap_future(get_trade_store().flush())
 
+def stored_handoffs():
+    """Ids of the latest hand-off batches in the trade store, oldest first."""
+    return list(get_trade_store().handoffs)
 
-def add_successful_trade(open_trades : Dict, symbol: str, trade_data: List[Dict]):
-    open_trades[symbol] = open_trades.get(symbol, []) + trade_data
-    asyncio.run(save_trade_data(open_trades))
+def close_trade_store():
+    global trade_store
+    if trade_store is not None:
+        trade_store.close()
+        trade_store = None
+
+
+def add_successful_trade(symbol: str, trade_data: List[Dict]):
+    add_successful_trades({symbol: trade_data})
+
+
+def add_successful_trades(trades_by_symbol: Dict[str, List[Dict]], handoff: str = None):
+    """Opens trades on any number of symbols with one trade store write. `handoff` is the id of a batch from another worker."""
+    store = get_trade_store()
+    for symbol, trades in store.add_many(trades_by_symbol, handoff).items():
+        for trade in trades:
+            stoploss_index.add(symbol, trade)
+        for pseudo_account in dict.fromkeys(trade.pseudo_account for trade in trades):
+            if stoploss_index.flat(symbol, pseudo_account):  # offsetting BUY and SELL fills close each other
+                logger.info("%s is flat on %s, closing its trades", pseudo_account, symbol)
+                remove_trade(symbol, pseudo_account)
+        if price_feed is not None and symbol in store.trades:
+            asyncio.get_running_loop().create_task(subscribe_symbol(symbol))
 
 
 async def monitor_stop_losses():
     from main import get_trading_service
-    trading_service = get_trading_service()
+    config = setting()
+    exits = ExitExecutor(get_trading_service(), on_confirmed=exit_confirmed,
+                         workers=config.exit_workers, max_attempts=config.exit_max_attempts)
     try:
-        while True:
-            open_trades = await load_trade_data()
+        if config.price_feed == "websocket":
+            try:
+                # logs in and fetches the feed token: blocking broker calls, kept off the loop
+                feed = await asyncio.to_thread(create_smart_feed)
+                await stream_stop_losses(exits, feed)
+                return
+            except Exception as e:
+                logger.exception("Price feed failed, falling back to polling:", exc_info=e)
+        await poll_stop_losses(exits)
+    except Exception as e:
+        logger.exception("An error occurred during stop-loss monitoring:", exc_info=e)
+    finally:
+        await exits.drain()
 
-            if not open_trades:
-                break
 
-            for symbol, trades in open_trades.items():
-                current_price = fetch_latest_price(symbol)
+async def poll_stop_losses(exits: ExitExecutor):
+    while True:
+        if not load_trade_data():
+            break
 
-                if not current_price: #skip this iteration id getting the price of the symbol fails
-                    continue 
+        await poll_tick(exits)
 
-                for i in range(len(trades) - 1, -1, -1):  # Iterate backwards for removal
-                    trade = trades[i]
-                    if should_trigger_stoploss(trade, current_price):
-                        trade_signal = build_rms_trade_request(trade, current_price)
-                        res = trading_service.place_rms_order(trade_signal)
-                        if res['status']:
-                            remove_trade(open_trades, symbol, trade['pseudo_account'])
+        await asyncio.sleep(1) # Sleep for 1 second before the next tick
+
+
+async def poll_tick(exits: ExitExecutor):
+    """One polling pass: fetch prices for every indexed symbol and submit the exits they trigger."""
+    started = time.monotonic()
+    prices = await fetch_latest_prices(stoploss_index.symbols())
+
+    for symbol, current_price in prices.items():
+        evaluate_stop_losses(exits, symbol, current_price)
+    tick_done(started)
 
-                asyncio.sleep(1) # Sleep for 1 second before checking next symbol
-    except Exception as e:
-        logger.exception("An error occurred during stop-loss monitoring:", exc_info=e)
 
-def remove_trade(open_trades, symbol, pseudo_account):
-    if symbol in open_trades:
-        open_trades[symbol] = [
-            trade for trade in open_trades[symbol] if trade['pseudo_account'] != pseudo_account
-        ]
-        if not open_trades[symbol]:  # Remove the symbol if no trades left
-            del open_trades[symbol]
-        asyncio.run(save_trade_data(open_trades))    
+def tick_done(started: float):
+    global last_tick_at
+    last_tick_at = time.monotonic()
+    metrics.MONITOR_TICK_SECONDS.set(last_tick_at - started)
+
+
+async def stream_stop_losses(exits: ExitExecutor, feed: PriceFeed):
+    """
+    Event-driven monitoring: every tick from `feed` immediately evaluates the
+    stops of that symbol. Returns once no trades are open; raises FeedClosed if
+    the feed drops, so the caller can fall back to polling.
+    """
+    global price_feed
+    await feed.start()
+    price_feed = feed
+    retry = asyncio.create_task(retry_unresolved_symbols())
+    try:
+        for symbol in list(load_trade_data()):
+            await subscribe_symbol(symbol)
+
+        async for exchange, token, ltp in feed.ticks():
+            started = time.monotonic()
+            for symbol in tuple(feed_symbols.get((exchange, token), ())):
+                evaluate_stop_losses(exits, symbol, ltp)
+            tick_done(started)
+    finally:
+        retry.cancel()
+        price_feed = None
+        feed_symbols.clear()
+        unresolved_symbols.clear()
+        await feed.stop()
+
+
+async def subscribe_symbol(symbol: str, exchange: str = DEFAULT_EXCHANGE):
+    token = await token_index.resolve(symbol)
+    if price_feed is None:
+        return
+    if not token:
+        if symbol not in unresolved_symbols:
+            logger.warning("No token for %s, its stop-losses are not streamed until the lookup succeeds", symbol)
+        unresolved_symbols.add(symbol)
+        return
+    unresolved_symbols.discard(symbol)
+    feed_symbols.setdefault((exchange, token), set()).add(symbol)
+    price_feed.subscribe(exchange, token)
+
+
+async def retry_unresolved_symbols():
+    """Streaming mode: looks up the tokens that failed to resolve again, until every open symbol is subscribed."""
+    while True:
+        await asyncio.sleep(RESOLVE_RETRY_SECONDS)
+        for symbol in list(unresolved_symbols):
+            if symbol not in load_trade_data():
+                unresolved_symbols.discard(symbol)  # closed in the meantime
+                continue
+            try:
+                await subscribe_symbol(symbol)
+            except Exception as e:
+                logger.exception("Could not subscribe to %s:", symbol, exc_info=e)
+
+
+def unsubscribe_symbol(symbol: str, exchange: str = DEFAULT_EXCHANGE):
+    unresolved_symbols.discard(symbol)
+    token = token_index.get(symbol)
+    symbols = feed_symbols.get((exchange, token))
+    if not symbols:
+        return
+    symbols.discard(symbol)
+    if not symbols:
+        del feed_symbols[(exchange, token)]
+        price_feed.unsubscribe(exchange, token)
+
+
+def evaluate_stop_losses(exits: ExitExecutor, symbol: str, current_price: float):
+    if not current_price: #skip this symbol if getting its price failed
+        return
+
+    # Only the positions whose stop this price crosses, not every open trade. Each
+    # account's fills on a side of the symbol are netted, so a breach is one exit order.
+    # Exits run concurrently; positions already exiting are skipped by the executor.
+    for position in stoploss_index.crossed(symbol, current_price):
+        if exits.is_exiting(symbol, position):
+            continue
+        position = position.snapshot()  # fills that arrive while exiting stay open
+        if exits.submit(symbol, position, build_rms_trade_request(position, current_price)):
+            metrics.EXITS_TRIGGERED.inc()
+
+def exit_confirmed(symbol, position):
+    """Closes the fills the confirmed exit covered, in one store write when they are all the account holds there."""
+    if not isinstance(position, NetPosition):
+        remove_trade(symbol, position['pseudo_account'], position.get('order_id'))
+        return
+    current = stoploss_index.position(symbol, position.pseudo_account, position.trade_type)
+    opposite = stoploss_index.position(symbol, position.pseudo_account, 'SELL' if position.trade_type == 'BUY' else 'BUY')
+    covered = current is None or len(current.fills) == len(position.fills) and all(
+        fill is exited for fill, exited in zip(current.fills, position.fills))
+    if covered and opposite is None:
+        remove_trade(symbol, position.pseudo_account)
+        return
+    for fill in position.fills:
+        if fill.order_id is not None:  # None would close every trade of the account, see TradeStore.remove
+            remove_trade(symbol, position.pseudo_account, fill.order_id)
+
+def remove_trade(symbol, pseudo_account, order_id=None):
+    """Removes the account's trade `order_id` on `symbol`, or all of its trades on `symbol` if no order id is given."""
+    stoploss_index.remove(symbol, pseudo_account, order_id)
+    store = get_trade_store()
+    store.remove(symbol, pseudo_account, order_id)
+    if price_feed is not None and symbol not in store.trades:
+        unsubscribe_symbol(symbol)
+        if not store.trades:
+            price_feed.finish()  # nothing left to monitor
 
 
 def should_trigger_stoploss(trade, current_price):
@@ -88,49 +276,22 @@ def build_rms_trade_request(trade, current_price: float):
     )
     return trade_request
 
-def fetch_latest_price(symbol: str):
-    token = get_token_from_file(symbol)
-
-    if token:
-        price = fetch_price(token)  #implement fetch price
-        if price:
-            return price
-    else:
-        #token does not exist so fetch token then get price
-        token = get_symbol_info(symbol)
-        #fetch price after getting token and append token to token-symbol file
-        if token:
-            tokens_data = get_symbol_token_data()
-            tokens_data[symbol] = token
-            write_json_file(tokens_data)
-
-            price = fetch_price(token)
-            if price:
-                return price
-    return None
- 
-def get_symbol_token_data():
-    try:
-        return read_json_file()
-    except FileNotFoundError:
-        return {}
-    
-def read_json_file():
-    with open("symbol_tokens.json", 'r') as file:
-        return json.load(file)
-    
-def write_json_file(data):
-    with open("symbol_tokens.json", 'w') as file:
-        return json.dump(data, file, indent=4)
- 
-def get_token_from_file(symbol):
+async def fetch_latest_prices(symbols: List[str], exchange: str = DEFAULT_EXCHANGE) -> Dict[str, float]:
     """
-    Retrieves the token associated with the given symbol from the token data file.
-    Args:
-        symbol (str): The symbol to search for.
-    Returns:
-        str or bool: The token associated with the symbol if found, False otherwise.
+    Fetches the latest price of every symbol in batched market-data calls.
+
+    Tokens come from the in-memory token index; symbols without a token or
+    price are left out.
     """
-    tokens_data = get_symbol_token_data()
-    return tokens_data.get(symbol, False)
-   
\ No newline at end of file
+    tokens = await asyncio.gather(*(token_index.resolve(symbol) for symbol in symbols))
+    symbol_tokens = {symbol: token for symbol, token in zip(symbols, tokens) if token}
+
+    if not symbol_tokens:
+        return {}
+
+    prices = await fetch_prices_scheduled({exchange: list(set(symbol_tokens.values()))})
+    return {
+        symbol: prices[(exchange, token)]
+        for symbol, token in symbol_tokens.items()
+        if (exchange, token) in prices
+    }
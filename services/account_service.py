@@ -1,52 +1,107 @@
-import requests
-import os
+import asyncio
+import time
+import aiohttp
+import metrics
+from cache import TTLCache
 from models import Account
 from logger import logger
-from utils import setting
+from utils import broker_scheduler, setting
+from rate_limiter import MARGINS, Priority
 class AccountService:
-    def __init__(self, api_base_url: str):
+    """
+    Client for the users service and the broker margin API.
+
+    The active-accounts list is cached for `accounts_ttl` seconds. Once it is
+    older than that, callers still get the cached list for up to `stale_ttl`
+    seconds while a single background request refreshes it; concurrent callers
+    with nothing usable cached share one request. Per-account margins have their
+    own short-lived LRU cache.
+    """
+
+    def __init__(self, api_base_url: str, session: aiohttp.ClientSession, accounts_ttl: float = 2.0,
+                 stale_ttl: float = 30.0, margin_ttl: float = 5.0, margin_cache_size: int = 1024):
         self.api_base_url = api_base_url
+        self.session = session  # shared connection pool, owned by the app lifespan
+        self.accounts_ttl = accounts_ttl
+        self.stale_ttl = stale_ttl
+        self.margins = TTLCache(maxsize=margin_cache_size, ttl=margin_ttl)
+        self._accounts: list[Account] = None
+        self._accounts_fetched_at = 0.0
+        self._accounts_task: asyncio.Task = None
 
-    def get_active_accounts(self) -> list[Account]:
-        try:
-            url = self.api_base_url
+    async def get_active_accounts(self) -> list[Account]:
+        age = time.monotonic() - self._accounts_fetched_at
+        if self._accounts is not None and age < self.accounts_ttl + self.stale_ttl:
+            if age >= self.accounts_ttl:
+                self._refresh_accounts()  # stale: serve it now, revalidate in the background
+            return self._copy_accounts()
+
+        await asyncio.shield(self._refresh_accounts())
+        if time.monotonic() - self._accounts_fetched_at >= self.accounts_ttl + self.stale_ttl:
+            return []  # refresh failed and nothing recent enough is cached
+        return self._copy_accounts()
+
+    def invalidate_accounts(self):
+        self._accounts = None
+        self._accounts_fetched_at = 0.0
+
+    def invalidate_margins(self, pseudo_account: str = None):
+        if pseudo_account is None:
+            self.margins.clear()
+        else:
+            self.margins.pop(pseudo_account)
 
-            response = requests.get(url)
+    def _copy_accounts(self) -> list[Account]:
+        # Callers update account.fund with live margins, so never hand out the cached objects
+        return [account.model_copy() for account in self._accounts or []]
 
-            if response.status_code == 200:
-                accounts_data = response.json().get('accountslist')
-                return accounts_data
-            else:
-                return []
+    def _refresh_accounts(self) -> asyncio.Task:
+        if self._accounts_task is None or self._accounts_task.done():
+            self._accounts_task = asyncio.get_running_loop().create_task(self._fetch_accounts())
+        return self._accounts_task
 
-            #for testing
-            # return [Account(pseudoAccountName="NPG0001", fund=100000, accountId="VL580K", stoplosstype="number", stoploss=1000)]
+    async def _fetch_accounts(self):
+        try:
+            url = self.api_base_url
+
+            async with self.session.get(url) as response:
+                if response.status == 200:
+                    body = await response.json(content_type=None)
+                    accounts_data = body.get('accountslist') or []
+                    self._accounts = [Account.model_validate(account) for account in accounts_data]
+                    self._accounts_fetched_at = time.monotonic()
+                else:
+                    logger.warning("Users service returned HTTP %s", response.status)
         except Exception as e:
             logger.exception("An error occurred during get_active_accounts:", exc_info=e)
-        
-    def get_user_demat(self, id) -> float:
 
-        api_key = setting().stock_developers_api_key 
-        url = "https://api.stocksdeveloper.in/trading/readPlatformMargins"
+    async def get_user_demat(self, id) -> float:
+        demat_margin = self.margins.get(id)
+        if demat_margin is not None:
+            return demat_margin
+
+        api_key = setting().stock_developers_api_key
+        url = f"{setting().stocks_developer_url}/trading/readPlatformMargins"
         headers = {'api-key': api_key}
 
         data = {'pseudoAccount': id}
 
-        res = requests.get(url, headers=headers, data=data)
+        demat_margin = 0
 
-        if res.status == True and res.result != None:
+        await broker_scheduler.acquire(MARGINS, Priority.ENTRY)  # margin lookups only happen for entries
+        with metrics.GET_USER_DEMAT_SECONDS.time():
+            async with self.session.get(url, headers=headers, data=data) as res:
+                body = await res.json(content_type=None)
 
-            demat_margin = 0
+        if body.get('status') == True and body.get('result') != None:
 
-            for margin in res.result:
-                if margin.category == "EQUITY":
-                    demat_margin += margin.funds
-                    break 
+            for margin in body['result']:
+                if margin.get('category') == "EQUITY":
+                    demat_margin += margin.get('funds', 0)
+                    break
                 else:
                     continue
 
-        return demat_margin            
-
-
+            self.margins.set(id, demat_margin)
 
-        
\ No newline at end of file
+        return demat_margin
@@ -0,0 +1,23 @@
+import aiohttp
+from utils import setting
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    Creates the shared HTTP session used for every outbound broker call.
+
+    The connector keeps connections alive between requests, caps the number of
+    connections per host and caches DNS lookups, so an order fan-out across many
+    accounts reuses a handful of warm TLS connections instead of opening one per order.
+
+    Must be called from inside a running event loop (the FastAPI lifespan).
+    """
+    config = setting()
+    connector = aiohttp.TCPConnector(
+        limit=config.http_pool_limit,
+        limit_per_host=config.http_pool_limit_per_host,
+        ttl_dns_cache=config.http_dns_cache_ttl,
+        keepalive_timeout=config.http_keepalive_timeout,
+    )
+    timeout = aiohttp.ClientTimeout(total=config.http_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
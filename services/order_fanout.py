@@ -0,0 +1,128 @@
+import asyncio
+from logger import log_context, logger
+from models import Account, TradeSignal, TradeRequest, OrderType, ProductType
+
+
+def build_trade_request(account: Account, signal: TradeSignal, lot_size: int):
+    trade_request = TradeRequest(
+        pseudoAccount=account.pseudoAccountName,
+        symbol=signal.symbolname.lower(),
+        tradeType=signal.signal.upper(),
+        orderType=OrderType.market,
+        productType=ProductType.INTRADAY,
+        quantity=lot_size,
+        price=signal.price,
+        triggerPrice=0
+    )
+    return trade_request
+
+
+class OrderFanout:
+    """
+    Fans a signal out to every account in three stages:
+
+    1. margin lookups for all accounts, concurrently
+    2. lot sizes and stop-loss prices for all accounts in one vectorised pass
+    3. order placement for every account with a non-zero lot size, concurrently
+
+    At most `concurrency` broker calls are in flight per stage, so a signal costs
+    roughly one broker round-trip per stage no matter how many accounts are active,
+    and sizing stays a flat cost per signal instead of per-account Python work.
+
+    `progress`, if given, is told which accounts a run covers (`started(names)`)
+    and each account's result as soon as it is known (`finished(name, result)`).
+    """
+
+    def __init__(self, trading_service, account_service, concurrency: int = 50, progress=None):
+        self.trading_service = trading_service
+        self.account_service = account_service
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.progress = progress
+
+    async def run(self, accounts: list[Account], signal: TradeSignal) -> list[dict]:
+        return (await self.run_batch(accounts, [signal]))[0]
+
+    async def run_batch(self, accounts: list[Account], signals: list[TradeSignal]) -> list[list[dict]]:
+        """
+        Fans several signals out at once, loading each account's margin only once.
+        Signals are sized in order, each from what the previous ones left: the
+        notional of every sized order (quantity x signal price) is taken off the
+        account's funds before the next signal, as if the signals had arrived one
+        after another. The orders of all signals are placed concurrently.
+
+        Returns one list of per-account results for each signal, in order.
+        """
+        if self.progress is not None:
+            self.progress.started([account.pseudoAccountName for account in accounts])
+        failures = await asyncio.gather(*(self.load_margin(account) for account in accounts))
+        margin_failures = [failure for failure in failures if failure is not None]
+        self._report(margin_failures)
+        accounts = [account for account, failure in zip(accounts, failures) if failure is None]
+
+        batches = []
+        available = [account.fund for account in accounts]
+        for signal in signals:
+            sized = [account if fund == account.fund else account.model_copy(update={'fund': fund})
+                     for account, fund in zip(accounts, available)]
+            quantities, stoploss_prices = self.trading_service.size_orders(sized, signal)
+            results = [dict(failure) for failure in margin_failures]
+            tasks = []
+            for i, (account, quantity, stoploss_price) in enumerate(zip(sized, quantities, stoploss_prices)):
+                if quantity:
+                    available[i] = max(0.0, available[i] - quantity * signal.price)
+                    tasks.append(self.place_order(account, signal, quantity, stoploss_price))
+                else:
+                    results.append({
+                        'status': False,
+                        'account': account.pseudoAccountName,
+                        'message': f'No order for {account.pseudoAccountName}: margin too small for {signal.symbolname}'
+                    })
+            self._report(results[len(margin_failures):])
+            batches.append((results, tasks))
+
+        placed = await asyncio.gather(*(asyncio.gather(*tasks) for _, tasks in batches))
+        return [results + list(orders) for (results, _), orders in zip(batches, placed)]
+
+    def _report(self, results):
+        if self.progress is not None:
+            for result in results:
+                self.progress.finished(result['account'], result)
+
+    async def load_margin(self, account: Account):
+        """Refreshes account.fund from the broker. Returns a failure result if the lookup raised."""
+        async with self.semaphore:
+            with log_context(account=account.pseudoAccountName):
+                try:
+                    demat_margin = await self.account_service.get_user_demat(account.pseudoAccountName)
+                    if demat_margin:
+                        account.fund = demat_margin
+                    return None
+                except Exception as e:
+                    logger.exception("An error occurred reading margin for %s:", account.pseudoAccountName, exc_info=e)
+                    return {
+                        'status': False,
+                        'account': account.pseudoAccountName,
+                        'message': f'Order failed for {account.pseudoAccountName}: {str(e)}'
+                    }
+
+    async def place_order(self, account: Account, signal: TradeSignal, lot_size, stoploss_price):
+        async with self.semaphore:
+            with log_context(signal=signal.symbolname, account=account.pseudoAccountName):
+                try:
+                    trade_request = build_trade_request(account, signal, lot_size)
+                    result = await self.trading_service.place_order(trade_request, account)
+                    if result.get('status'):
+                        self.account_service.invalidate_margins(account.pseudoAccountName)  # margin was just used
+                        result['data']['stoploss_price'] = stoploss_price
+                    else:
+                        result.setdefault('account', account.pseudoAccountName)
+                except Exception as e:
+                    logger.exception("An error occurred placing order for %s:", account.pseudoAccountName, exc_info=e)
+                    result = {
+                        'status': False,
+                        'account': account.pseudoAccountName,
+                        'message': f'Order failed for {account.pseudoAccountName}: {str(e)}'
+                    }
+                if self.progress is not None:
+                    self.progress.finished(account.pseudoAccountName, result)
+                return result
@@ -0,0 +1,74 @@
+from models import TradeSignal, TradeType
+from instrument_master import instruments
+
+# Option lot rules matched by substring of the signal symbol: lot size, capital per lot.
+# Accounts get one lot per perLot of funds, rounded up. With an instrument master
+# loaded, the lot size comes from the contract instead.
+OPTION_LOT_SIZES = {
+    'banknifty': (15, 25000),
+    'finnifty': (40, 33000),
+    'nifty': (50, 33000),
+}
+DEFAULT_OPTION_PER_LOT = 25000
+MIN_OPTION_FUND = 100000  # accounts below this margin are not traded on option signals
+
+
+def option_lot_rule(symbolname: str):
+    """Returns (lot_size, per_lot) for the first matching option underlying, or None."""
+    instrument = instruments.option(symbolname)
+    if instrument is not None:
+        _, per_lot = OPTION_LOT_SIZES.get(instrument.name.lower(), (None, DEFAULT_OPTION_PER_LOT))
+        return instrument.lot_size, per_lot
+    symbolname = symbolname.lower()
+    for key, rule in OPTION_LOT_SIZES.items():
+        if key in symbolname:
+            return rule
+    return None
+
+
+def bulk_lot_sizes(signal: TradeSignal, funds):
+    """
+    Lot sizes for every account of a signal in one pass, following the same rules
+    as TradingService.calculate_lot_size and get_predefined_option_lot_size.
+    Accounts that must not be traded get 0.
+    """
+    import numpy as np  # deferred: only signals pay for the import, not startup
+    funds = np.asarray(funds, dtype=np.float64)
+
+    if signal.type == TradeType.equity:
+        return np.round(funds / signal.price, 1)
+
+    if signal.type == TradeType.option:
+        rule = option_lot_rule(signal.symbolname)
+        if rule:
+            lot_size, per_lot = rule
+            lot_sizes = np.ceil(funds / per_lot) * lot_size  # whole lots
+        else:
+            lot_sizes = np.ceil(funds / DEFAULT_OPTION_PER_LOT)
+        return np.where(funds < MIN_OPTION_FUND, 0, lot_sizes)
+
+    return np.zeros_like(funds)
+
+
+def bulk_stop_loss_prices(prices, quantities, is_buy, stoploss_types, stoploss_values, balances):
+    """
+    Vectorised calculate_stop_loss_price: 'number' stops risk a fixed amount per
+    trade, 'percentage' stops risk a percentage of the balance. Rows with an
+    unknown stop-loss type or zero quantity are NaN.
+    """
+    import numpy as np
+    prices = np.asarray(prices, dtype=np.float64)
+    quantities = np.asarray(quantities, dtype=np.float64)
+    is_buy = np.asarray(is_buy, dtype=bool)
+    stoploss_types = np.asarray(stoploss_types)
+    stoploss_values = np.asarray(stoploss_values, dtype=np.float64)
+    balances = np.asarray(balances, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        loss_per_share = np.select(
+            [stoploss_types == 'number', stoploss_types == 'percentage'],
+            [stoploss_values / quantities, balances * (stoploss_values / 100) / quantities],
+            default=np.nan,
+        )
+    stop_prices = np.where(is_buy, prices - loss_per_share, prices + loss_per_share)
+    return np.where(quantities > 0, stop_prices, np.nan)
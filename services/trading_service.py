@@ -1,10 +1,16 @@
-from utils import setting
-from models import TradeRequest, Account, TradeSignal
-import requests
+from utils import broker_scheduler, setting
+from rate_limiter import MARGINS, ORDERS, Priority
+from models import TradeRequest, Account, TradeSignal, SignalType, TradeType
+from services.sizing import DEFAULT_OPTION_PER_LOT, bulk_lot_sizes, bulk_stop_loss_prices, option_lot_rule
+import asyncio
 import math
 import aiohttp
+import metrics
 
 class TradingService:
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session  # shared connection pool, owned by the app lifespan
+
     def calculate_lot_size(self, account: Account, signal: TradeSignal):
         price = signal.price
         fund = account.fund
@@ -29,88 +35,141 @@ class TradingService:
             None
 
         """
-        lot_sizes = {
-            'banknifty': (15, 25000),  # quantity, perLot 
-            'finnifty': (40, 33000),
-            'nifty': (50, 33000),
-        }
-
         demat_balance = account.fund 
 
-        for key in lot_sizes:
-            if key.lower() in signal.symbolname.lower():
-                quantity, per_lot = lot_sizes[key]
-                calc = demat_balance / per_lot
-                lot_size = math.ceil(calc * quantity) 
-                return lot_size
+        rule = option_lot_rule(signal.symbolname)
+        if rule:
+            lot_size, per_lot = rule
+            lots = math.ceil(demat_balance / per_lot)
+            return lots * lot_size
 
-        lot_size = math.ceil(demat_balance / 25000)
+        lot_size = math.ceil(demat_balance / DEFAULT_OPTION_PER_LOT)
         return lot_size
 
+    def size_orders(self, accounts: list[Account], signal: TradeSignal):
+        """
+        Sizes a signal for every account in one vectorised pass.
+
+        Returns (quantities, stoploss_prices) aligned with `accounts`. A quantity of
+        0 means the account is not traded; the stop-loss price is None when the
+        account's stop-loss settings cannot produce one.
+        """
+        if not accounts:
+            return [], []
+
+        funds = [account.fund for account in accounts]
+        lot_sizes = bulk_lot_sizes(signal, funds)
+        stop_prices = bulk_stop_loss_prices(
+            prices=signal.price,
+            quantities=lot_sizes,
+            is_buy=signal.signal == SignalType.buy,
+            stoploss_types=[account.stoplosstype for account in accounts],
+            stoploss_values=[account.stoploss for account in accounts],
+            balances=funds,
+        )
+
+        cast = int if signal.type == TradeType.option else float
+        quantities = [cast(lot_size) for lot_size in lot_sizes]
+        stoploss_prices = [None if math.isnan(stop) else float(stop) for stop in stop_prices]
+        return quantities, stoploss_prices
+
     async def place_order(self, trade_request: TradeRequest, account: Account):
         api_key = setting().stock_developers_api_key  
-        url = "https://api.stocksdeveloper.in/trading/placeRegularOrder"
+        url = f"{setting().stocks_developer_url}/trading/placeRegularOrder"
         headers = {'api-key': api_key}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, data=trade_request.model_dump(mode="json")) as response:
+            await broker_scheduler.acquire(ORDERS, Priority.ENTRY)
+            with metrics.PLACE_ORDER_SECONDS.time():
+                async with self.session.post(url, headers=headers, data=trade_request.model_dump(mode="json")) as response:
                     response.raise_for_status()  # Ensure successful status
-                    api_response = await response.json()
-                    if api_response.get('status'):
-                        return {  # Return details on success
-                            'status': True,
-                            'data': {
-                                'order_id': api_response.get('result'),
-                                'account': account.pseudoAccountName,
-                                'account_id': account.accountId,
-                                'balance': account.fund,
-                                'symbol': trade_request.symbol,
-                                'trade_type': trade_request.tradeType,
-                                'quantity': trade_request.quantity,
-                                'price': trade_request.price,
-                                'stoplosstype': account.stoplosstype,
-                                'stoploss': account.stoploss
-                            }
-                        }
-                    else:
-                        return {
-                            'status': False,
-                            'message': api_response.get('message', 'API error')
-                        }
-                
-        except aiohttp.ClientError as e:
-            return {
-                'status': False,
-                'message': f'Cannot connect to API: {str(e)}'
-            }             
+                    api_response = await response.json(content_type=None)
+            if api_response.get('status'):
+                metrics.ENTRY_ORDERS_PLACED.inc()
+                return {  # Return details on success
+                    'status': True,
+                    'data': {
+                        'order_id': api_response.get('result'),
+                        'account': account.pseudoAccountName,
+                        'account_id': account.accountId,
+                        'balance': account.fund,
+                        'symbol': trade_request.symbol,
+                        'trade_type': trade_request.tradeType,
+                        'quantity': trade_request.quantity,
+                        'price': trade_request.price,
+                        'stoplosstype': account.stoplosstype,
+                        'stoploss': account.stoploss
+                    }
+                }
+            else:
+                metrics.ENTRY_ORDERS_FAILED.inc()
+                return {
+                    'status': False,
+                    'message': api_response.get('message', 'API error')
+                }
 
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # the session's ClientTimeout raises TimeoutError
+            metrics.ENTRY_ORDERS_FAILED.inc()
             return {
                 'status': False,
-                'message': f'Cannot connect to API: {str(e)}'
+                'message': f'Cannot connect to API: {str(e) or type(e).__name__}'
             }
-        
-    def place_rms_order(self, trade_request: TradeRequest):
+
+    async def place_rms_order(self, trade_request: TradeRequest):
         api_key =setting().stock_developers_api_key
-        url = "https://api.stocksdeveloper.in/trading/placeRegularOrder"
+        url = f"{setting().stocks_developer_url}/trading/placeRegularOrder"
         headers = {'api-key': api_key}
 
         try:
-            response = requests.post(url, headers=headers, data=trade_request.model_dump(mode="json"))
-            response.raise_for_status()  # Ensure successful status
-            api_response = response.json()
+            await broker_scheduler.acquire(ORDERS, Priority.EXIT)  # exits jump ahead of queued entries
+            with metrics.PLACE_RMS_ORDER_SECONDS.time():
+                async with self.session.post(url, headers=headers, data=trade_request.model_dump(mode="json")) as response:
+                    response.raise_for_status()  # Ensure successful status
+                    api_response = await response.json(content_type=None)
             if api_response.get('status'):
+                metrics.EXIT_ORDERS_PLACED.inc()
                 return {  # Return details on success
                     'status': True,
                 }
             else:
+                metrics.EXIT_ORDERS_FAILED.inc()
                 return {
                     'status': False,
                     'message': api_response.get('message', 'API error')
                 }
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # the session's ClientTimeout raises TimeoutError
+            metrics.EXIT_ORDERS_FAILED.inc()
+            # Only a request that never reached the broker, or that it refused outright, is known not to be
+            # placed. After a timeout or a dropped connection the broker may have accepted it: see find_rms_order.
+            refused = isinstance(e, aiohttp.ClientResponseError) and e.status < 500
             return {
                 'status': False,
-                'message': f'Cannot connect to API: {str(e)}'
+                'message': f'Cannot connect to API: {str(e) or type(e).__name__}',
+                'ambiguous': not refused and not isinstance(e, aiohttp.ClientConnectorError),
             }
+
+    async def find_rms_order(self, trade_request: TradeRequest, since: float):
+        """
+        Whether the broker holds an exit whose placement ended ambiguously: an order of the account
+        on the same symbol, side and quantity, placed (platformTime, epoch ms) at or after `since`
+        (epoch seconds) and not rejected or cancelled. Returns None if the order book can't be read.
+        """
+        url = f"{setting().stocks_developer_url}/trading/readPlatformOrders"
+        headers = {'api-key': setting().stock_developers_api_key}
+        try:
+            await broker_scheduler.acquire(MARGINS, Priority.EXIT)
+            async with self.session.get(url, headers=headers, data={'pseudoAccount': trade_request.pseudoAccount}) as response:
+                response.raise_for_status()
+                body = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+        if not body.get('status') or body.get('result') is None:
+            return None
+        for order in body['result']:
+            if (str(order.get('symbol', '')).lower() == trade_request.symbol.lower()
+                    and str(order.get('tradeType', '')).upper() == trade_request.tradeType.value
+                    and order.get('quantity') == trade_request.quantity
+                    and str(order.get('status', '')).upper() not in ('REJECTED', 'CANCELLED')
+                    and (order.get('platformTime') or 0) >= since * 1000):
+                return True
+        return False
@@ -0,0 +1,289 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from open_trade import OpenTrade, footprint
+
+
+class NetPosition:
+    """
+    All open fills of one account on one symbol and side, netted into a single position.
+
+    Quantities are summed as fills arrive, so merging an entry is O(1), and the
+    stop is the quantity-weighted mean stop of the fills (fills without a stop
+    don't count towards it). A breach exits the whole quantity with one order.
+    An account's BUY and SELL fills are separate positions, so each side's stop
+    still triggers. Item access mirrors OpenTrade, so a position can be exited
+    like a trade.
+    """
+
+    __slots__ = ('pseudo_account', 'trade_type', 'symbol', 'fills', 'indexed', 'quantity', '_stops', '_stop_quantity')
+
+    order_id = None  # a position spans several orders; exits are keyed by account, symbol and side
+
+    def __init__(self, pseudo_account, trade_type, fills=()):
+        self.pseudo_account = pseudo_account
+        self.trade_type = trade_type
+        self.symbol = None
+        self.fills = []
+        self.indexed = False  # filed in its SymbolStopIndex; positions are unfiled before they change
+        self._reset()
+        for fill in fills:
+            self.add(fill)
+
+    def _reset(self):
+        self.quantity = 0
+        self._stops = self._stop_quantity = 0
+
+    def add(self, fill: OpenTrade):
+        self.fills.append(fill)
+        if self.symbol is None:
+            self.symbol = fill.symbol
+        quantity = fill.quantity or 0
+        self.quantity += quantity
+        if fill.stoploss_price:
+            self._stops += fill.stoploss_price * quantity
+            self._stop_quantity += quantity
+
+    def remove(self, order_id):
+        """Drops the fill `order_id`. Returns it, or None if the position has no such fill."""
+        if order_id is None:
+            return None  # never a wildcard: fills without an id can't be told apart
+        for position, fill in enumerate(self.fills):
+            if fill.order_id == order_id:
+                break
+        else:
+            return None
+        fills = self.fills
+        del fills[position]
+        self.fills = []
+        self._reset()
+        for remaining in fills:  # rare (exits and replacements), so re-summing beats tracking float drift
+            self.add(remaining)
+        return fill
+
+    def snapshot(self) -> 'NetPosition':
+        """A copy with the current fills, so an exit closes only what it was sized for."""
+        return NetPosition(self.pseudo_account, self.trade_type, self.fills)
+
+    @property
+    def stoploss_price(self):
+        return self._stops / self._stop_quantity if self._stop_quantity else None
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __repr__(self):
+        return f"NetPosition({self.pseudo_account!r}, {self.trade_type} {self.quantity} @ stop {self.stoploss_price}, {len(self.fills)} fills)"
+
+
+class SortedStops:
+    """
+    One side's stop levels in ascending order, each paired with its position.
+
+    Entries live in blocks of at most 2 * `load`: a packed array of stops and a
+    parallel list of positions per block, plus the largest stop of each block.
+    An update bisects to its block and shifts only that block, so adding or
+    removing a position costs O(log n + load) however many are open, instead of
+    moving every entry behind it. Equal stops keep insertion order.
+    """
+
+    def __init__(self, load: int = 512):
+        self.load = load
+        self._stops: list[array] = []
+        self._positions: list[list] = []
+        self._maxes: list[float] = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def insert(self, stop_loss, position):
+        if not self._maxes:
+            self._stops.append(array('d', [stop_loss]))
+            self._positions.append([position])
+            self._maxes.append(stop_loss)
+            self._len = 1
+            return
+        block = min(bisect_right(self._maxes, stop_loss), len(self._maxes) - 1)
+        stops, positions = self._stops[block], self._positions[block]
+        index = bisect_right(stops, stop_loss)
+        stops.insert(index, stop_loss)
+        positions.insert(index, position)
+        self._maxes[block] = stops[-1]
+        self._len += 1
+        if len(stops) > 2 * self.load:  # split, so no block grows with the book
+            half = self.load
+            self._stops[block:block + 1] = [stops[:half], stops[half:]]
+            self._positions[block:block + 1] = [positions[:half], positions[half:]]
+            self._maxes[block:block + 1] = [stops[half - 1], stops[-1]]
+
+    def remove(self, stop_loss, position):
+        block = bisect_left(self._maxes, stop_loss)
+        index = bisect_left(self._stops[block], stop_loss)
+        while self._positions[block][index] is not position:  # step over equal stops
+            index += 1
+            if index == len(self._positions[block]):
+                block, index = block + 1, 0
+        stops, positions = self._stops[block], self._positions[block]
+        del stops[index]
+        del positions[index]
+        self._len -= 1
+        if stops:
+            self._maxes[block] = stops[-1]
+        else:
+            del self._stops[block], self._positions[block], self._maxes[block]
+
+    def from_stop(self, price) -> list:
+        """Positions with a stop at or above `price`."""
+        block = bisect_left(self._maxes, price)
+        if block == len(self._maxes):
+            return []
+        found = self._positions[block][bisect_left(self._stops[block], price):]
+        for positions in self._positions[block + 1:]:
+            found += positions
+        return found
+
+    def up_to(self, price) -> list:
+        """Positions with a stop at or below `price`."""
+        end = bisect_right(self._maxes, price)  # every stop of the blocks before `end` is <= price
+        found = []
+        for positions in self._positions[:end]:
+            found += positions
+        if end < len(self._maxes):
+            found += self._positions[end][:bisect_right(self._stops[end], price)]
+        return found
+
+
+class SymbolStopIndex:
+    """
+    Net positions of one symbol, kept sorted by stop level per side.
+
+    A long position triggers when the price falls to or below its stop, a short
+    one when the price rises to or above it, so the positions crossed by a price
+    are a suffix of the BUY stops and a prefix of the SELL stops. Finding them
+    costs O(log n + k) for k crossed positions, and filing or unfiling one costs
+    O(log n + load) (see SortedStops).
+
+    Adding a fill re-files its account's position on that side under the new
+    combined stop.
+    """
+
+    def __init__(self):
+        self._sides = {'BUY': SortedStops(), 'SELL': SortedStops()}
+        self._by_account: dict[str, dict[str, NetPosition]] = {}
+
+    def __len__(self):
+        return len(self._sides['BUY']) + len(self._sides['SELL'])
+
+    def __bool__(self):
+        return bool(self._by_account)
+
+    def position(self, pseudo_account, side) -> NetPosition:
+        return self._by_account.get(pseudo_account, {}).get(side)
+
+    def flat(self, pseudo_account) -> bool:
+        """True if the account's BUY and SELL fills cancel out, leaving nothing to protect."""
+        positions = self._by_account.get(pseudo_account, {})
+        buy, sell = positions.get('BUY'), positions.get('SELL')
+        return buy is not None and sell is not None and buy.quantity == sell.quantity
+
+    def add(self, trade: OpenTrade):
+        positions = self._by_account.setdefault(trade.pseudo_account, {})
+        position = positions.get(trade.trade_type)
+        if position is None:
+            position = positions[trade.trade_type] = NetPosition(trade.pseudo_account, trade.trade_type)
+        else:
+            self._unfile(position)
+            position.remove(trade.order_id)  # re-adding a fill replaces it
+        position.add(trade)
+        self._file(position)
+
+    def _file(self, position: NetPosition):
+        stop_loss = position.stoploss_price
+        if not stop_loss or position.trade_type not in self._sides:
+            return  # no usable stop: can never trigger
+        self._sides[position.trade_type].insert(stop_loss, position)
+        position.indexed = True
+
+    def _unfile(self, position: NetPosition):
+        if not position.indexed:
+            return
+        self._sides[position.trade_type].remove(position.stoploss_price, position)  # unchanged since _file
+        position.indexed = False
+
+    def discard(self, pseudo_account, order_id=None):
+        positions = self._by_account.get(pseudo_account)
+        if positions is None:
+            return
+        for side, position in list(positions.items()):
+            self._unfile(position)
+            if order_id is not None:
+                position.remove(order_id)
+            if order_id is None or not position.fills:
+                del positions[side]
+            else:
+                self._file(position)
+        if not positions:
+            del self._by_account[pseudo_account]
+
+    def crossed(self, price):
+        """Returns the positions whose combined stop-loss is breached at `price`."""
+        return self._sides['BUY'].from_stop(price) + self._sides['SELL'].up_to(price)
+
+
+class StopLossIndex:
+    """Per-symbol stop-loss indexes of the net positions of all open trades."""
+
+    def __init__(self):
+        self._symbols: dict[str, SymbolStopIndex] = {}
+
+    def __len__(self):
+        """Positions that can trigger."""
+        return sum(len(index) for index in self._symbols.values())
+
+    def symbols(self):
+        """Symbols with at least one position that can trigger, i.e. the ones worth pricing."""
+        return [symbol for symbol, index in self._symbols.items() if len(index)]
+
+    def add(self, symbol, trade):
+        """Merges a fill into its account's net position on `symbol` and the fill's side."""
+        index = self._symbols.get(symbol)
+        if index is None:
+            index = self._symbols[symbol] = SymbolStopIndex()
+        index.add(trade)
+
+    def position(self, symbol, pseudo_account, side) -> NetPosition:
+        index = self._symbols.get(symbol)
+        return index.position(pseudo_account, side) if index is not None else None
+
+    def flat(self, symbol, pseudo_account) -> bool:
+        index = self._symbols.get(symbol)
+        return index is not None and index.flat(pseudo_account)
+
+    def remove(self, symbol, pseudo_account, order_id=None):
+        """Drops one fill of the account, or all of its positions on `symbol` if no order id is given."""
+        index = self._symbols.get(symbol)
+        if index is None:
+            return
+        index.discard(pseudo_account, order_id)
+        if not index:
+            del self._symbols[symbol]
+
+    def crossed(self, symbol, price):
+        index = self._symbols.get(symbol)
+        return index.crossed(price) if index is not None else []
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the index itself; the trade records are owned by the trade store."""
+        return footprint(self._symbols, skip=(OpenTrade,))
+
+    def rebuild(self, open_trades):
+        """Adds every trade of an open-trades mapping; fills already indexed are replaced, not duplicated."""
+        for symbol, trades in open_trades.items():
+            for trade in trades:
+                self.add(symbol, trade)
@@ -0,0 +1,19 @@
+"""
+Placeholder values for the settings without defaults, so the suite runs without
+a .env or broker credentials. Environment variables take precedence over .env,
+and the tests never talk to the real services with these.
+"""
+import os
+import utils
+
+TEST_SETTINGS = {
+    'USERS_URL': 'http://users.test',
+    'SMART_API_USER': 'test',
+    'SMART_API_PASS': 'test',
+    'SMART_API_KEY': 'test',
+    'TOTP_KEY': 'JBSWY3DPEHPK3PXP',
+    'STOCK_DEVELOPERS_API_KEY': 'test',
+}
+
+os.environ.update(TEST_SETTINGS)
+utils.setting.cache_clear()
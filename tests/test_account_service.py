@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+from unittest import TestCase
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from services.account_service import AccountService
+
+ACCOUNT = {'pseudoAccountName': 'A1', 'fund': 100000, 'accountId': 'A1-id', 'stoplosstype': 'number', 'stoploss': 1000}
+
+class TestAccountService(TestCase):
+    def run_with_service(self, scenario, **kwargs):
+        hits = []
+
+        async def accounts(request):
+            hits.append(request.path)
+            await asyncio.sleep(0.01)
+            return web.json_response({'accountslist': [ACCOUNT]})
+
+        async def run():
+            app = web.Application()
+            app.router.add_get('/accounts', accounts)
+            async with TestServer(app) as server, aiohttp.ClientSession() as session:
+                service = AccountService(str(server.make_url('/accounts')), session, **kwargs)
+                await scenario(service)
+
+        asyncio.run(run())
+        return hits
+
+    def test_concurrent_callers_share_one_fetch(self):
+        async def scenario(service):
+            results = await asyncio.gather(*(service.get_active_accounts() for _ in range(5)))
+            self.assertTrue(all(result[0].pseudoAccountName == 'A1' for result in results))
+            results[0][0].fund = 1  # callers get copies
+            self.assertEqual((await service.get_active_accounts())[0].fund, 100000)
+
+        self.assertEqual(len(self.run_with_service(scenario)), 1)
+
+    def test_stale_list_is_served_while_revalidating(self):
+        async def scenario(service):
+            await service.get_active_accounts()
+            await asyncio.sleep(0.02)
+            self.assertEqual(len(await service.get_active_accounts()), 1)  # stale, answered from cache
+            await service._accounts_task
+
+        self.assertEqual(len(self.run_with_service(scenario, accounts_ttl=0.01)), 2)
+
+    def test_invalidate_forces_refetch(self):
+        async def scenario(service):
+            await service.get_active_accounts()
+            service.invalidate_accounts()
+            await service.get_active_accounts()
+
+        self.assertEqual(len(self.run_with_service(scenario)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
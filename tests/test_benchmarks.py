@@ -0,0 +1,59 @@
+import asyncio
+import csv
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from benchmarks.run import run_benchmarks
+from benchmarks.replay import read_ticks, replay, seed_trades
+
+class TestBenchmarks(TestCase):
+    def test_benchmark_harness_runs(self):
+        report = asyncio.run(run_benchmarks(accounts=[2], open_trades=[50], signals=2, symbols=5, ticks=2))
+
+        webhook, monitor, instrumentation, startup = report['results']
+        self.assertEqual(webhook['scenario'], 'webhook')
+        self.assertEqual(webhook['orders'], 4)
+        self.assertIn('p99_ms', webhook)
+        self.assertEqual(monitor['scenario'], 'monitor')
+        self.assertEqual(monitor['exits'] + monitor['remaining_trades'], 50)
+        self.assertIn('tick_p50_ms', monitor)
+        self.assertEqual(instrumentation['scenario'], 'instrumentation')
+        self.assertGreater(startup['import_main_ms'], 0)
+
+    def test_replay_triggers_stops_from_recorded_ticks(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'ticks.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['timestamp', 'symbol', 'ltp'])
+            writer.writerows([
+                ['2024-05-02T09:15:00', 'SBIN-EQ', 100], ['2024-05-02T09:15:01', 'INFY-EQ', 1500],
+                ['2024-05-02T09:15:02', 'SBIN-EQ', 96], ['2024-05-02T09:15:03', 'SBIN-EQ', 94],
+                ['2024-05-02T09:15:04', 'INFY-EQ', 1490],
+            ])
+
+        def trade(account, order_id, side, stop, quantity):
+            return {'pseudo_account': account, 'order_id': order_id, 'symbol': 'sbin-eq', 'trade_type': side,
+                    'stoploss_price': stop, 'quantity': quantity, 'price': 100}
+
+        open_trades = {'SBIN-EQ': [
+            trade('A1', '1', 'BUY', 95, 10),
+            trade('A2', '2', 'SELL', 105, 10),
+            trade('A3', '3', 'BUY', 97, 5), trade('A3', '4', 'BUY', 97, 5),  # one net position
+        ]}
+        report, orders = asyncio.run(replay(read_ticks([path]), open_trades, workdir=tmpdir.name))
+
+        self.assertEqual(report['ticks'], 5)
+        self.assertEqual(report['triggers'], 2)
+        self.assertEqual(report['remaining_trades'], 1)
+        self.assertIn('tick_p99_ms', report)
+        self.assertEqual([(o['account'], o['side'], o['quantity'], o['price']) for o in orders],
+                         [('A3', 'SELL', 10, 96), ('A1', 'SELL', 10, 94)])
+
+        seeded = seed_trades(read_ticks([path]), 10, stop_band=0.01)
+        self.assertEqual({symbol: len(trades) for symbol, trades in seeded.items()}, {'SBIN-EQ': 5, 'INFY-EQ': 5})
+
+if __name__ == '__main__':
+    unittest.main()
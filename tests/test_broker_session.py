@@ -0,0 +1,68 @@
+import base64
+import json
+import threading
+import time
+import unittest
+from unittest import TestCase, mock
+from broker_session import BrokerSession, jwt_expiry
+
+def make_jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+def login_response(jwt='jwt'):
+    return {'status': True, 'data': {'jwtToken': jwt, 'refreshToken': 'refresh', 'feedToken': 'feed'}}
+
+class TestBrokerSession(TestCase):
+    def test_jwt_expiry(self):
+        self.assertEqual(jwt_expiry('Bearer ' + make_jwt(1700000000)), 1700000000)
+        self.assertIsNone(jwt_expiry('not-a-jwt'))
+
+    def test_concurrent_callers_share_one_login(self):
+        def slow_login():
+            time.sleep(0.05)
+            return login_response()
+
+        login = mock.Mock(side_effect=slow_login)
+        session = BrokerSession(login, refresh=mock.Mock())
+        threads = [threading.Thread(target=session.ensure) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        login.assert_called_once()
+        self.assertTrue(session.active)
+
+    def test_auth_error_refreshes_and_retries_once(self):
+        session = BrokerSession(mock.Mock(return_value=login_response()), refresh=mock.Mock(return_value=login_response('jwt2')))
+        session.ensure()
+        method = mock.Mock(side_effect=[{'status': False, 'errorcode': 'AG8002'}, {'status': True, 'data': 'ok'}])
+
+        self.assertEqual(session.call(method, 'NSE'), {'status': True, 'data': 'ok'})
+        self.assertEqual(method.call_count, 2)
+        self.assertEqual(session.token_refreshes, 1)
+        self.assertEqual(session.user_data['jwtToken'], 'jwt2')
+
+        method = mock.Mock(return_value={'status': False, 'errorcode': 'AG8002'})
+        session.call(method, 'NSE')
+        self.assertEqual(method.call_count, 2)  # never more than one retry
+
+    def test_refresh_without_response_falls_back_to_login(self):
+        login = mock.Mock(return_value=login_response())
+        session = BrokerSession(login, refresh=mock.Mock(return_value=None))
+        session.ensure()
+        self.assertTrue(session.renew(session.generation))
+        self.assertEqual(login.call_count, 2)
+
+    def test_expiry_comes_from_the_jwt(self):
+        now = [1000.0]
+        session = BrokerSession(mock.Mock(return_value=login_response(make_jwt(2000))), refresh=mock.Mock(),
+                                timer=lambda: now[0])
+        session.ensure()
+        self.assertEqual(session.expires_at, 2000)
+        now[0] = 2001
+        self.assertFalse(session.active)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import math
+import unittest
+from unittest import TestCase, mock
+import main
+from health import HealthChecker
+
+class TestHealthChecker(TestCase):
+    def test_results_are_cached_per_dependency(self):
+        calls = []
+
+        async def accounts():
+            calls.append('accounts')
+            return ['A1']
+
+        async def smartapi():
+            raise ConnectionError('broker unreachable')
+
+        async def slow():
+            await asyncio.sleep(1)
+            return True
+
+        checker = HealthChecker({'accounts': accounts, 'smartapi': smartapi, 'slow': slow}, timeout=0.01, clock=lambda: 1000.0)
+        self.assertFalse(checker.ready)  # nothing checked yet
+        asyncio.run(checker.check_all())
+
+        self.assertEqual(calls, ['accounts'])
+        self.assertEqual((checker.results['accounts']['status'], checker.results['accounts']['last_success_at']), (True, 1000.0))
+        self.assertIsNotNone(checker.results['accounts']['latency_ms'])
+        self.assertEqual(checker.results['smartapi']['last_error'], 'ConnectionError: broker unreachable')
+        self.assertEqual(checker.results['slow']['last_error'], 'timed out after 0.01s')
+        self.assertFalse(checker.ready)
+
+    def test_falsy_result_is_down(self):
+        checker = HealthChecker({'accounts': mock.AsyncMock(return_value=[])})
+        asyncio.run(checker.check_all())
+        self.assertEqual(checker.results['accounts']['status'], False)
+        self.assertEqual(checker.results['accounts']['last_error'], 'check returned no result')
+
+class TestProbes(TestCase):
+    def setUp(self):
+        self.checker = HealthChecker({'accounts': mock.AsyncMock(return_value=['A1'])})
+        asyncio.run(self.checker.check_all())
+        mock.patch.object(main.app.state, 'health', self.checker, create=True).start()
+        mock.patch.object(main.app.state, 'coordinator', None, create=True).start()
+        mock.patch.object(main, 'setting', return_value=mock.Mock(monitor_max_tick_age=10, feed_max_silence=30)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_livez_does_no_checks(self):
+        self.assertEqual(asyncio.run(main.liveness()), {'status': True})
+
+    def test_readyz_reports_cached_checks_and_monitor(self):
+        with mock.patch.object(main, 'open_trade_count', return_value=0):
+            response = asyncio.run(main.readiness())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(asyncio.run(main.health_check())['status'])
+        self.checker.checks['accounts'].assert_awaited_once()  # probes are not re-run per request
+
+    def test_stalled_monitor_is_not_ready(self):
+        with mock.patch.object(main, 'open_trade_count', return_value=3), \
+                mock.patch.object(main, 'is_monitoring_running', True), \
+                mock.patch.object(main, 'tick_lag', return_value=42.0), \
+                mock.patch.object(main, 'last_tick_age', return_value=42.0):
+            report = main.readiness_report()
+            response = asyncio.run(main.readiness())
+        self.assertFalse(report['status'])
+        self.assertEqual((report['monitor']['role'], report['monitor']['tick_lag_s']), ('monitor', 42.0))
+        self.assertEqual(response.status_code, 503)
+
+    def test_streaming_monitor_is_ready_while_symbols_are_quiet(self):
+        with mock.patch.object(main, 'open_trade_count', return_value=3), \
+                mock.patch.object(main, 'is_monitoring_running', True), \
+                mock.patch.object(main, 'tick_lag', return_value=42.0), \
+                mock.patch.object(main, 'last_tick_age', return_value=42.0), \
+                mock.patch.object(main, 'feed_silence', return_value=4.0):  # heartbeats keep coming
+            report = main.readiness_report()
+        self.assertTrue(report['status'])
+        self.assertEqual((report['monitor']['mode'], report['monitor']['feed_silence_s']), ('stream', 4.0))
+
+    def test_silent_feed_is_not_ready(self):
+        for silence in (31.0, math.inf):  # no heartbeat for too long, or disconnected
+            with mock.patch.object(main, 'open_trade_count', return_value=3), \
+                    mock.patch.object(main, 'is_monitoring_running', True), \
+                    mock.patch.object(main, 'tick_lag', return_value=0.5), \
+                    mock.patch.object(main, 'last_tick_age', return_value=0.5), \
+                    mock.patch.object(main, 'feed_silence', return_value=silence):
+                self.assertFalse(main.readiness_report()['status'])
+
+if __name__ == '__main__':
+    unittest.main()
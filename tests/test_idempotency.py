@@ -0,0 +1,78 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from models import TradeSignal, TradeType
+from idempotency import IdempotencyCache
+
+def make_signal(price=100):
+    return TradeSignal(symbolname='SBIN-EQ', signal='buy', price=price, type=TradeType.equity, strategyname='test')
+
+class TestIdempotencyCache(TestCase):
+    def test_keys(self):
+        now = [1000.0]
+        cache = IdempotencyCache(ttl=60, clock=lambda: now[0])
+        self.assertEqual(cache.key_for(make_signal()), cache.key_for(make_signal()))
+        self.assertNotEqual(cache.key_for(make_signal()), cache.key_for(make_signal(price=101)))
+        self.assertEqual(cache.key_for(make_signal(), 'abc'), 'key:abc')
+        key = cache.key_for(make_signal())
+        now[0] += 60
+        self.assertNotEqual(cache.key_for(make_signal()), key)  # next time bucket
+
+    def test_concurrent_duplicates_share_one_run(self):
+        calls = []
+
+        async def execute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'status': True, 'data': len(calls)}
+
+        async def scenario():
+            cache = IdempotencyCache()
+            results = await asyncio.gather(*(cache.run('k', execute) for _ in range(5)))
+            results.append(await cache.run('k', execute))  # replay after completion
+            return results
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'status': True, 'data': 1}] * 6)
+
+    def test_failures_are_not_remembered(self):
+        attempts = []
+
+        async def execute():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError('broker down')
+            return {'status': True}
+
+        async def scenario():
+            cache = IdempotencyCache()
+            with self.assertRaises(RuntimeError):
+                await cache.run('k', execute)
+            return await cache.run('k', execute)
+
+        self.assertEqual(asyncio.run(scenario()), {'status': True})
+        self.assertEqual(len(attempts), 2)
+
+    def test_spill_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'idempotency.db')
+
+            async def execute():
+                return {'status': True, 'data': [{'order_id': '1'}]}
+
+            first = IdempotencyCache(spill_path=path)
+            asyncio.run(first.run('k', execute))
+            first.close()
+
+            async def fail():
+                raise AssertionError('should have been replayed')
+
+            second = IdempotencyCache(spill_path=path)
+            self.assertEqual(asyncio.run(second.run('k', fail)), {'status': True, 'data': [{'order_id': '1'}]})
+            second.close()
+
+if __name__ == '__main__':
+    unittest.main()
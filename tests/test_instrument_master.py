@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+import token_index
+from instrument_master import InstrumentIndex, build_index, iter_instruments
+from models import TradeSignal
+from services import sizing
+from token_index import SymbolTokenIndex
+
+MASTER = [
+    {"token": "3045", "symbol": "SBIN-EQ", "name": "SBIN", "expiry": "", "strike": "-1.000000", "lotsize": "1",
+     "instrumenttype": "", "exch_seg": "NSE", "tick_size": "5.000000"},
+    {"token": "1594", "symbol": "INFY-EQ", "name": "INFY", "expiry": "", "strike": "-1.000000", "lotsize": "1",
+     "instrumenttype": "", "exch_seg": "NSE", "tick_size": "5.000000"},
+    {"token": "500112", "symbol": "SBIN", "name": "SBIN", "expiry": "", "strike": "-1.000000", "lotsize": "1",
+     "instrumenttype": "", "exch_seg": "BSE", "tick_size": "5.000000"},
+    {"token": "46512", "symbol": "BANKNIFTY29MAY2448000CE", "name": "BANKNIFTY", "expiry": "29MAY2024",
+     "strike": "4800000.000000", "lotsize": "15", "instrumenttype": "OPTIDX", "exch_seg": "NFO", "tick_size": "5.000000"},
+]
+
+class TestInstrumentMaster(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.master_path = os.path.join(self.tmpdir.name, 'OpenAPIScripMaster.json')
+        self.index_path = os.path.join(self.tmpdir.name, 'instruments.idx')
+        with open(self.master_path, 'w') as f:
+            f.write('[\n' + ',\n  '.join(json.dumps(instrument) for instrument in MASTER) + '\n]\n')
+
+    def open_index(self):
+        index = InstrumentIndex()
+        self.assertTrue(index.load(self.master_path, self.index_path))
+        self.addCleanup(index.close)
+        return index
+
+    def test_streams_the_master_in_small_chunks(self):
+        self.assertEqual(list(iter_instruments(self.master_path, chunk_size=7)), MASTER)
+
+    def test_lookups(self):
+        index = self.open_index()
+        self.assertEqual(len(index), 4)
+
+        sbin = index.get('SBIN-EQ')
+        self.assertEqual((sbin.token, sbin.exchange, sbin.lot_size, sbin.tick_size), ('3045', 'NSE', 1, 0.05))
+        self.assertEqual(index.get('sbin', 'BSE').token, '500112')
+        self.assertIsNone(index.get('SBIN', 'NSE'))
+        self.assertIsNone(index.get('TCS-EQ'))
+
+        option = index.option('BANKNIFTY29MAY2448000CE')
+        self.assertEqual((option.exchange, option.name, option.lot_size), ('NFO', 'BANKNIFTY', 15))
+
+    def test_index_is_rebuilt_only_when_the_master_changes(self):
+        self.open_index().close()
+        with mock.patch('instrument_master.build_index') as build:
+            self.open_index()
+        build.assert_not_called()
+
+    def test_many_instruments_probe_correctly(self):
+        instruments = [{'token': str(i), 'symbol': f'SYM{i}-EQ', 'exch_seg': 'NSE', 'lotsize': '1'} for i in range(5000)]
+        self.assertEqual(build_index(instruments, self.index_path), 5000)
+        index = InstrumentIndex()
+        index.open(self.index_path)
+        self.addCleanup(index.close)
+        self.assertTrue(all(index.get(f'SYM{i}-EQ').token == str(i) for i in range(5000)))
+        self.assertIsNone(index.get('SYM5000-EQ'))
+
+    def test_tokens_and_lot_sizes_come_from_the_index(self):
+        index = self.open_index()
+        tokens = SymbolTokenIndex(filename=os.path.join(self.tmpdir.name, 'symbol_tokens.json'))
+        with mock.patch.object(token_index, 'instruments', index), \
+                mock.patch.object(sizing, 'instruments', index):
+            self.assertEqual(tokens.get('INFY-EQ'), '1594')
+            self.assertEqual(sizing.option_lot_rule('BANKNIFTY29MAY2448000CE'), (15, 25000))
+            self.assertEqual(sizing.option_lot_rule('FINNIFTY'), (40, 33000))  # not in the master: substring rules
+
+    def test_malformed_master_keeps_the_previous_index(self):
+        self.open_index().close()
+        with open(self.master_path, 'w') as f:
+            f.write(json.dumps(MASTER)[:200])  # truncated download
+        future = os.path.getmtime(self.index_path) + 60
+        os.utime(self.master_path, (future, future))
+
+        index = self.open_index()
+        self.assertEqual(index.get('SBIN-EQ').token, '3045')
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['OpenAPIScripMaster.json', 'instruments.idx'])
+
+        os.unlink(self.index_path)  # nothing to fall back to: startup goes on without an index
+        self.assertFalse(InstrumentIndex().load(self.master_path, self.index_path))
+
+    def test_unconfigured_underlyings_are_sized_by_contract_lot_size(self):
+        contract = {"token": "60012", "symbol": "MIDCPNIFTY27MAY2412000CE", "name": "MIDCPNIFTY", "lotsize": "75",
+                    "exch_seg": "NFO"}
+        build_index(MASTER + [contract], self.index_path)
+        index = InstrumentIndex()
+        index.open(self.index_path)
+        self.addCleanup(index.close)
+        funds = [100000, 250000]
+        with mock.patch.object(sizing, 'instruments', index):
+            # no configured capital per lot: one lot of the contract per DEFAULT_OPTION_PER_LOT
+            self.assertEqual(sizing.option_lot_rule('MIDCPNIFTY27MAY2412000CE'), (75, sizing.DEFAULT_OPTION_PER_LOT))
+            signal = TradeSignal(symbolname='MIDCPNIFTY27MAY2412000CE', signal='buy', price=100, type='option',
+                                 strategyname='s')
+            self.assertEqual(list(sizing.bulk_lot_sizes(signal, funds)), [300, 750])
+            # uneven funds still buy whole lots
+            uneven = [100001, 137500, 249999]
+            self.assertEqual(list(sizing.bulk_lot_sizes(signal, uneven)), [375, 450, 750])
+            for quantity in sizing.bulk_lot_sizes(signal, uneven):
+                self.assertEqual(quantity % 75, 0)
+            # missing from the index as well: one unit per DEFAULT_OPTION_PER_LOT, as before the index
+            self.assertIsNone(sizing.option_lot_rule('SENSEX24MAY75000CE'))
+            signal = TradeSignal(symbolname='SENSEX24MAY75000CE', signal='buy', price=100, type='option',
+                                 strategyname='s')
+            self.assertEqual(list(sizing.bulk_lot_sizes(signal, funds)), [4, 10])
+
+if __name__ == '__main__':
+    unittest.main()
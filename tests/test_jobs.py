@@ -0,0 +1,173 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from jobs import QueueFull, SignalJobQueue
+
+SIGNAL = {'symbolname': 'SBIN-EQ', 'signal': 'buy', 'price': 100}
+DEAD_OWNER = f'{os.getpid()}:1:{"0" * 32}'  # our pid, but a process that started (and died) long ago
+
+async def settle(queue, job_id):
+    for _ in range(100):
+        if queue.get(job_id)['state'] not in ('queued', 'running'):
+            return queue.get(job_id)
+        await asyncio.sleep(0)
+    raise AssertionError(f'job {job_id} did not finish')
+
+class TestSignalJobQueue(TestCase):
+    def test_reports_per_account_progress(self):
+        async def execute(signal, progress):
+            progress.started(['A1', 'A2'])
+            progress.finished('A1', {'status': True, 'data': {'order_id': 'o1', 'quantity': 5, 'stoploss_price': 98}})
+            self.assertEqual(progress.to_dict()['progress'], {'accounts': 2, 'done': 1})
+            progress.finished('A2', {'status': False, 'account': 'A2', 'message': 'margin too small'})
+            return {'status': True, 'data': [signal['symbolname']]}
+
+        async def scenario():
+            queue = SignalJobQueue(execute, workers=1)
+            await queue.start()
+            job = queue.submit(SIGNAL)
+            result = await settle(queue, job.id)
+            await queue.stop()
+            return result
+
+        result = asyncio.run(scenario())
+        self.assertEqual(result['state'], 'done')
+        self.assertEqual(result['result'], {'status': True, 'data': ['SBIN-EQ']})
+        self.assertEqual(result['accounts'], {
+            'A1': {'status': 'placed', 'order_id': 'o1', 'quantity': 5, 'stoploss_price': 98},
+            'A2': {'status': 'failed', 'message': 'margin too small'},
+        })
+
+    def test_bounded_queue_rejects_when_full(self):
+        async def scenario():
+            gate = asyncio.Event()
+
+            async def execute(signal, progress):
+                await gate.wait()
+
+            queue = SignalJobQueue(execute, workers=1, max_pending=1)
+            await queue.start()
+            running = queue.submit(SIGNAL)
+            await asyncio.sleep(0)  # the worker takes it off the queue
+            waiting = queue.submit(SIGNAL)
+            with self.assertRaises(QueueFull):
+                queue.submit(SIGNAL)
+            self.assertEqual(len(queue), 1)
+            gate.set()
+            states = [(await settle(queue, job.id))['state'] for job in (running, waiting)]
+            await queue.stop()
+            return states
+
+        self.assertEqual(asyncio.run(scenario()), ['done', 'done'])
+
+    def test_job_past_its_deadline_expires_unplaced(self):
+        now = [1000.0]
+        calls = []
+
+        async def execute(signal, progress):
+            calls.append(signal)
+
+        async def scenario():
+            queue = SignalJobQueue(execute, workers=1, deadline=30, clock=lambda: now[0])
+            await queue.start()
+            job = queue.submit(SIGNAL)
+            now[0] += 31  # e.g. stuck behind a backlog
+            result = await settle(queue, job.id)
+            await queue.stop()
+            return result
+
+        result = asyncio.run(scenario())
+        self.assertEqual(result['state'], 'expired')
+        self.assertEqual(calls, [])
+
+    def test_queued_jobs_survive_a_restart(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'signal_jobs.db')
+        calls = []
+
+        async def execute(signal, progress):
+            calls.append(signal)
+            return {'status': True}
+
+        async def scenario():
+            first = SignalJobQueue(execute, workers=0, path=path)
+            await first.start()
+            queued = first.submit(SIGNAL)
+            interrupted = first.submit(SIGNAL)
+            interrupted.state = 'running'  # as if the process died mid fan-out
+            first.owner, owner = DEAD_OWNER, first.owner
+            first._persist(interrupted)
+            first.owner = owner
+            await first.stop()
+
+            second = SignalJobQueue(execute, workers=1, path=path)
+            await second.start()
+            results = [await settle(second, job.id) for job in (queued, interrupted)]
+            await second.stop()
+            return results
+
+        queued, interrupted = asyncio.run(scenario())
+        self.assertEqual(queued['state'], 'done')
+        self.assertEqual(interrupted['state'], 'failed')
+        self.assertIn('interrupted', interrupted['error'])
+        self.assertEqual(calls, [SIGNAL])  # the interrupted job is not placed twice
+
+    def test_each_orphaned_job_is_claimed_once(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'signal_jobs.db')
+
+        async def execute(signal, progress):
+            return {'status': True}
+
+        async def scenario():
+            first = SignalJobQueue(execute, workers=0, path=path)
+            await first.start()
+            job = first.submit(SIGNAL)
+            await first.stop()  # released: owner is NULL
+
+            # two workers starting together both read the orphan before either claims it
+            workers = [SignalJobQueue(execute, workers=0, path=path) for _ in range(2)]
+            for number, worker in enumerate(workers):
+                worker.owner = f'worker-{number}'
+            claims = [worker._claim(job.id, 'queued', None) for worker in workers]
+            for worker in workers:
+                worker._db.close()
+            return claims
+
+        self.assertEqual(asyncio.run(scenario()), [True, False])
+
+    def test_jobs_of_a_previous_process_with_our_pid_are_recovered(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'signal_jobs.db')
+        calls = []
+
+        async def execute(signal, progress):
+            calls.append(signal)
+            return {'status': True}
+
+        async def scenario():
+            first = SignalJobQueue(execute, workers=0, path=path)
+            await first.start()
+            job = first.submit(SIGNAL)
+            # it died without releasing the job, and we were given its pid (e.g. PID 1 in a container)
+            first.owner = DEAD_OWNER
+            first._persist(job)
+            first._db.close()
+            first._db = None
+
+            second = SignalJobQueue(execute, workers=1, path=path)
+            await second.start()
+            result = await settle(second, job.id)
+            await second.stop()
+            return result
+
+        self.assertEqual(asyncio.run(scenario())['state'], 'done')
+        self.assertEqual(calls, [SIGNAL])
+
+if __name__ == '__main__':
+    unittest.main()
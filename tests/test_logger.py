@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import unittest
+from logging.handlers import QueueListener
+from unittest import TestCase
+from logger import ContextQueueHandler, JsonFormatter, RepeatFilter, TextFormatter, log_context
+
+class ListHandler(logging.Handler):
+    def __init__(self, formatter):
+        super().__init__()
+        self.setFormatter(formatter)
+        self.lines, self.threads = [], []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+class TestLoggingPipeline(TestCase):
+    def make_logger(self, formatter, repeat_filter=None):
+        records = queue.SimpleQueue()
+        handler = ListHandler(formatter)
+        listener = QueueListener(records, handler)
+        queue_handler = ContextQueueHandler(records)
+        if repeat_filter is not None:
+            queue_handler.addFilter(repeat_filter)
+        log = logging.getLogger('test_logger.%d' % id(handler))
+        log.setLevel(logging.INFO)
+        log.propagate = False
+        log.addHandler(queue_handler)
+        listener.start()
+        self.addCleanup(log.removeHandler, queue_handler)
+        return log, handler, listener
+
+    def test_records_are_written_by_the_listener_with_context(self):
+        log, handler, listener = self.make_logger(TextFormatter())
+
+        async def place(account):
+            with log_context(account=account):
+                await asyncio.sleep(0)
+                log.warning("order failed for %s", account)
+
+        async def scenario():
+            with log_context(signal='SBIN-EQ'):
+                await asyncio.gather(place('A1'), place('A2'))
+            log.warning("no context")
+
+        asyncio.run(scenario())
+        listener.stop()
+        self.assertEqual(handler.lines, [
+            'order failed for A1 [signal=SBIN-EQ account=A1]',
+            'order failed for A2 [signal=SBIN-EQ account=A2]',
+            'no context',
+        ])
+        self.assertNotIn(threading.current_thread(), handler.threads)
+
+    def test_json_records_carry_context_and_traceback(self):
+        log, handler, listener = self.make_logger(JsonFormatter())
+        with log_context(signal='SBIN-EQ', account='A1'):
+            try:
+                raise RuntimeError('broker down')
+            except RuntimeError as e:
+                log.exception("An error occurred placing order for %s:", 'A1', exc_info=e)
+        listener.stop()
+
+        entry = json.loads(handler.lines[0])
+        self.assertEqual(entry['message'], 'An error occurred placing order for A1:')
+        self.assertEqual((entry['level'], entry['signal'], entry['account']), ('ERROR', 'SBIN-EQ', 'A1'))
+        self.assertIn('RuntimeError: broker down', entry['exception'])
+
+    def test_repeated_errors_are_rate_limited(self):
+        now = [0.0]
+        log, handler, listener = self.make_logger(TextFormatter(), RepeatFilter(burst=3, window=60, clock=lambda: now[0]))
+
+        def fail(account):
+            log.error("order failed for %s", account)
+
+        for i in range(10):
+            fail('A%d' % i)
+            log.info("placed %d", i)  # below the limited level
+        now[0] = 61
+        fail('A10')
+        listener.stop()
+
+        errors = [line for line in handler.lines if line.startswith('order failed')]
+        self.assertEqual(errors, [
+            'order failed for A0', 'order failed for A1', 'order failed for A2',
+            'order failed for A10 (7 similar messages suppressed)',
+        ])
+        self.assertEqual(len(handler.lines) - len(errors), 10)
+
+if __name__ == '__main__':
+    unittest.main()
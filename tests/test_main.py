@@ -1,57 +1,201 @@
 import asyncio
+import unittest
 from unittest import TestCase, mock
 from models import TradeSignal, Account, TradeType
 from services import trading_service, account_service
-from main import process_trade_signal
+import main
+from fastapi import HTTPException
+from jobs import SignalJobQueue
+from main import get_job, process_trade_signal, process_trade_signals
+
+def make_signal(type, symbolname='SBIN-EQ'):
+    return TradeSignal(symbolname=symbolname, signal='buy', price=100, type=type, strategyname='test')
+
+def make_account(name, fund):
+    return Account(pseudoAccountName=name, fund=fund, accountId=name + '-id', stoplosstype='number', stoploss=1000)
+
+def order_result(trade_request, account):
+    return {
+        'status': True,
+        'data': {
+            'order_id': 'order-' + account.pseudoAccountName,
+            'account': account.pseudoAccountName,
+            'account_id': account.accountId,
+            'balance': account.fund,
+            'symbol': trade_request.symbol,
+            'trade_type': trade_request.tradeType,
+            'quantity': trade_request.quantity,
+            'price': trade_request.price,
+            'stoplosstype': account.stoplosstype,
+            'stoploss': account.stoploss
+        }
+    }
 
 class TestProcessTradeSignal(TestCase):
     def setUp(self):
         self.mock_trading_service = mock.Mock(spec=trading_service.TradingService)
         self.mock_account_service = mock.Mock(spec=account_service.AccountService)
+        self.mock_account_service.get_user_demat = mock.AsyncMock(return_value=0)
+        self.mock_trading_service.place_order = mock.AsyncMock(side_effect=order_result)
+        self.mock_trading_service.size_orders.side_effect = trading_service.TradingService(session=None).size_orders
+
+        mock.patch.object(main, 'get_trading_service', return_value=self.mock_trading_service).start()
+        mock.patch.object(main, 'get_account_service', return_value=self.mock_account_service).start()
+        mock.patch.object(main, 'start_monitoring').start()
+        self.add_successful_trades = mock.patch.object(main, 'add_successful_trades').start()
+        self.addCleanup(mock.patch.stopall)
 
     def test_process_trade_signal_equity(self):
-        signal = TradeSignal(type=TradeType.equity)
-        account1 = Account(fund=50000)
-        account2 = Account(fund=60000)
-        self.mock_account_service.get_active_accounts.return_value = [account1, account2]
-        self.mock_trading_service.calculate_lot_size.return_value = 10
-        self.mock_trading_service.place_order.return_value = {'pseudo_account': '123', 'falcon_account': '456'}
+        signal = make_signal(TradeType.equity)
+        account1 = make_account('A1', 50000)
+        account2 = make_account('A2', 60000)
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(return_value=[account1, account2])
 
-        result = asyncio.run(process_trade_signal(signal, self.mock_trading_service, self.mock_account_service))
+        result = asyncio.run(process_trade_signal(signal))
 
         self.assertTrue(result['status'])
-        self.assertEqual(result['data'], [{'pseudo_account': '123', 'falcon_account': '456'}])
+        self.assertEqual([trade['pseudo_account'] for trade in result['data']], ['A1', 'A2'])
+        self.assertEqual([trade['quantity'] for trade in result['data']], [500, 600])
+        self.assertEqual(result['data'][0]['stoploss_price'], 100 - 1000 / 500)
         self.mock_account_service.get_active_accounts.assert_called_once()
-        self.mock_trading_service.calculate_lot_size.assert_called_with(account1, signal)
-        self.mock_trading_service.place_order.assert_called_with(mock.ANY)
+        self.mock_trading_service.size_orders.assert_called_once_with([account1, account2], signal)
+        self.assertEqual(self.mock_trading_service.place_order.await_count, 2)
+        self.add_successful_trades.assert_called_once()
 
     def test_process_trade_signal_option(self):
-        signal = TradeSignal(type=TradeType.option)
-        account1 = Account(fund=150000)
-        account2 = Account(fund=200000)
-        self.mock_account_service.get_active_accounts.return_value = [account1, account2]
-        self.mock_trading_service.get_predefined_option_lot_size.return_value = 20
-        self.mock_trading_service.place_order.return_value = {'pseudo_account': '789', 'falcon_account': '012'}
+        signal = make_signal(TradeType.option, symbolname='BANKNIFTY')
+        account1 = make_account('A1', 150000)
+        account2 = make_account('A2', 50000)  # below the option margin floor, skipped
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(return_value=[account1, account2])
 
-        result = asyncio.run(process_trade_signal(signal, self.mock_trading_service, self.mock_account_service))
+        result = asyncio.run(process_trade_signal(signal))
 
         self.assertTrue(result['status'])
-        self.assertEqual(result['data'], [{'pseudo_account': '789', 'falcon_account': '012'}])
+        self.assertEqual([trade['pseudo_account'] for trade in result['data']], ['A1'])
+        self.assertEqual(result['data'][0]['quantity'], 90)
         self.mock_account_service.get_active_accounts.assert_called_once()
-        self.mock_trading_service.get_predefined_option_lot_size.assert_called_with(account1, signal)
-        self.mock_trading_service.place_order.assert_called_with(mock.ANY)
+        self.mock_trading_service.place_order.assert_awaited_once_with(mock.ANY, account1)
 
     def test_process_trade_signal_no_active_accounts(self):
-        signal = TradeSignal(type=TradeType.equity)
-        self.mock_account_service.get_active_accounts.return_value = []
+        signal = make_signal(TradeType.equity)
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(return_value=[])
 
-        result = asyncio.run(process_trade_signal(signal, self.mock_trading_service, self.mock_account_service))
+        result = asyncio.run(process_trade_signal(signal))
 
         self.assertFalse(result['status'])
         self.assertEqual(result['data'], 'No active accounts found')
         self.mock_account_service.get_active_accounts.assert_called_once()
-        self.mock_trading_service.calculate_lot_size.assert_not_called()
+        self.mock_trading_service.size_orders.assert_not_called()
         self.mock_trading_service.place_order.assert_not_called()
 
+class TestProcessTradeSignals(TestCase):
+    setUp = TestProcessTradeSignal.setUp
+
+    def test_batch_shares_accounts_margins_and_store_write(self):
+        equity = make_signal(TradeType.equity)
+        option = make_signal(TradeType.option, symbolname='BANKNIFTY')
+        account1 = make_account('A1', 150000)
+        account2 = make_account('A2', 50000)
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(return_value=[account1, account2])
+
+        result = asyncio.run(process_trade_signals([option, equity]))
+
+        self.assertTrue(result['status'])
+        self.assertEqual([item['symbol'] for item in result['data']], ['BANKNIFTY', 'SBIN-EQ'])
+        option_accounts, equity_accounts = (item['accounts'] for item in result['data'])
+        self.assertEqual(sorted((r['account'], r['status']) for r in option_accounts), [('A1', True), ('A2', False)])
+        self.assertEqual([(r['account'], r['status']) for r in equity_accounts], [('A1', True), ('A2', True)])
+        # A1's 90 option units at 100 are taken off its funds before the equity signal is sized
+        self.assertEqual([r['trade']['quantity'] for r in equity_accounts], [1410, 500])
+
+        self.mock_account_service.get_active_accounts.assert_called_once()
+        self.assertEqual(self.mock_account_service.get_user_demat.await_count, 2)  # once per account, not per signal
+        self.assertEqual(self.mock_trading_service.place_order.await_count, 3)
+        self.add_successful_trades.assert_called_once()
+        trades_by_symbol = self.add_successful_trades.call_args.args[0]
+        self.assertEqual({symbol: len(trades) for symbol, trades in trades_by_symbol.items()}, {'SBIN-EQ': 2, 'BANKNIFTY': 1})
+
+    def test_batch_sizes_each_signal_from_the_funds_left(self):
+        account = make_account('A1', 200000)
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(return_value=[account])
+        signals = [make_signal(TradeType.option, 'BANKNIFTY'), make_signal(TradeType.option, 'NIFTY')]
+
+        result = asyncio.run(process_trade_signals(signals))
+
+        banknifty, nifty = ([r['trade']['quantity'] for r in item['accounts']] for item in result['data'])
+        self.assertEqual(banknifty, [120])  # 8 lots of 15
+        self.assertEqual(nifty, [300])  # 188000 left: 6 lots of 50, not the 7 the full 200000 buys
+        balances = [call.args[1].fund for call in self.mock_trading_service.place_order.await_args_list]
+        self.assertCountEqual(balances, [200000, 188000])
+        self.assertEqual(account.fund, 200000)  # the account itself is left alone
+
+    def test_batch_reports_failed_accounts(self):
+        account1 = make_account('A1', 50000)
+        account2 = make_account('A2', 60000)
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(return_value=[account1, account2])
+        self.mock_account_service.get_user_demat = mock.AsyncMock(side_effect=[0, RuntimeError('timeout')])
+
+        result = asyncio.run(process_trade_signals([make_signal(TradeType.equity), make_signal(TradeType.equity, 'INFY-EQ')]))
+
+        sbin, infy = (item['accounts'] for item in result['data'])
+        self.assertEqual([(r['account'], r['status']) for r in sbin], [('A2', False), ('A1', True)])
+        # the SBIN order takes all of A1's funds, so nothing is left for INFY
+        self.assertEqual([(r['account'], r['status']) for r in infy], [('A2', False), ('A1', False)])
+        self.assertIn('margin too small', infy[1]['message'])
+        self.assertEqual(self.mock_trading_service.place_order.await_count, 1)
+
+class TestAsyncTradeSignal(TestCase):
+    def setUp(self):
+        TestProcessTradeSignal.setUp(self)
+        mock.patch.object(main.app.state, 'idempotency', None, create=True).start()
+        mock.patch.object(main.app.state, 'coordinator', None, create=True).start()
+
+    def run_with_jobs(self, scenario, **options):
+        async def run():
+            jobs = SignalJobQueue(main.run_signal_job, **options)
+            await jobs.start()
+            try:
+                with mock.patch.object(main.app.state, 'jobs', jobs, create=True):
+                    return await scenario(jobs)
+            finally:
+                await jobs.stop()
+        return asyncio.run(run())
+
+    def test_async_signal_is_accepted_and_tracked(self):
+        self.mock_account_service.get_active_accounts = mock.AsyncMock(
+            return_value=[make_account('A1', 50000), make_account('A2', 60000)])
+
+        async def scenario(jobs):
+            response = await process_trade_signal(make_signal(TradeType.equity), run_async=True)
+            self.assertEqual(response.status_code, 202)
+            job_id = response.headers['location'].rsplit('/', 1)[-1]
+            for _ in range(100):
+                job = await get_job(job_id)
+                if job['state'] == 'done':
+                    return job
+                await asyncio.sleep(0)
+
+        job = self.run_with_jobs(scenario, workers=1)
+
+        self.assertEqual(job['progress'], {'accounts': 2, 'done': 2})
+        self.assertEqual(job['accounts']['A2'], {'status': 'placed', 'order_id': 'order-A2', 'quantity': 600,
+                                                 'stoploss_price': 100 - 1000 / 600})
+        self.assertEqual([trade['pseudo_account'] for trade in job['result']['data']], ['A1', 'A2'])
+        self.add_successful_trades.assert_called_once()
+
+    def test_full_queue_asks_the_sender_to_retry(self):
+        async def scenario(jobs):
+            await process_trade_signal(make_signal(TradeType.equity), run_async=True)
+            with self.assertRaises(HTTPException) as raised:
+                await process_trade_signal(make_signal(TradeType.equity), run_async=True)
+            with self.assertRaises(HTTPException) as missing:
+                await get_job('no-such-job')
+            return raised.exception, missing.exception
+
+        full, missing = self.run_with_jobs(scenario, workers=0, max_pending=1)
+
+        self.assertEqual((full.status_code, full.headers), (503, {'Retry-After': '1'}))
+        self.assertEqual(missing.status_code, 404)
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,37 @@
+import asyncio
+import unittest
+from unittest import TestCase, mock
+from prometheus_client import REGISTRY
+from models import TradeSignal, TradeType
+from services import trading_service, account_service
+import main
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+class TestMetrics(TestCase):
+    def test_signal_latency_is_recorded(self):
+        account_service_mock = mock.Mock(spec=account_service.AccountService)
+        account_service_mock.get_active_accounts = mock.AsyncMock(return_value=[])
+        signal = TradeSignal(symbolname='SBIN-EQ', signal='buy', price=100, type=TradeType.equity, strategyname='test')
+        before = sample('falcon_signal_seconds_count')
+
+        with mock.patch.object(main, 'get_account_service', return_value=account_service_mock), \
+                mock.patch.object(main, 'get_trading_service', return_value=mock.Mock(spec=trading_service.TradingService)):
+            asyncio.run(main.process_trade_signal(signal))
+
+        self.assertEqual(sample('falcon_signal_seconds_count'), before + 1)
+
+    def test_metrics_endpoint_exposes_hot_paths(self):
+        response = asyncio.run(main.prometheus_metrics())
+        body = response.body.decode()
+
+        self.assertTrue(response.media_type.startswith('text/plain'))
+        for name in ['falcon_signal_seconds_bucket', 'falcon_broker_call_seconds_count{call="place_order"}',
+                     'falcon_trade_store_seconds_count{op="open"}', 'falcon_orders_total{kind="exit",status="failed"}',
+                     'falcon_exits_triggered_total', 'falcon_auth_refreshes_total{method="login"}',
+                     'falcon_open_trades', 'falcon_open_symbols', 'falcon_monitor_tick_lag_seconds']:
+            self.assertIn(name, body)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+from monitor_leader import MonitorCoordinator, MonitorLease
+
+class TestMonitorCoordinator(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def make(self, received, elected, handoff_timeout=5.0, **hooks):
+        return MonitorCoordinator(
+            self.path('monitor.lock'), self.path('monitor.sock'), self.path('monitor.spool'),
+            on_trades=lambda trades_by_symbol, handoff_id: received.extend(trades_by_symbol.items()),
+            on_elected=lambda: elected.append(True),
+            poll_interval=0.02, handoff_timeout=handoff_timeout, **hooks,
+        )
+
+    async def wait_for_leader(self, coordinator):
+        while not coordinator.is_leader:
+            await asyncio.sleep(0.01)
+
+    def test_lease_is_exclusive(self):
+        first, second = MonitorLease(self.path('monitor.lock')), MonitorLease(self.path('monitor.lock'))
+        self.assertTrue(first.try_acquire())
+        self.assertFalse(second.try_acquire())
+        first.release()
+        self.assertTrue(second.try_acquire())
+        second.release()
+
+    def test_followers_hand_off_and_take_over(self):
+        leader_trades, follower_trades, elected = [], [], []
+        trade = {'pseudo_account': 'A1', 'order_id': '1', 'trade_type': 'BUY', 'stoploss_price': 95}
+
+        async def scenario():
+            leader = self.make(leader_trades, elected)
+            follower = self.make(follower_trades, elected)
+            leader_task = asyncio.create_task(leader.run())
+            await self.wait_for_leader(leader)
+            follower_task = asyncio.create_task(follower.run())
+            await asyncio.sleep(0.05)
+            self.assertFalse(follower.is_leader)
+
+            await follower.submit('SBIN-EQ', [trade])
+            self.assertEqual(leader_trades, [('SBIN-EQ', [trade])])
+            await follower.submit_many({'TCS-EQ': [trade], 'ITC-EQ': [trade]})
+            self.assertEqual(leader_trades[1:], [('TCS-EQ', [trade]), ('ITC-EQ', [trade])])
+
+            leader_task.cancel()  # the leader dies; its lock goes with it
+            await asyncio.gather(leader_task, return_exceptions=True)
+            await asyncio.wait_for(self.wait_for_leader(follower), 1)
+            await follower.submit('INFY-EQ', [trade])
+            self.assertEqual(follower_trades, [('INFY-EQ', [trade])])
+
+            follower_task.cancel()
+            await asyncio.gather(follower_task, return_exceptions=True)
+
+        asyncio.run(scenario())
+        self.assertEqual(len(elected), 2)
+
+    def test_undeliverable_trades_are_spooled_for_the_next_leader(self):
+        received, elected = [], []
+        trade = {'pseudo_account': 'A1', 'order_id': '1'}
+
+        async def scenario():
+            with open(self.path('monitor.spool'), 'w') as f:  # spooled by a version without batches
+                f.write(json.dumps({'symbol': 'INFY-EQ', 'trades': [trade]}) + '\n')
+            lease = MonitorLease(self.path('monitor.lock'))
+            lease.try_acquire()  # a leader that holds the lock but never answers
+            worker = self.make(received, elected, handoff_timeout=0.1)
+            await worker.submit('SBIN-EQ', [trade])
+            self.assertEqual(received, [])
+            lease.release()
+
+            task = asyncio.create_task(worker.run())
+            await asyncio.wait_for(self.wait_for_leader(worker), 1)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+        self.assertEqual(received, [('INFY-EQ', [trade]), ('SBIN-EQ', [trade])])
+
+    def test_late_acknowledged_handoff_is_not_replayed(self):
+        received, elected = [], []
+        trade = {'pseudo_account': 'A1', 'order_id': '1'}
+
+        async def scenario():
+            leader = self.make(received, elected)
+            task = asyncio.create_task(leader.run())
+            await self.wait_for_leader(leader)
+            follower = self.make([], elected, handoff_timeout=0.1)
+            deliver = follower._deliver
+
+            async def late_ack(message):
+                await deliver(message)  # the leader has stored the trades...
+                await asyncio.sleep(1)  # ...but the follower gives up first and spools them
+
+            with mock.patch.object(follower, '_deliver', late_ack):
+                await follower.submit('SBIN-EQ', [trade])
+            self.assertTrue(os.path.getsize(self.path('monitor.spool')))
+            await asyncio.sleep(0.1)  # the leader replays the spool
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+        self.assertEqual(received, [('SBIN-EQ', [trade])])
+        self.assertEqual(os.path.getsize(self.path('monitor.spool')), 0)
+
+    def test_ack_waits_until_the_trades_are_on_disk(self):
+        received, elected = [], []
+        trade = {'pseudo_account': 'A1', 'order_id': '1'}
+
+        async def scenario():
+            on_disk = asyncio.Event()
+            leader = self.make(received, elected, sync=on_disk.wait)
+            task = asyncio.create_task(leader.run())
+            await self.wait_for_leader(leader)
+            follower = self.make([], elected)
+            submitted = asyncio.create_task(follower.submit('SBIN-EQ', [trade]))
+            await asyncio.sleep(0.1)
+            self.assertEqual(received, [('SBIN-EQ', [trade])])
+            self.assertFalse(submitted.done())  # stored, but not yet durable
+            on_disk.set()
+            await asyncio.wait_for(submitted, 1)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+
+    def test_new_leader_skips_batches_its_predecessor_stored(self):
+        received, elected = [], []
+        trade = {'pseudo_account': 'A1', 'order_id': '1'}
+
+        async def scenario():
+            with open(self.path('monitor.spool'), 'w') as f:
+                # the old leader stored 'stored' and died before acking; the follower spooled it
+                f.write(json.dumps({'id': 'stored', 'batch': {'SBIN-EQ': [trade]}}) + '\n')
+                f.write(json.dumps({'id': 'fresh', 'batch': {'INFY-EQ': [trade]}}) + '\n')
+            leader = self.make(received, elected, handled=lambda: ['stored'])
+            task = asyncio.create_task(leader.run())
+            await asyncio.wait_for(self.wait_for_leader(leader), 1)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+        self.assertEqual(received, [('INFY-EQ', [trade])])
+
+if __name__ == '__main__':
+    unittest.main()
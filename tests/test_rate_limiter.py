@@ -0,0 +1,61 @@
+import asyncio
+import time
+import unittest
+from unittest import TestCase
+from rate_limiter import BrokerScheduler, EndpointLimiter, Priority, TokenBucket, ORDERS
+
+class TestTokenBucket(TestCase):
+    def test_refills_at_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=2, timer=lambda: now[0])
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 0.5)
+        now[0] = 0.5
+        self.assertEqual(bucket.take(), 0)
+
+class TestBrokerScheduler(TestCase):
+    def test_exits_are_served_before_queued_entries(self):
+        order = []
+
+        async def call(scheduler, priority, name):
+            await scheduler.acquire(ORDERS, priority)
+            order.append(name)
+
+        async def scenario():
+            scheduler = BrokerScheduler({ORDERS: (50, 0)})
+            entries = [asyncio.create_task(call(scheduler, Priority.ENTRY, f'entry{i}')) for i in range(60)]
+            await asyncio.sleep(0)  # the burst goes out, the rest queue up
+            exit = asyncio.create_task(call(scheduler, Priority.EXIT, 'exit'))
+            await asyncio.gather(exit, *entries)
+
+        asyncio.run(scenario())
+        self.assertEqual(order.index('exit'), 50)  # first call after the burst
+
+    def test_reserve_is_kept_for_exits(self):
+        async def scenario():
+            limiter = EndpointLimiter(rate=1, burst=3, reserve=1)
+            for _ in range(3):
+                await limiter.acquire(Priority.ENTRY)
+            started = time.monotonic()
+            await limiter.acquire(Priority.EXIT)  # the reserved token, no wait
+            return time.monotonic() - started
+
+        self.assertLess(asyncio.run(scenario()), 0.05)
+
+    def test_rate_is_respected(self):
+        async def scenario():
+            scheduler = BrokerScheduler({ORDERS: (100, 0)})
+            started = time.monotonic()
+            await asyncio.gather(*(scheduler.acquire(ORDERS, Priority.QUOTE) for _ in range(120)))
+            return time.monotonic() - started
+
+        self.assertGreaterEqual(asyncio.run(scenario()), 0.18)  # 100 burst + 20 at 100/s
+
+    def test_unlimited_endpoints_pass_through(self):
+        scheduler = BrokerScheduler()
+        asyncio.run(scheduler.acquire('anything', Priority.LOOKUP))
+        self.assertEqual(scheduler.queued(), {})
+
+if __name__ == '__main__':
+    unittest.main()
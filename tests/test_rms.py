@@ -0,0 +1,640 @@
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase, mock
+import rms
+import utils
+import token_index
+from token_index import SymbolTokenIndex
+from stoploss_index import SortedStops, StopLossIndex
+from open_trade import OpenTrade, footprint
+from trade_store import JournalTradeStore, SqliteTradeStore, TradeStore
+from price_feed import FakePriceFeed
+from exit_executor import ExitExecutor
+
+def market_data(mode, exchange_tokens):
+    fetched = [
+        {'exchange': exchange, 'symbolToken': token, 'ltp': float(token)}
+        for exchange, tokens in exchange_tokens.items() for token in tokens
+    ]
+    return {'status': True, 'data': {'fetched': fetched, 'unfetched': []}}
+
+class TestFetchPrices(TestCase):
+    def setUp(self):
+        mock.patch.object(utils.broker_session, 'ensure', return_value=True).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_fetch_prices_chunks_tokens(self):
+        tokens = {'NSE': [str(i) for i in range(1, 61)], 'NFO': ['1001']}
+        with mock.patch.object(utils, 'smartApi') as smart_api:
+            smart_api.getMarketData.side_effect = market_data
+            prices = utils.fetch_prices(tokens)
+
+        self.assertEqual(smart_api.getMarketData.call_count, 2)
+        for call in smart_api.getMarketData.call_args_list:
+            self.assertLessEqual(sum(len(t) for t in call.args[1].values()), utils.MAX_QUOTE_TOKENS)
+        self.assertEqual(len(prices), 61)
+        self.assertEqual(prices[('NFO', '1001')], 1001.0)
+
+    def test_fetch_latest_prices_maps_symbols(self):
+        index = SymbolTokenIndex(filename='unused.json')
+        index._loaded = True
+        index._tokens = {'SBIN-EQ': '3045', 'INFY-EQ': '1594'}
+        with mock.patch.object(rms, 'token_index', index), \
+                mock.patch.object(utils, 'smartApi') as smart_api:
+            smart_api.getMarketData.side_effect = market_data
+            prices = asyncio.run(rms.fetch_latest_prices(['SBIN-EQ', 'INFY-EQ']))
+
+        smart_api.getMarketData.assert_called_once()
+        self.assertEqual(prices, {'SBIN-EQ': 3045.0, 'INFY-EQ': 1594.0})
+
+class TestSymbolTokenIndex(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.filename = os.path.join(self.tmpdir.name, 'symbol_tokens.json')
+        with open(self.filename, 'w') as file:
+            json.dump({'SBIN-EQ': '3045'}, file)
+
+    def test_lookups_are_served_from_memory(self):
+        index = SymbolTokenIndex(filename=self.filename)
+        index.load()
+        os.remove(self.filename)
+        self.assertEqual(index.get('SBIN-EQ'), '3045')
+
+    def test_unknown_symbols_are_cached_negatively(self):
+        index = SymbolTokenIndex(filename=self.filename)
+        lookup = mock.AsyncMock(return_value=None)
+        with mock.patch.object(token_index, 'get_symbol_info', lookup):
+            self.assertIsNone(asyncio.run(index.resolve('NOPE-EQ')))
+            self.assertIsNone(asyncio.run(index.resolve('NOPE-EQ')))
+        lookup.assert_awaited_once()
+
+    def test_failed_searches_are_not_cached(self):
+        index = SymbolTokenIndex(filename=self.filename, flush_delay=0)
+
+        async def resolve_twice():
+            tokens = [await index.resolve('INFY-EQ'), await index.resolve('INFY-EQ')]
+            await index.close()
+            return tokens
+
+        lookup = mock.AsyncMock(side_effect=[RuntimeError('session expired'), '1594'])
+        with mock.patch.object(token_index, 'get_symbol_info', lookup):
+            self.assertEqual(asyncio.run(resolve_twice()), [None, '1594'])
+        self.assertEqual(lookup.await_count, 2)
+
+    def test_new_tokens_are_persisted_in_background(self):
+        index = SymbolTokenIndex(filename=self.filename, flush_delay=0)
+
+        async def resolve_and_wait():
+            token = await index.resolve('INFY-EQ')
+            await index._flush_task
+            return token
+
+        with mock.patch.object(token_index, 'get_symbol_info', mock.AsyncMock(return_value='1594')):
+            self.assertEqual(asyncio.run(resolve_and_wait()), '1594')
+        with open(self.filename) as file:
+            self.assertEqual(json.load(file), {'SBIN-EQ': '3045', 'INFY-EQ': '1594'})
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+    def test_concurrent_misses_share_one_search(self):
+        index = SymbolTokenIndex(filename=self.filename, flush_delay=0)
+
+        async def search(symbol):
+            await asyncio.sleep(0.01)
+            return '1594'
+
+        async def resolve_together():
+            tokens = await asyncio.gather(*(index.resolve('INFY-EQ') for _ in range(5)))
+            await index.close()
+            return tokens
+
+        lookup = mock.AsyncMock(side_effect=search)
+        with mock.patch.object(token_index, 'get_symbol_info', lookup):
+            self.assertEqual(asyncio.run(resolve_together()), ['1594'] * 5)
+        lookup.assert_awaited_once_with('INFY-EQ')
+
+    def test_tokens_set_during_a_write_are_flushed_again(self):
+        index = SymbolTokenIndex(filename=self.filename, flush_delay=0)
+        writing, release = threading.Event(), threading.Event()
+        write = index._write
+
+        def slow_write(data):
+            writing.set()
+            release.wait(5)
+            write(data)
+
+        async def set_while_writing():
+            index.set('INFY-EQ', '1594')
+            await asyncio.to_thread(writing.wait, 5)
+            index.set('TCS-EQ', '11536')  # lands after the first snapshot was taken
+            release.set()
+            await index._flush_task
+
+        with mock.patch.object(index, '_write', slow_write):
+            asyncio.run(set_while_writing())
+        with open(self.filename) as file:
+            self.assertEqual(json.load(file), {'SBIN-EQ': '3045', 'INFY-EQ': '1594', 'TCS-EQ': '11536'})
+
+def make_trade(account, order_id, trade_type, stoploss_price, quantity=1):
+    return {'pseudo_account': account, 'order_id': order_id, 'trade_type': trade_type, 'stoploss_price': stoploss_price,
+            'quantity': quantity}
+
+def as_dicts(trades):
+    return {symbol: [trade.to_dict() for trade in symbol_trades] for symbol, symbol_trades in trades.items()}
+
+class TestStopLossIndex(TestCase):
+    def test_crossed_matches_should_trigger_stoploss(self):
+        rng = random.Random(7)
+        trades = [
+            OpenTrade.from_dict(make_trade('A%d' % i, str(i), rng.choice(['BUY', 'SELL']), round(rng.uniform(90, 110), 2)))
+            for i in range(500)
+        ]
+        index = StopLossIndex()
+        for trade in trades:
+            index.add('SBIN-EQ', trade)
+
+        for price in [85, 95.5, 100, 104.25, 115]:
+            expected = [t['pseudo_account'] for t in trades if rms.should_trigger_stoploss(t, price)]
+            crossed = [position['pseudo_account'] for position in index.crossed('SBIN-EQ', price)]
+            self.assertCountEqual(crossed, expected)
+
+    def test_sorted_stops_blocks_stay_ordered(self):
+        rng = random.Random(11)
+        stops = SortedStops(load=4)  # small blocks, so they split and empty out
+        entries = []
+        for i in range(300):
+            if entries and rng.random() < 0.4:
+                stop_loss, position = entries.pop(rng.randrange(len(entries)))
+                stops.remove(stop_loss, position)
+            else:
+                entry = (rng.choice([95.0, 100.0, round(rng.uniform(90, 110), 1)]), object())
+                stops.insert(*entry)
+                entries.append(entry)
+            price = rng.uniform(88, 112)
+            self.assertCountEqual(stops.from_stop(price), [p for stop_loss, p in entries if stop_loss >= price])
+            self.assertCountEqual(stops.up_to(price), [p for stop_loss, p in entries if stop_loss <= price])
+        self.assertEqual(len(stops), len(entries))
+
+    def test_remove_account_and_readd(self):
+        index = StopLossIndex()
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '1', 'BUY', 95)))
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '1', 'BUY', 95)))  # same trade again is not duplicated
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A2', '2', 'SELL', 105)))
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A3', '3', 'BUY', None)))  # no stop, never triggers
+        self.assertEqual(len(index), 2)
+        self.assertGreater(index.memory_footprint(), 0)
+
+        index.remove('SBIN-EQ', 'A1')
+        self.assertEqual(index.crossed('SBIN-EQ', 90), [])
+        index.remove('SBIN-EQ', 'A2')
+        self.assertEqual(index.symbols(), [])
+
+    def test_fills_merge_into_one_net_position_per_side(self):
+        index = StopLossIndex()
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '1', 'BUY', 95, quantity=10)))
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '2', 'BUY', 91, quantity=30)))
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '3', 'SELL', 110, quantity=5)))
+        self.assertEqual(len(index), 2)
+
+        long = index.position('SBIN-EQ', 'A1', 'BUY')
+        short = index.position('SBIN-EQ', 'A1', 'SELL')
+        self.assertEqual((long['quantity'], long['stoploss_price']), (40, 92))
+        self.assertEqual((short['quantity'], short['stoploss_price']), (5, 110))
+        self.assertEqual(index.crossed('SBIN-EQ', 92.5), [])
+        self.assertEqual(index.crossed('SBIN-EQ', 92), [long])
+        self.assertEqual(index.crossed('SBIN-EQ', 110), [short])  # the opposing stop still triggers
+
+        index.remove('SBIN-EQ', 'A1', '2')  # the stop moves to the remaining BUY fill
+        self.assertEqual((long['quantity'], long['stoploss_price']), (10, 95))
+        self.assertEqual(index.crossed('SBIN-EQ', 96), [])
+        index.remove('SBIN-EQ', 'A1', '1')
+        self.assertIsNone(index.position('SBIN-EQ', 'A1', 'BUY'))
+        self.assertEqual(index.crossed('SBIN-EQ', 90), [])
+        index.remove('SBIN-EQ', 'A1', '3')
+        self.assertIsNone(index.position('SBIN-EQ', 'A1', 'SELL'))
+        self.assertEqual(index.symbols(), [])
+
+    def test_stopless_side_does_not_hide_the_other(self):
+        index = StopLossIndex()
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '1', 'BUY', None, quantity=10)))
+        index.add('SBIN-EQ', OpenTrade.from_dict(make_trade('A1', '2', 'SELL', 105, quantity=4)))
+        self.assertEqual(index.symbols(), ['SBIN-EQ'])
+        self.assertEqual(index.crossed('SBIN-EQ', 105), [index.position('SBIN-EQ', 'A1', 'SELL')])
+        self.assertFalse(index.flat('SBIN-EQ', 'A1'))
+
+class TestTradeStore(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def exercise(self, make_store):
+        store = make_store()
+        store.load()
+        store.add('SBIN-EQ', [make_trade('A1', '1', 'BUY', 95), make_trade('A2', '2', 'BUY', 96)])
+        opened = store.add_many({  # one write for both symbols
+            'INFY-EQ': [make_trade('A1', '3', 'SELL', 1500)],
+            'SBIN-EQ': [make_trade('A2', '4', 'BUY', 97)],
+            'TCS-EQ': [],
+        })
+        self.assertEqual(sorted(opened), ['INFY-EQ', 'SBIN-EQ'])
+        self.assertEqual(store.open_count, 4)
+        store.remove('SBIN-EQ', 'A2', '4')  # only that order
+        store.remove('SBIN-EQ', 'A1')
+        store.remove('INFY-EQ', 'A1')
+        store.close()
+
+        replayed = make_store()
+        self.assertEqual(as_dicts(replayed.load()), {'SBIN-EQ': [make_trade('A2', '2', 'BUY', 96)]})
+        self.assertEqual(replayed.open_count, 1)
+        replayed.close()
+
+    def exercise_unidentified(self, make_store, write_legacy):
+        write_legacy({'pseudo_account': 'A1', 'trade_type': 'BUY', 'quantity': 5})  # opened before ids were assigned
+        store = make_store()
+        store.load()
+        store.add('SBIN-EQ', [make_trade('A1', None, 'BUY', 95), make_trade('A1', None, 'BUY', 96)])
+        order_ids = [trade.order_id for trade in store.trades['SBIN-EQ']]
+        self.assertNotIn(None, order_ids)
+        self.assertEqual(len(set(order_ids)), 3)
+        store.remove('SBIN-EQ', 'A1', order_ids[1])  # only that fill
+        store.close()
+
+        replayed = make_store()
+        self.assertEqual([trade.order_id for trade in replayed.load()['SBIN-EQ']], [order_ids[0], order_ids[2]])
+        replayed.close()
+
+    def test_trades_without_order_id_are_closed_on_their_own(self):
+        journal = self.path('trades.journal')
+
+        def write_journal(trade):
+            with open(journal, 'w') as f:
+                f.write(json.dumps({'op': 'open', 'symbol': 'SBIN-EQ', 'trade': trade}) + '\n')
+        self.exercise_unidentified(lambda: JournalTradeStore(journal), write_journal)
+
+        database = self.path('trades.db')
+
+        def write_row(trade):
+            store = SqliteTradeStore(database)
+            store._connect().execute("INSERT INTO open_trades (symbol, pseudo_account, trade) VALUES (?, ?, ?)",
+                                     ('SBIN-EQ', 'A1', json.dumps(trade)))
+            store._db.commit()
+            store.close()
+        self.exercise_unidentified(lambda: SqliteTradeStore(database), write_row)
+
+    def test_handoff_ids_are_stored_with_their_trades(self):
+        for make_store in (lambda: JournalTradeStore(self.path('trades.journal'), compact_ratio=2, compact_min_events=4),
+                           lambda: SqliteTradeStore(self.path('trades.db'))):
+            store = make_store()
+            store.load()
+            store.add_many({'SBIN-EQ': [make_trade('A1', '1', 'BUY', 95)]}, handoff='h1')
+            for i in range(5):  # closed again, and (journal) compacted away
+                store.add('INFY-EQ', [make_trade('A1', str(i), 'BUY', 95)])
+                store.remove('INFY-EQ', 'A1')
+            store.add_many({'INFY-EQ': [make_trade('A2', '9', 'BUY', 95)]}, handoff='h2')
+            store.flush().result(5)
+            self.assertEqual(list(store.handoffs), ['h1', 'h2'])
+            store.close()
+
+            replayed = make_store()
+            replayed.load()
+            self.assertEqual(list(replayed.handoffs), ['h1', 'h2'])
+            replayed.close()
+
+    def test_backends_implement_the_whole_interface(self):
+        with self.assertRaises(TypeError):
+            TradeStore()
+
+    def test_journal_store_replays_events(self):
+        self.exercise(lambda: JournalTradeStore(self.path('trades.journal')))
+
+    def test_sqlite_store_replays_events(self):
+        self.exercise(lambda: SqliteTradeStore(self.path('trades.db')))
+
+    def test_sqlite_store_commits_off_the_event_loop(self):
+        store = SqliteTradeStore(self.path('trades.db'))
+        store.load()
+        statements = []
+        store._connect().set_trace_callback(lambda sql: statements.append((threading.current_thread(), sql)))
+        store.add('SBIN-EQ', [make_trade('A1', '1', 'BUY', 95)])
+        store.remove('SBIN-EQ', 'A1', '1')
+        store.close()
+        writes = [thread for thread, sql in statements if sql.startswith(('INSERT', 'DELETE', 'COMMIT'))]
+        self.assertTrue(writes)
+        self.assertNotIn(threading.current_thread(), writes)
+
+    def test_journal_compacts_and_skips_torn_line(self):
+        store = JournalTradeStore(self.path('trades.journal'), compact_ratio=2, compact_min_events=4)
+        store.load()
+        fsync_threads = []
+        fsync = os.fsync
+
+        def record_fsync(fd):
+            fsync_threads.append(threading.current_thread())
+            fsync(fd)
+
+        with mock.patch('trade_store.os.fsync', record_fsync):
+            for i in range(10):
+                store.add('SBIN-EQ', [make_trade('A%d' % i, str(i), 'BUY', 95)])
+                store.remove('SBIN-EQ', 'A%d' % i)
+            store.add('SBIN-EQ', [make_trade('A1', '1', 'BUY', 95)])
+            store.close()
+        self.assertTrue(fsync_threads)
+        self.assertNotIn(threading.current_thread(), fsync_threads)  # compaction stays off the event loop
+
+        with open(self.path('trades.journal')) as f:
+            self.assertLessEqual(len(f.readlines()), 4)
+        with open(self.path('trades.journal'), 'a') as f:
+            f.write('{"op": "open", "sym')  # crash mid-append
+
+        replayed = JournalTradeStore(self.path('trades.journal'))
+        self.assertEqual(as_dicts(replayed.load()), {'SBIN-EQ': [make_trade('A1', '1', 'BUY', 95)]})
+
+    def test_records_share_strings_and_report_footprint(self):
+        store = JournalTradeStore(self.path('trades.journal'))
+        store.load()
+        trades = [
+            {'pseudo_account': 'ACC%d' % (i % 10), 'falcon_account': 'ID%d' % (i % 10), 'symbol': 'sbin-eq',
+             'order_id': 'O%d' % i, 'quantity': 10, 'price': 100.0, 'balance': 100000.0, 'trade_type': 'BUY',
+             'stoploss_price': 95.0 - i / 1000}
+            for i in range(1000)
+        ]
+        records = store.add('SBIN-EQ', trades)
+        self.assertIsInstance(records[0], OpenTrade)
+        self.assertIs(records[0].pseudo_account, records[10].pseudo_account)
+        self.assertEqual(records[5]['order_id'], 'O5')
+        self.assertEqual(records[5].to_dict(), trades[5])
+
+        # the dicts as the store used to hold them, decoded from disk, measured the same way
+        dict_bytes = footprint(json.loads(json.dumps(trades)))
+        # about 190 B vs 620 B per trade here (3.2x), with 10 accounts sharing their
+        # strings; with a different account on every trade it drops to about 2.1x
+        self.assertGreater(dict_bytes / store.memory_footprint(), 3)
+        store.close()
+
+class TestNetPositionExits(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        store = JournalTradeStore(os.path.join(self.tmpdir.name, 'trades.journal'))
+        store.load()
+        self.addCleanup(store.close)
+        mock.patch.object(rms, 'trade_store', store).start()
+        mock.patch.object(rms, 'stoploss_index', StopLossIndex()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_breach_exits_the_net_quantity_once(self):
+        released = None
+        trading_service = mock.Mock()
+
+        async def place_rms_order(trade_request):
+            await released.wait()
+            return {'status': True}
+        trading_service.place_rms_order = mock.AsyncMock(side_effect=place_rms_order)
+
+        def fill(order_id, quantity, stop):
+            return make_trade('A1', order_id, 'BUY', stop, quantity) | {'symbol': 'sbin-eq'}
+
+        async def scenario():
+            nonlocal released
+            released = asyncio.Event()
+            exits = ExitExecutor(trading_service, on_confirmed=rms.exit_confirmed)
+            rms.add_successful_trades({'SBIN-EQ': [fill('1', 10, 95), fill('2', 20, 96), fill('3', 10, 97)]})
+            rms.evaluate_stop_losses(exits, 'SBIN-EQ', 94)
+            rms.evaluate_stop_losses(exits, 'SBIN-EQ', 93)  # still exiting, not submitted again
+            rms.add_successful_trade('SBIN-EQ', [fill('4', 5, 90)])  # arrives mid-exit, stays open
+            released.set()
+            await exits.drain()
+
+        asyncio.run(scenario())
+        trading_service.place_rms_order.assert_awaited_once()
+        trade_request = trading_service.place_rms_order.await_args.args[0]
+        self.assertEqual((trade_request.tradeType, trade_request.quantity), ('SELL', 40))
+        self.assertEqual(as_dicts(rms.load_trade_data()), {'SBIN-EQ': [fill('4', 5, 90)]})
+        self.assertEqual(rms.stoploss_index.position('SBIN-EQ', 'A1', 'BUY')['quantity'], 5)
+
+    def test_flat_position_is_closed(self):
+        rms.add_successful_trades({'SBIN-EQ': [
+            make_trade('A1', '1', 'BUY', 95, quantity=10), make_trade('A2', '2', 'BUY', 95, quantity=10),
+        ]})
+        rms.add_successful_trade('SBIN-EQ', [make_trade('A1', '3', 'SELL', 105, quantity=6)])
+        rms.add_successful_trade('SBIN-EQ', [make_trade('A1', '4', 'SELL', None, quantity=4)])  # A1 is flat now
+
+        self.assertEqual(as_dicts(rms.load_trade_data()), {'SBIN-EQ': [make_trade('A2', '2', 'BUY', 95, quantity=10)]})
+        self.assertIsNone(rms.stoploss_index.position('SBIN-EQ', 'A1', 'BUY'))
+        self.assertIsNone(rms.stoploss_index.position('SBIN-EQ', 'A1', 'SELL'))
+        self.assertEqual(len(rms.stoploss_index), 1)
+
+    def test_opposing_stops_each_exit_their_side(self):
+        trading_service = mock.Mock()
+        trading_service.place_rms_order = mock.AsyncMock(return_value={'status': True})
+        long = make_trade('A1', '1', 'BUY', 95, quantity=10) | {'symbol': 'sbin-eq'}
+        short = make_trade('A1', '2', 'SELL', 110, quantity=4) | {'symbol': 'sbin-eq'}
+
+        async def scenario():
+            exits = ExitExecutor(trading_service, on_confirmed=rms.exit_confirmed)
+            rms.add_successful_trades({'SBIN-EQ': [long, short]})
+            rms.evaluate_stop_losses(exits, 'SBIN-EQ', 110)
+            await exits.drain()
+            self.assertEqual(as_dicts(rms.load_trade_data()), {'SBIN-EQ': [long]})
+            rms.evaluate_stop_losses(exits, 'SBIN-EQ', 94)
+            await exits.drain()
+
+        asyncio.run(scenario())
+        requests = [call.args[0] for call in trading_service.place_rms_order.await_args_list]
+        self.assertEqual([(r.tradeType, r.quantity) for r in requests], [('BUY', 4), ('SELL', 10)])
+        self.assertEqual(rms.load_trade_data(), {})
+        self.assertEqual(rms.stoploss_index.symbols(), [])
+
+class TestStreamStopLosses(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        store = JournalTradeStore(os.path.join(self.tmpdir.name, 'trades.journal'))
+        store.load()
+        self.addCleanup(store.close)
+        index = SymbolTokenIndex(filename='unused.json')
+        index._loaded = True
+        index._tokens = {'SBIN-EQ': '3045', 'INFY-EQ': '1594'}
+        mock.patch.object(rms, 'trade_store', store).start()
+        mock.patch.object(rms, 'stoploss_index', StopLossIndex()).start()
+        mock.patch.object(rms, 'token_index', index).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_ticks_drive_exits_and_subscriptions(self):
+        trading_service = mock.Mock()
+        trading_service.place_rms_order = mock.AsyncMock(return_value={'status': True})
+        feed = FakePriceFeed()
+
+        async def scenario():
+            exits = ExitExecutor(trading_service, on_confirmed=rms.exit_confirmed)
+            rms.add_successful_trade('SBIN-EQ', [make_trade('A1', '1', 'BUY', 95) | {'symbol': 'sbin-eq', 'quantity': 10}])
+            monitor = asyncio.create_task(rms.stream_stop_losses(exits, feed))
+            await asyncio.sleep(0)
+            self.assertEqual(feed.subscriptions, {('NSE', '3045')})
+
+            rms.add_successful_trade('INFY-EQ', [make_trade('A2', '2', 'SELL', 1500) | {'symbol': 'infy-eq', 'quantity': 5}])
+            await asyncio.sleep(0)
+            self.assertEqual(feed.subscriptions, {('NSE', '3045'), ('NSE', '1594')})
+
+            feed.push('NSE', '3045', 96)  # above the BUY stop, nothing happens
+            feed.push('NSE', '3045', 94)  # coalesced with the previous tick, triggers
+            await asyncio.sleep(0.01)
+            self.assertEqual(feed.subscriptions, {('NSE', '1594')})
+
+            feed.push('NSE', '1594', 1501)
+            await asyncio.wait_for(monitor, 1)  # returns once no trades are open
+
+        asyncio.run(scenario())
+        self.assertEqual(trading_service.place_rms_order.await_count, 2)
+        self.assertEqual(rms.load_trade_data(), {})
+
+    def test_symbols_without_a_token_are_subscribed_once_it_resolves(self):
+        feed = FakePriceFeed()
+        lookup = mock.AsyncMock(side_effect=[RuntimeError('session expired'), '11536'])
+
+        async def scenario():
+            rms.add_successful_trade('TCS-EQ', [make_trade('A1', '1', 'BUY', 3000) | {'symbol': 'tcs-eq'}])
+            monitor = asyncio.create_task(rms.stream_stop_losses(mock.Mock(), feed))
+            await asyncio.sleep(0.01)
+            self.assertEqual((feed.subscriptions, rms.unresolved_symbols), (set(), {'TCS-EQ'}))
+            await asyncio.sleep(0.1)  # the retry resolves it
+            self.assertEqual((feed.subscriptions, rms.unresolved_symbols), ({('NSE', '11536')}, set()))
+            feed.finish()
+            await asyncio.wait_for(monitor, 1)
+
+        with mock.patch.object(token_index, 'get_symbol_info', lookup), \
+                mock.patch.object(rms.token_index, '_write'), \
+                mock.patch.object(rms, 'RESOLVE_RETRY_SECONDS', 0.05):
+            asyncio.run(scenario())
+        self.assertEqual(lookup.await_count, 2)
+
+    def test_feed_liveness_counts_heartbeats_not_ticks(self):
+        feed = FakePriceFeed()
+        self.assertEqual(feed.silence(), math.inf)  # not started
+
+        async def scenario():
+            await feed.start()
+            with mock.patch('price_feed.time.monotonic', return_value=time.monotonic() + 20):
+                self.assertGreaterEqual(feed.silence(), 20)
+                feed.heard()  # a heartbeat, no ticks
+                self.assertEqual(feed.silence(), 0)
+            feed.close()
+            self.assertEqual(feed.silence(), math.inf)
+
+        asyncio.run(scenario())
+
+class TestExitExecutor(TestCase):
+    def test_exits_are_deduplicated_retried_and_confirmed(self):
+        trading_service = mock.Mock()
+        trading_service.place_rms_order = mock.AsyncMock(side_effect=[
+            {'status': False, 'message': 'throttled'},
+            {'status': True},
+            {'status': True},
+        ])
+        confirmed = []
+        trade1 = make_trade('A1', '1', 'BUY', 95)
+        trade2 = make_trade('A2', '2', 'BUY', 95)
+
+        async def scenario():
+            exits = ExitExecutor(trading_service, on_confirmed=lambda symbol, trade: confirmed.append(trade['order_id']),
+                                 base_delay=0.001)
+            self.assertTrue(exits.submit('SBIN-EQ', trade1, 'request-1'))
+            self.assertFalse(exits.submit('SBIN-EQ', trade1, 'request-1'))  # still in flight
+            self.assertTrue(exits.submit('SBIN-EQ', trade2, 'request-2'))
+            await exits.drain()
+            self.assertEqual(exits.in_flight, {})
+
+        asyncio.run(scenario())
+        self.assertEqual(trading_service.place_rms_order.await_count, 3)
+        self.assertCountEqual(confirmed, ['1', '2'])
+
+    def test_ambiguous_exits_are_checked_not_resent(self):
+        timed_out = {'status': False, 'message': 'Cannot connect to API: TimeoutError', 'ambiguous': True}
+        for found, placed, confirmed in [([True], 1, True), ([False], 2, True), ([None] * 3, 1, False)]:
+            trading_service = mock.Mock()
+            trading_service.place_rms_order = mock.AsyncMock(side_effect=[timed_out, {'status': True}])
+            trading_service.find_rms_order = mock.AsyncMock(side_effect=found)
+            on_confirmed = mock.Mock()
+
+            async def scenario():
+                exits = ExitExecutor(trading_service, on_confirmed=on_confirmed, base_delay=0.001, settle_delay=0.001)
+                exits.submit('SBIN-EQ', make_trade('A1', '1', 'BUY', 95), 'request')
+                await exits.drain()
+                return exits
+
+            exits = asyncio.run(scenario())
+            self.assertEqual(trading_service.place_rms_order.await_count, placed)
+            self.assertEqual(on_confirmed.called, confirmed)
+            self.assertEqual(bool(exits.in_doubt), not confirmed)
+
+    def test_parked_exit_is_checked_again_on_the_next_breach(self):
+        trading_service = mock.Mock()
+        trading_service.place_rms_order = mock.AsyncMock(return_value={'status': False, 'message': 'timeout', 'ambiguous': True})
+        trading_service.find_rms_order = mock.AsyncMock(side_effect=[None, None, None, True])
+        confirmed = []
+
+        async def scenario():
+            exits = ExitExecutor(trading_service, on_confirmed=lambda symbol, trade: confirmed.append(trade),
+                                 max_attempts=3, settle_delay=0.001)
+            trade = make_trade('A1', '1', 'BUY', 95)
+            exits.submit('SBIN-EQ', trade, 'request')
+            await exits.drain()
+            self.assertFalse(exits.is_exiting('SBIN-EQ', trade))  # parked: the next breach gets through...
+            exits.submit('SBIN-EQ', trade | {'quantity': 5}, 'resized request')
+            await exits.drain()
+            return trade
+
+        trade = asyncio.run(scenario())
+        trading_service.place_rms_order.assert_awaited_once_with('request')  # ...but only to check again
+        self.assertEqual(confirmed, [trade])
+
+    def test_backoff_does_not_hold_a_worker(self):
+        placed = []
+
+        async def place_rms_order(trade_request):
+            placed.append(trade_request)
+            return {'status': trade_request != 'failing'}
+
+        trading_service = mock.Mock()
+        trading_service.place_rms_order = mock.AsyncMock(side_effect=place_rms_order)
+
+        async def scenario():
+            exits = ExitExecutor(trading_service, on_confirmed=mock.Mock(), workers=1, max_attempts=2,
+                                 base_delay=10, max_delay=10)
+            with mock.patch('exit_executor.random.uniform', return_value=10):
+                exits.submit('SBIN-EQ', make_trade('A1', '1', 'BUY', 95), 'failing')
+                await asyncio.sleep(0)  # first attempt fails, backing off for 10s
+                exits.submit('SBIN-EQ', make_trade('A2', '2', 'BUY', 95), 'fresh')
+                await asyncio.wait_for(exits.in_flight[('2', 'A2', 'SBIN-EQ', 'BUY')], 1)
+            for task in exits.in_flight.values():
+                task.cancel()
+
+        asyncio.run(scenario())
+        self.assertEqual(placed, ['failing', 'fresh'])
+
+    def test_unconfirmed_exit_leaves_trade_open(self):
+        trading_service = mock.Mock()
+        trading_service.place_rms_order = mock.AsyncMock(return_value={'status': False, 'message': 'rejected'})
+        on_confirmed = mock.Mock()
+
+        async def scenario():
+            exits = ExitExecutor(trading_service, on_confirmed=on_confirmed, max_attempts=2, base_delay=0.001)
+            exits.submit('SBIN-EQ', make_trade('A1', '1', 'BUY', 95), 'request-1')
+            await exits.drain()
+
+        asyncio.run(scenario())
+        self.assertEqual(trading_service.place_rms_order.await_count, 2)
+        on_confirmed.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,42 +1,133 @@
+import asyncio
 import math
-from models import Account, TradeSignal
+import aiohttp
+from models import Account, TradeRequest, TradeSignal, TradeType
 from services import trading_service
+import main
 import unittest
-from unittest import TestCase
+from unittest import TestCase, mock
+
+def make_account(fund):
+    return Account(pseudoAccountName='A1', fund=fund, accountId='A1-id', stoplosstype='number', stoploss=1000)
+
+def make_signal(symbolname):
+    return TradeSignal(symbolname=symbolname, signal='buy', price=100, type=TradeType.option, strategyname='test')
 
 class TestTradingService(TestCase):
     def setUp(self):
-        self.trading_service = trading_service.TradingService()
+        self.trading_service = trading_service.TradingService(session=None)
 
     def test_lot_size_banknifty(self):
-        account = Account(fund=50000)
-        signal = TradeSignal(symbolname='banknifty')
-        expected_lot_size = math.ceil(account.fund / 25000 * 15)
-        self.assertEqual(self.trading_service.self.trading_service.get_predefined_option_lot_size(account, signal), expected_lot_size)
+        account = make_account(50000)
+        signal = make_signal('banknifty')
+        expected_lot_size = math.ceil(account.fund / 25000) * 15
+        self.assertEqual(self.trading_service.get_predefined_option_lot_size(account, signal), expected_lot_size)
 
     def test_lot_size_nifty(self):
-        account = Account(fund=50000)
-        signal = TradeSignal(symbolname='nifty')
-        expected_lot_size = math.ceil(account.fund / 33000 * 50)
+        account = make_account(50000)
+        signal = make_signal('nifty')
+        expected_lot_size = math.ceil(account.fund / 33000) * 50
         self.assertEqual(self.trading_service.get_predefined_option_lot_size(account, signal), expected_lot_size)
 
     def test_lot_size_finnifty(self):
-        account = Account(fund=50000)
-        signal = TradeSignal(symbolname='finnifty')
-        expected_lot_size = math.ceil(account.fund / 33000 * 40)
+        account = make_account(50000)
+        signal = make_signal('finnifty')
+        expected_lot_size = math.ceil(account.fund / 33000) * 40
         self.assertEqual(self.trading_service.get_predefined_option_lot_size(account, signal), expected_lot_size)
 
+    def test_option_quantities_are_whole_lots(self):
+        signal = make_signal('nifty')
+        for fund in (120000, 165001, 399999):
+            quantity = self.trading_service.get_predefined_option_lot_size(make_account(fund), signal)
+            self.assertEqual(quantity % 50, 0)
+            self.assertEqual(quantity, math.ceil(fund / 33000) * 50)
+
     def test_lot_size_unknown_symbol(self):
-        account = Account(fund=50000)
-        signal = TradeSignal(symbolname='unknown')
+        account = make_account(50000)
+        signal = make_signal('unknown')
         expected_lot_size = math.ceil(account.fund / 25000)
         self.assertEqual(self.trading_service.get_predefined_option_lot_size(account, signal), expected_lot_size)
 
     def test_lot_size_insufficient_balance(self):
-        account = Account(fund=10000)
-        signal = TradeSignal(symbolname='unknown')
-        expected_lot_size = 0
-        self.assertEqual(self.trading_service.get_predefined_option_lot_size(account, signal), expected_lot_size)
+        # accounts below the option margin floor are not sized at all
+        account = make_account(10000)
+        signal = make_signal('unknown')
+        quantities, stoploss_prices = self.trading_service.size_orders([account], signal)
+        self.assertEqual(quantities, [0])
+        self.assertEqual(stoploss_prices, [None])
+
+    def test_size_orders_matches_scalar_rules(self):
+        accounts = [
+            Account(pseudoAccountName=f'A{i}', fund=fund, accountId=f'A{i}-id', stoplosstype=stoplosstype, stoploss=stoploss)
+            for i, (fund, stoplosstype, stoploss) in enumerate([
+                (150000, 'number', 1000), (250000, 'percentage', 2), (1000000, 'number', 500), (120000, 'unknown', 1),
+            ])
+        ]
+        for symbolname, type, side in [('BANKNIFTY', TradeType.option, 'buy'), ('NIFTY', TradeType.option, 'sell'),
+                                       ('SBIN-EQ', TradeType.equity, 'buy'), ('INFY-EQ', TradeType.equity, 'sell')]:
+            signal = TradeSignal(symbolname=symbolname, signal=side, price=123.45, type=type, strategyname='test')
+            quantities, stoploss_prices = self.trading_service.size_orders(accounts, signal)
+            for account, quantity, stoploss_price in zip(accounts, quantities, stoploss_prices):
+                if type == TradeType.equity:
+                    expected = self.trading_service.calculate_lot_size(account, signal)
+                else:
+                    expected = self.trading_service.get_predefined_option_lot_size(account, signal)
+                self.assertEqual(quantity, expected)
+                trade_data = {'price': signal.price, 'quantity': expected, 'trade_type': signal.signal.upper()}
+                expected_stop = main.calculate_stop_loss_price(trade_data, account.stoplosstype, account.stoploss, account.fund)
+                if expected_stop is None:
+                    self.assertIsNone(stoploss_price)
+                else:
+                    self.assertAlmostEqual(stoploss_price, expected_stop)
+
+    def test_timed_out_orders_are_failures(self):
+        session = mock.Mock()
+        session.post.side_effect = asyncio.TimeoutError()  # what ClientTimeout raises
+        service = trading_service.TradingService(session)
+        account = make_account(50000)
+        trade_request = TradeRequest(pseudoAccount='A1', symbol='sbin-eq', tradeType='BUY', orderType='market',
+                                     productType='INTRADAY', quantity=10, price=100, triggerPrice=0)
+
+        with mock.patch.object(trading_service, 'broker_scheduler', mock.Mock(acquire=mock.AsyncMock())):
+            placed = asyncio.run(service.place_order(trade_request, account))
+            exited = asyncio.run(service.place_rms_order(trade_request))
+
+        self.assertEqual(placed, {'status': False, 'message': 'Cannot connect to API: TimeoutError'})
+        # the exit may have reached the broker, so the executor must not simply resend it
+        self.assertEqual(exited, {'status': False, 'message': 'Cannot connect to API: TimeoutError', 'ambiguous': True})
+
+    def test_exits_that_never_reached_the_broker_are_definite_failures(self):
+        session = mock.Mock()
+        session.post.side_effect = aiohttp.ClientConnectorError(mock.Mock(host='broker', port=443, ssl=True),
+                                                                OSError(111, 'Connection refused'))
+        service = trading_service.TradingService(session)
+        trade_request = TradeRequest(pseudoAccount='A1', symbol='sbin-eq', tradeType='SELL', orderType='market',
+                                     productType='INTRADAY', quantity=10, price=100, triggerPrice=0)
+
+        with mock.patch.object(trading_service, 'broker_scheduler', mock.Mock(acquire=mock.AsyncMock())):
+            exited = asyncio.run(service.place_rms_order(trade_request))
+        self.assertFalse(exited['ambiguous'])
+
+    def test_find_rms_order_matches_orders_since_the_attempt(self):
+        orders = [
+            {'symbol': 'SBIN-EQ', 'tradeType': 'SELL', 'quantity': 10, 'status': 'COMPLETE', 'platformTime': 999_000},
+            {'symbol': 'SBIN-EQ', 'tradeType': 'SELL', 'quantity': 10, 'status': 'REJECTED', 'platformTime': 1_001_000},
+        ]
+        response = mock.MagicMock()
+        response.__aenter__.return_value.json = mock.AsyncMock(side_effect=lambda **_: {'status': True, 'result': orders})
+        response.__aenter__.return_value.raise_for_status = mock.Mock()
+        session = mock.Mock()
+        session.get.return_value = response
+        service = trading_service.TradingService(session)
+        trade_request = TradeRequest(pseudoAccount='A1', symbol='sbin-eq', tradeType='SELL', orderType='market',
+                                     productType='INTRADAY', quantity=10, price=100, triggerPrice=0)
+
+        with mock.patch.object(trading_service, 'broker_scheduler', mock.Mock(acquire=mock.AsyncMock())):
+            self.assertFalse(asyncio.run(service.find_rms_order(trade_request, since=1000)))  # older, and rejected
+            orders.append({'symbol': 'SBIN-EQ', 'tradeType': 'SELL', 'quantity': 10, 'status': 'OPEN', 'platformTime': 1_000_500})
+            self.assertTrue(asyncio.run(service.find_rms_order(trade_request, since=1000)))
+            session.get.side_effect = aiohttp.ClientConnectionError()
+            self.assertIsNone(asyncio.run(service.find_rms_order(trade_request, since=1000)))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
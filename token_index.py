@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import time
+from logger import logger
+from utils import get_symbol_info
+from instrument_master import instruments
+
+TOKEN_FILE = "symbol_tokens.json"
+
+
+class SymbolTokenIndex:
+    """
+    Process-wide symbol -> token lookup served from memory.
+
+    The token file is read once; symbols resolved through searchScrip are added to
+    memory immediately and persisted in the background (temp file + rename), so
+    lookups on the monitor path never touch the disk. Symbols the broker does not
+    know are remembered for `negative_ttl` seconds to avoid repeating the search;
+    failed searches are not remembered.
+    NSE symbols listed in the instrument master are answered from its index and
+    never searched.
+    """
+
+    def __init__(self, filename: str = TOKEN_FILE, negative_ttl: float = 300, flush_delay: float = 1.0):
+        self.filename = filename
+        self.negative_ttl = negative_ttl
+        self.flush_delay = flush_delay
+        self._tokens: dict[str, str] = {}
+        self._misses: dict[str, float] = {}  # symbol -> monotonic expiry
+        self._loaded = False
+        self._resolving: dict[str, asyncio.Task] = {}  # symbol -> the searchScrip every concurrent miss awaits
+        self._version = 0  # bumped by every set(); flushes write until the file has caught up
+        self._flushed_version = 0
+        self._flush_task = None
+        self._flush_now = None
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as file:
+                self._tokens = {symbol: str(token) for symbol, token in json.load(file).items()}
+        except FileNotFoundError:
+            self._tokens = {}
+        except ValueError as e:
+            logger.exception("Could not parse %s, starting with an empty token index:", self.filename, exc_info=e)
+            self._tokens = {}
+        self._loaded = True
+
+    def get(self, symbol: str):
+        if not self._loaded:
+            self.load()
+        token = self._tokens.get(symbol)
+        if token is None:
+            instrument = instruments.get(symbol, 'NSE')
+            if instrument is not None:
+                return instrument.token
+        return token
+
+    def set(self, symbol: str, token):
+        if not self._loaded:
+            self.load()
+        self._tokens[symbol] = str(token)
+        self._misses.pop(symbol, None)
+        self._version += 1
+        self.schedule_flush()
+
+    def is_known_missing(self, symbol: str) -> bool:
+        expiry = self._misses.get(symbol)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del self._misses[symbol]
+            return False
+        return True
+
+    async def resolve(self, symbol: str):
+        """Returns the token for `symbol`, asking the broker only on a cold miss."""
+        token = self.get(symbol)
+        if token or self.is_known_missing(symbol):
+            return token
+
+        task = self._resolving.get(symbol)
+        if task is None:
+            # concurrent misses on the same symbol share one searchScrip
+            task = self._resolving[symbol] = asyncio.ensure_future(self._search(symbol))
+            task.add_done_callback(lambda task: self._resolving.pop(symbol, None))
+        return await asyncio.shield(task)
+
+    async def _search(self, symbol: str):
+        try:
+            token = await get_symbol_info(symbol)
+        except Exception as e:
+            # not cached: the symbol may well exist, the next lookup asks again
+            logger.warning("Could not resolve the token of %s: %s", symbol, e)
+            return None
+        if token:
+            self.set(symbol, token)
+            return str(token)
+        self._misses[symbol] = time.monotonic() + self.negative_ttl
+        return None
+
+    def schedule_flush(self):
+        if self._flush_task and not self._flush_task.done():
+            return  # the pending flush writes until it has caught up with this entry too
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(dict(self._tokens))  # no event loop, persist synchronously
+            self._flushed_version = self._version
+            return
+        self._flush_now = asyncio.Event()
+        self._flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        try:
+            # coalesce bursts of new symbols into one write; close() cuts the wait short
+            await asyncio.wait_for(self._flush_now.wait(), self.flush_delay)
+        except asyncio.TimeoutError:
+            pass
+        await self.flush()
+
+    async def flush(self):
+        # entries set while a snapshot is being written get another write
+        while self._flushed_version != self._version:
+            version = self._version
+            try:
+                await asyncio.to_thread(self._write, dict(self._tokens))
+            except Exception as e:
+                logger.exception("An error occurred while saving %s:", self.filename, exc_info=e)
+                return
+            self._flushed_version = version
+
+    async def close(self):
+        """Writes out any entries still waiting for the delayed flush."""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_now.set()
+            await self._flush_task  # not cancelled: a write may be in progress in its thread
+        else:
+            await self.flush()
+
+    def _write(self, data):
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, 'w') as file:
+            json.dump(data, file, indent=4)
+        os.replace(tmp_filename, self.filename)
+
+
+token_index = SymbolTokenIndex()
@@ -0,0 +1,390 @@
+import concurrent.futures
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import uuid
+import metrics
+from abc import ABC, abstractmethod
+from typing import Dict, List
+from logger import logger
+from open_trade import OpenTrade, footprint
+
+LEGACY_TRADE_FILE = "trades.json"
+HANDOFF_IDS = 10000  # ids of the latest hand-off batches kept, see TradeStore.handoffs
+
+
+def matches(trade: OpenTrade, pseudo_account, order_id=None):
+    return trade.pseudo_account == pseudo_account and (order_id is None or trade.order_id == order_id)
+
+
+def assign_order_id(trade: OpenTrade) -> bool:
+    """Gives a trade the broker returned no order id for a local one, so it can be closed on its own."""
+    if trade.order_id is not None:
+        return False
+    trade.order_id = f'local-{uuid.uuid4().hex}'
+    return True
+
+
+class TradeStore(ABC):
+    """
+    Open trades grouped by symbol, kept in memory and persisted per change.
+
+    Backends only persist open/close events; `trades` is always the live
+    in-memory view of OpenTrade records, so reading open trades never touches
+    the disk. Writing does not either: backends hand their writes to a writer
+    thread (`_submit`), which applies them in order while the event loop moves
+    on, and close() waits until everything handed over is written.
+
+    Trades handed over by another worker (see monitor_leader) are stored with
+    the id of their hand-off, and `handoffs` keeps the latest ids across
+    restarts, so a new leader can tell a batch that was already stored.
+    """
+
+    def __init__(self):
+        self.trades: Dict[str, List[OpenTrade]] = {}
+        self.open_count = 0
+        self.handoffs: Dict[str, None] = {}  # oldest first
+        self._writes = queue.SimpleQueue()
+        self._writer = None
+
+    @abstractmethod
+    def load(self) -> Dict[str, List[OpenTrade]]:
+        """Restores the open trades from disk. Called once on boot."""
+
+    def add(self, symbol: str, trades: List[Dict]) -> List[OpenTrade]:
+        """Opens the trades (dicts or OpenTrade records) on `symbol` and returns them as records."""
+        return self.add_many({symbol: trades}).get(symbol, [])
+
+    def add_many(self, trades_by_symbol: Dict[str, List[Dict]], handoff: str = None) -> Dict[str, List[OpenTrade]]:
+        """Opens trades on several symbols with a single write, recording `handoff` with them. Returns the records by symbol."""
+        opened = {}
+        for symbol, trades in trades_by_symbol.items():
+            trades = [OpenTrade.from_dict(trade) for trade in trades]
+            for trade in trades:
+                assign_order_id(trade)
+            if trades:
+                opened[symbol] = trades
+                self.trades.setdefault(symbol, []).extend(trades)
+                self.open_count += len(trades)
+        if opened:
+            if handoff is not None:
+                self._remember(handoff)
+            with metrics.TRADE_STORE_OPEN_SECONDS.time():
+                self._persist_open(opened, handoff)
+        return opened
+
+    def remove(self, symbol: str, pseudo_account: str, order_id=None):
+        """Closes the account's trade `order_id` on `symbol`, or all of its trades there if no order id is given."""
+        if symbol not in self.trades:
+            return
+        remaining = [trade for trade in self.trades[symbol] if not matches(trade, pseudo_account, order_id)]
+        removed = len(self.trades[symbol]) - len(remaining)
+        if not removed:
+            return
+        self.open_count -= removed
+        if remaining:
+            self.trades[symbol] = remaining
+        else:  # Remove the symbol if no trades left
+            del self.trades[symbol]
+        with metrics.TRADE_STORE_CLOSE_SECONDS.time():
+            self._persist_close(symbol, pseudo_account, order_id)
+
+    def flush(self) -> concurrent.futures.Future:
+        """A future that resolves once every write submitted so far is on disk."""
+        done = concurrent.futures.Future()
+        if self._writer is None:
+            done.set_result(None)  # nothing was ever submitted
+        else:
+            self._submit(self._flush, done)
+        return done
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the open trades in memory."""
+        return footprint(self.trades)
+
+    def _remember(self, handoff: str):
+        self.handoffs[handoff] = None
+        if len(self.handoffs) > HANDOFF_IDS:
+            del self.handoffs[next(iter(self.handoffs))]
+
+    def close(self):
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+
+    @abstractmethod
+    def _persist_open(self, opened: Dict[str, List[OpenTrade]], handoff: str = None):
+        ...
+
+    @abstractmethod
+    def _persist_close(self, symbol: str, pseudo_account: str, order_id=None):
+        ...
+
+    def _import_legacy(self, filename=LEGACY_TRADE_FILE):
+        """
+        Returns the trades of a trades.json written by the old full-rewrite storage, or {}.
+        The file is renamed afterwards so it is imported only once.
+        """
+        try:
+            with open(filename, 'r') as f:
+                trades = json.load(f)
+        except FileNotFoundError:
+            return {}
+        os.replace(filename, filename + ".imported")
+        logger.warning("Imported open trades from %s", filename)
+        return {symbol: [OpenTrade.from_dict(trade) for trade in symbol_trades] for symbol, symbol_trades in trades.items()}
+
+    # -- writer thread --
+
+    def _submit(self, write, payload):
+        """Runs `write(payload)` on the writer thread, after every write submitted before it."""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name='trade-store-writer', daemon=True)
+            self._writer.start()
+        self._writes.put((write, payload))
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+            write, payload = item
+            try:
+                write(payload)
+            except Exception as e:
+                logger.exception("An error occurred writing open trades:", exc_info=e)
+        self._writer_stopped()
+
+    def _flush(self, done: concurrent.futures.Future):
+        try:
+            self._sync()
+        except Exception as e:
+            done.set_exception(e)
+        else:
+            done.set_result(None)
+
+    def _sync(self):
+        """Called on the writer thread: makes the writes so far durable."""
+
+    def _writer_stopped(self):
+        """Called on the writer thread as it exits; releases what the writes held open."""
+
+
+class JournalTradeStore(TradeStore):
+    """
+    Append-only journal of open/close events, one JSON object per line.
+
+    Each change appends a single line, so writes cost O(1) regardless of how many
+    trades are open. Once the journal holds more than `compact_ratio` times as
+    many events as there are open trades, it is rewritten as a snapshot of the
+    open trades (temp file + rename + fsync).
+
+    The file is only touched by the writer thread: the event loop hands it
+    events and snapshots in order and moves on, so neither appends nor a
+    compaction of a large book stall tick processing.
+    """
+
+    def __init__(self, filename="trades.journal", compact_ratio: float = 4, compact_min_events: int = 1000):
+        super().__init__()
+        self.filename = filename
+        self.compact_ratio = compact_ratio
+        self.compact_min_events = compact_min_events
+        self._events = 0
+        self._file = None  # owned by the writer thread
+
+    def load(self):
+        self.trades = {}
+        self._events = 0
+        try:
+            with open(self.filename, 'r') as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append leaves at most one torn line at the end
+                        logger.warning("Skipping unreadable line %d in %s", line_number, self.filename)
+                        continue
+                    self._apply(event)
+                    if event['op'] != 'handoff':  # snapshots list the latest hand-off ids on their own
+                        self._events += 1
+        except FileNotFoundError:
+            self.trades = self._import_legacy()
+
+        self.open_count = sum(len(trades) for trades in self.trades.values())
+        # trades opened before ids were assigned get theirs now; the compaction persists them
+        unidentified = sum(assign_order_id(trade) for trades in self.trades.values() for trade in trades)
+        if unidentified or self._events != self.open_count:
+            self._compact()
+        return self.trades
+
+    def _apply(self, event):
+        if event['op'] == 'handoff':
+            self._remember(event['id'])
+            return
+        symbol = event['symbol']
+        if event['op'] == 'open':
+            self.trades.setdefault(sys.intern(symbol), []).append(OpenTrade.from_dict(event['trade']))
+            if 'handoff' in event:
+                self._remember(event['handoff'])
+        elif event['op'] == 'close' and symbol in self.trades:
+            self.trades[symbol] = [
+                trade for trade in self.trades[symbol]
+                if not matches(trade, event['pseudo_account'], event.get('order_id'))
+            ]
+            if not self.trades[symbol]:
+                del self.trades[symbol]
+
+    def _persist_open(self, opened, handoff=None):
+        # the id goes on every open event, so it lands in the same line as the trades whatever a crash cuts off
+        extra = {'handoff': handoff} if handoff is not None else {}
+        self._append([
+            {'op': 'open', 'symbol': symbol, 'trade': trade.to_dict(), **extra}
+            for symbol, trades in opened.items() for trade in trades
+        ])
+
+    def _persist_close(self, symbol, pseudo_account, order_id=None):
+        event = {'op': 'close', 'symbol': symbol, 'pseudo_account': pseudo_account}
+        if order_id is not None:
+            event['order_id'] = order_id
+        self._append([event])
+
+    def _append(self, events):
+        self._submit(self._write_events, events)
+        self._events += len(events)
+        if self._events > max(self.compact_min_events, self.compact_ratio * self.open_count):
+            self._compact()
+
+    def _compact(self):
+        """Rewrites the journal as one open event per live trade."""
+        # the lists are copied here, in order with the events; serialising and writing happen on the writer
+        snapshot = list(self.handoffs), [(symbol, list(trades)) for symbol, trades in self.trades.items()]
+        self._submit(self._write_snapshot, snapshot)
+        self._events = self.open_count
+
+    def _sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def _writer_stopped(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_events(self, events):
+        if self._file is None:
+            self._file = open(self.filename, 'a')
+        self._file.write(''.join(json.dumps(event) + '\n' for event in events))
+        self._file.flush()
+
+    def _write_snapshot(self, snapshot):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        handoffs, trades_by_symbol = snapshot
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            f.writelines(json.dumps({'op': 'handoff', 'id': handoff}) + '\n' for handoff in handoffs)
+            for symbol, trades in trades_by_symbol:
+                for trade in trades:
+                    f.write(json.dumps({'op': 'open', 'symbol': symbol, 'trade': trade.to_dict()}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+
+
+class SqliteTradeStore(TradeStore):
+    """
+    Open trades in a SQLite table in WAL mode; each open/close is one small
+    transaction, committed on the writer thread.
+    """
+
+    def __init__(self, filename="trades.db"):
+        super().__init__()
+        self.filename = filename
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)  # load, then the writer only
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS open_trades ("
+                "id INTEGER PRIMARY KEY, symbol TEXT NOT NULL, pseudo_account TEXT NOT NULL, trade TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS open_trades_symbol_account ON open_trades (symbol, pseudo_account)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS handoffs (id TEXT PRIMARY KEY)")
+        return self._db
+
+    def load(self):
+        db = self._connect()
+        self.trades = {}
+        unidentified = []
+        for row_id, symbol, trade in db.execute("SELECT id, symbol, trade FROM open_trades ORDER BY id"):
+            trade = OpenTrade.from_dict(json.loads(trade))
+            if assign_order_id(trade):  # opened before ids were assigned
+                unidentified.append((json.dumps(trade.to_dict()), row_id))
+            self.trades.setdefault(sys.intern(symbol), []).append(trade)
+        if unidentified:
+            with db:
+                db.executemany("UPDATE open_trades SET trade = ? WHERE id = ?", unidentified)
+        self.open_count = sum(len(trades) for trades in self.trades.values())
+        for handoff, in db.execute("SELECT id FROM handoffs ORDER BY rowid DESC LIMIT ?", (HANDOFF_IDS,)).fetchall()[::-1]:
+            self._remember(handoff)
+
+        self.add_many(self._import_legacy())
+        return self.trades
+
+    def _persist_open(self, opened, handoff=None):
+        rows = [(symbol, trade.pseudo_account, trade.to_dict()) for symbol, trades in opened.items() for trade in trades]
+        self._submit(self._insert, (rows, handoff))
+
+    def _persist_close(self, symbol, pseudo_account, order_id=None):
+        self._submit(self._delete, (symbol, pseudo_account, order_id))
+
+    def _insert(self, opened):
+        rows, handoff = opened
+        db = self._connect()
+        with db:  # the trades and their hand-off id commit together
+            db.executemany(
+                "INSERT INTO open_trades (symbol, pseudo_account, trade) VALUES (?, ?, ?)",
+                [(symbol, pseudo_account, json.dumps(trade)) for symbol, pseudo_account, trade in rows]
+            )
+            if handoff is not None:
+                rowid = db.execute("INSERT OR IGNORE INTO handoffs (id) VALUES (?)", (handoff,)).lastrowid
+                db.execute("DELETE FROM handoffs WHERE rowid <= ?", (rowid - HANDOFF_IDS,))
+
+    def _delete(self, close):
+        symbol, pseudo_account, order_id = close
+        db = self._connect()
+        with db:
+            if order_id is None:
+                db.execute("DELETE FROM open_trades WHERE symbol = ? AND pseudo_account = ?", (symbol, pseudo_account))
+            else:
+                db.execute(
+                    "DELETE FROM open_trades WHERE symbol = ? AND pseudo_account = ? AND json_extract(trade, '$.order_id') = ?",
+                    (symbol, pseudo_account, order_id)
+                )
+
+    def close(self):
+        super().close()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def create_trade_store(backend: str = "journal", filename: str = None) -> TradeStore:
+    if backend == "journal":
+        return JournalTradeStore(filename or "trades.journal")
+    if backend == "sqlite":
+        return SqliteTradeStore(filename or "trades.db")
+    raise ValueError(f"Unknown trade store backend: {backend}")
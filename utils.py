@@ -1,97 +1,132 @@
+import asyncio
+from functools import lru_cache
 import pyotp
-from SmartApi.smartConnect import SmartConnect
+import metrics
 from logger import logger
+from broker_session import BrokerSession
+from rate_limiter import BrokerScheduler, Priority, QUOTES, SEARCH
 from models import Settings
 
+@lru_cache(maxsize=None)
 def setting():
+    """Settings are read from the environment and .env once; call setting.cache_clear() to re-read them."""
     return Settings()
 
-smartapikey = setting().smart_api_key
-smartApi = SmartConnect(smartapikey)
+smartApi = None  # SmartConnect client, created on first use by get_smart_api()
 
-user_data = {}
+MAX_QUOTE_TOKENS = 50  # getMarketData accepts at most 50 tokens per request
 
-def login_user():
+def get_smart_api():
+    # Deferred: importing SmartApi is slow and SmartConnect() looks up the public IP over the network
+    global smartApi
+    if smartApi is None:
+        from SmartApi.smartConnect import SmartConnect
+        config = setting()
+        smartApi = SmartConnect(config.smart_api_key, root=config.smart_api_root or None)
+    return smartApi
+
+
+def generate_session():
     smartapiuser = setting().smart_api_user
     smartapipass = setting().smart_api_pass
     totp_secret = setting().totp_key
     totp = pyotp.TOTP(totp_secret).now()
 
-    user = smartApi.generateSession(smartapiuser, smartapipass, totp)
+    return get_smart_api().generateSession(smartapiuser, smartapipass, totp)
+
+
+def generate_token(refresh_token):
+    return get_smart_api().generateToken(refresh_token)
+
+
+# Both read their settings on first use, not at import
+broker_session = BrokerSession(generate_session, generate_token, settings=setting)
+user_data = broker_session.user_data  # status, jwtToken, refreshToken, feedToken of the live session
 
-    if user['status']:
-        user_data['status'] = True
-        user_data['refreshToken'] = user['data']['refreshToken']
-        return True
-    return False
+# per-endpoint rate limits and priorities for every outbound broker call
+broker_scheduler = BrokerScheduler(settings=setting)
+
+
+def login_user():
+    return broker_session.renew(broker_session.generation, force_login=True)
 
 
 def refresh_auth():
-    try:
-        if 'refreshToken' in user_data:  # Check for 'refreshToken' key
-            rtoken = user_data['refreshToken']
-            user = smartApi.generateToken(rtoken)
-
-            if 'data' in user and 'jwtToken' in user['data']:  # Check for 'data' and 'jwtToken'
-                return True
-        elif 'refreshToken' not in user_data:  # Check for 'refreshToken' key
-            return login_user()
-        if user.get("errorcode") in ["AB8050", "AB8051", "AB1011"]: 
-            attempt = login_user()
-            if attempt:
-                return True
-    except Exception as e:
-        logger.exception("An error occurred during refresh_auth:", exc_info=e)
-        return False
-        
+    return broker_session.renew(broker_session.generation)
 
 
 async def get_symbol_info(symbol):
+    """
+    Returns the NSE token of `symbol`, or None when searchScrip has no such symbol.
+
+    Failed searches (network, session, or an error status from the broker) raise
+    instead, so callers can tell "not listed" from "could not ask".
+    """
+    await broker_scheduler.acquire(SEARCH, Priority.LOOKUP)
+    with metrics.GET_SYMBOL_INFO_SECONDS.time():
+        searchScripData = await asyncio.to_thread(broker_session.call, get_smart_api().searchScrip, "NSE", symbol)
+
+    if not searchScripData or not searchScripData.get('status'):
+        message = searchScripData.get('message') if searchScripData else 'no response'
+        raise RuntimeError(f"searchScrip failed for {symbol}: {message}")
+    symbols = searchScripData.get('data') or []  # Default to an empty list
+    for sym in symbols:
+        if sym.get('tradingsymbol') == symbol:
+            return sym.get('symboltoken')
+    return None
+
+
+def fetch_price(token, exchange="NSE"):
+    prices = fetch_prices({exchange: [token]})
+    return prices.get((exchange, token))
+
+
+def fetch_prices(exchange_tokens):
+    """
+    Fetches the LTP of many instruments with as few getMarketData calls as possible.
+
+    Args:
+        exchange_tokens (dict): Mapping of exchange to a list of symbol tokens, e.g. {"NSE": ["3045", "1594"]}.
+
+    Returns:
+        dict: (exchange, token) -> ltp for every token the broker returned a price for.
+    """
+    prices = {}
+    for chunk in quote_chunks(exchange_tokens):
+        prices.update(fetch_price_chunk(chunk))
+    return prices
+
+
+async def fetch_prices_scheduled(exchange_tokens, priority: Priority = Priority.QUOTE):
+    """fetch_prices for callers on the event loop: each getMarketData call waits its turn with the scheduler."""
+    async def fetch(chunk):
+        await broker_scheduler.acquire(QUOTES, priority)
+        return await asyncio.to_thread(fetch_price_chunk, chunk)
+
+    prices = {}
+    for chunk_prices in await asyncio.gather(*(fetch(chunk) for chunk in quote_chunks(exchange_tokens))):
+        prices.update(chunk_prices)
+    return prices
+
+
+def quote_chunks(exchange_tokens):
+    """Splits {exchange: [tokens]} into requests of at most MAX_QUOTE_TOKENS tokens."""
+    pairs = [(exchange, str(token)) for exchange, tokens in exchange_tokens.items() for token in tokens]
+    for i in range(0, len(pairs), MAX_QUOTE_TOKENS):
+        chunk = {}
+        for exchange, token in pairs[i:i + MAX_QUOTE_TOKENS]:
+            chunk.setdefault(exchange, []).append(token)
+        yield chunk
+
+
+def fetch_price_chunk(exchange_tokens):
     try:
-        status = user_data.get('status', False)
-        if not status:
-            login_user()
-
-        symbol_token = None
-
-        searchScripData = smartApi.searchScrip("NSE", symbol)
-
-        if searchScripData.get('status'):  # Safely check 'status'
-            symbols = searchScripData.get('data', [])  # Default to an empty list
-            for sym in symbols:
-                if sym.get('tradingsymbol') == symbol: 
-                    symbol_token = sym.get('symboltoken')      
-        if searchScripData.get('errorcode') in ["AG8001", "AG8002", "AG8003"]:
-            refresh_auth()
-            get_symbol_info(symbol)
-        if searchScripData.get("errorcode") in ["AB8050", "AB8051", "AB1011"]: 
-            login_user()
-            get_symbol_info(symbol)
-
-        if symbol_token:
-            return symbol_token
-        return None
-    except Exception as e:
-        logger.exception("An error occurred during get_symbol_info:", exc_info=e)
+        with metrics.FETCH_PRICE_SECONDS.time():
+            marketData = broker_session.call(get_smart_api().getMarketData, "LTP", exchange_tokens)
 
-            
-def fetch_price(token):
-    try:
-        mode="LTP"
-        exchangeTokens= {
-        "NSE": [
-                token
-            ]
-        }
-        marketData=smartApi.getMarketData(mode, exchangeTokens)
-
-        if 'status' in marketData:  # Check for 'status' key first
-            if marketData['status']:
-                if 'data' in marketData and 'fetched' in marketData['data'] and marketData['data']['fetched']:
-                    return marketData['data']['fetched'][0]['ltp']  
-        elif 'errorcode' in marketData and marketData['errorcode'] in ["AG8001", "AG8002", "AG8003"]:
-            refresh_auth()
-            fetch_price(token)
+        if marketData and marketData.get('status'):
+            fetched = (marketData.get('data') or {}).get('fetched') or []
+            return {(quote['exchange'], str(quote['symbolToken'])): quote['ltp'] for quote in fetched}
     except Exception as e:
         logger.exception("An error occurred during fetch_price:", exc_info=e)
-        return None
\ No newline at end of file
+    return {}